@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+import argparse
+import importlib.util
+import json
+import logging
+import multiprocessing
+import pathlib
+import platform
+import resource
+import subprocess
+import sys
+import time
+from synthetic import repo_dir, scripts_dir, generate
+
+logging.basicConfig(level=logging.INFO)
+
+_parent_dir = pathlib.Path(__file__).resolve().parent
+_default_data = _parent_dir / "data"
+strategies = ["row", "bulk", "pipeline"]
+
+
+def with_args(f):
+    def with_args_(*args, **kwargs):
+        ap = argparse.ArgumentParser(description="Timing and memory benchmark for the database loaders.")
+        ap.add_argument("-r", "--readings", type=int, nargs="+", help="Sizes of the synthetic readings files to load.", default=[10000, 100000, 1000000])
+        ap.add_argument("-m", "--measures", type=int, help="Number of synthetic measures.", default=106)
+        ap.add_argument("-l", "--locations", type=int, help="Number of made up sensor locations, the real ones when not given.", default=None)
+        ap.add_argument("-S", "--strategies", type=str, nargs="+", choices=strategies, help="Load strategies to compare.", default=strategies)
+        ap.add_argument("-R", "--max-row-readings", type=int, help="Largest file loaded a row at a time, since that strategy is slow.", default=1000000)
+        ap.add_argument("-b", "--batch-size", type=int, help="Number of readings per insert batch for bulk and pipeline.", default=50000)
+        ap.add_argument("-j", "--jobs", type=int, help="Number of parser processes for pipeline, all cores when 0.", default=0)
+        ap.add_argument("-d", "--data-dir", type=str, help="Where the synthetic files and databases are written.", default=str(_default_data))
+        ap.add_argument("-s", "--seed", type=int, help="Seed for the synthetic data.", default=0)
+        ap.add_argument("-o", "--output", type=str, help="Write the results as JSON here instead of to stdout.", default=None)
+        return f(ap.parse_args(), *args, **kwargs)
+    return with_args_
+
+
+def _script(name):
+    # the loader scripts have dashes in their names, so they are loaded by path
+    spec = importlib.util.spec_from_file_location(name.replace("-", "_"), str(scripts_dir / f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _peak_mb(who=resource.RUSAGE_SELF):
+    # linux carries ru_maxrss over an exec, so the spawned loader would report the peak of the process that started
+    # it. its own high water mark is read from /proc instead, where there is one. both are in KiB.
+    if who == resource.RUSAGE_SELF:
+        try:
+            for line in pathlib.Path("/proc/self/status").read_text().splitlines():
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+        except OSError:
+            pass
+    return round(resource.getrusage(who).ru_maxrss / 1024, 1)
+
+
+def load(raw_dir, database, strategy, batch_size, jobs, results):
+    # runs in a process of its own, so its peak memory is the peak of this one load
+    sys.path.insert(0, str(scripts_dir))
+    from sqlalchemy.orm import sessionmaker
+    from models import Base
+    from loader import (
+        sqlite_engine, units_and_chemicals, location_types_and_waste, read_coordinates, bulk_insert_readings,
+        bump_data_version
+    )
+    from loader.pipeline import pipeline_insert_readings
+    from loader.rollups import refresh_rollups
+
+    db_init, db_load = _script("db-init"), _script("db-load")
+    logging.getLogger().setLevel(logging.WARNING)  # the loaders log every dimension row they add
+    stages, memory = {}, {}
+
+    def timed(name, f):
+        start = time.perf_counter()
+        value = f()
+        stages[name] = round(time.perf_counter() - start, 3)
+        memory[name] = _peak_mb()
+        return value
+
+    engine = sqlite_engine(database)
+    timed("schema", lambda: (Base.metadata.create_all(bind=engine), db_init.create_views(engine)))
+    session = sessionmaker(bind=engine)()
+
+    coordinates = read_coordinates(raw_dir / "location-coordinates.json")
+
+    def dimensions():
+        units_and_chemicals(session, raw_dir / "units-of-measure.csv")
+        lt_sensor = location_types_and_waste(session, coordinates)
+        session.commit()
+        return lt_sensor
+
+    lt_sensor = timed("dimensions", dimensions)
+
+    def readings():
+        path = raw_dir / "waterway-readings.csv"
+        if strategy == "pipeline":
+            _, count = pipeline_insert_readings(
+                session, path, lt_sensor, coordinates, batch_size, workers=jobs or None
+            )
+        elif strategy == "bulk":
+            _, count = bulk_insert_readings(session, path, lt_sensor, coordinates, batch_size)
+        else:
+            count = db_load.locations_and_readings(session, path, lt_sensor, coordinates)
+        session.commit()
+        return count
+
+    count = timed("readings", readings)
+
+    def rollups():
+        refresh_rollups(session)
+        bump_data_version(session)
+        session.commit()
+
+    timed("rollups", rollups)
+    session.close()
+
+    results.put({
+        "readings_loaded": count,
+        "stages_s": stages,
+        "rows_per_s": round(count / stages["readings"]) if stages["readings"] else None,
+        "peak_rss_mb": memory,
+        "children_peak_rss_mb": _peak_mb(resource.RUSAGE_CHILDREN),
+    })
+
+
+def run(raw_dir, database, strategy, cmd_line):
+    for path in (database, pathlib.Path(f"{database}-wal"), pathlib.Path(f"{database}-shm")):
+        if path.exists():
+            path.unlink()
+    # spawned rather than forked, so nothing this process has imported or allocated counts against the load, and
+    # not a pool worker, since the pipeline strategy starts processes of its own
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(
+        target=load, args=(raw_dir, str(database), strategy, cmd_line.batch_size, cmd_line.jobs, results)
+    )
+    process.start()
+    result = results.get()
+    process.join()
+    result["database_mb"] = round(database.stat().st_size / 1024 / 1024, 1)
+    database.unlink()
+    return result
+
+
+@with_args
+def main(cmd_line):
+    data_dir = pathlib.Path(cmd_line.data_dir)
+    results = []
+    for size in cmd_line.readings:
+        raw_dir = data_dir / f"raw-{size}-{cmd_line.measures}-{cmd_line.locations or 'real'}-{cmd_line.seed}"
+        generated = None
+        if not (raw_dir / "waterway-readings.csv").exists():
+            start = time.perf_counter()
+            generate(raw_dir, size, cmd_line.measures, cmd_line.locations, cmd_line.seed)
+            generated = round(time.perf_counter() - start, 3)
+            logging.info(f"{size} readings generated in {generated}s.")
+
+        for strategy in cmd_line.strategies:
+            if strategy == "row" and size > cmd_line.max_row_readings:
+                logging.info(f"Skipping the row strategy for {size} readings, raise -R to include it.")
+                continue
+            result = {"readings": size, "strategy": strategy, "generate_s": generated}
+            result.update(run(raw_dir, data_dir / f"bench-{size}-{strategy}.db", strategy, cmd_line))
+            logging.info(
+                f"{size} readings, {strategy}: {result['stages_s']} {result['rows_per_s']} rows/s, "
+                f"peak {max(result['peak_rss_mb'].values())}MB"
+            )
+            results.append(result)
+
+    report = {
+        "benchmark": "loader",
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=str(repo_dir), stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, universal_newlines=True
+        ).stdout.strip() or None,
+        "python": platform.python_version(),
+        "settings": {
+            "measures": cmd_line.measures, "locations": cmd_line.locations, "batch_size": cmd_line.batch_size,
+            "jobs": cmd_line.jobs, "seed": cmd_line.seed,
+        },
+        "results": results,
+    }
+
+    output = json.dumps(report, indent=2)
+    if cmd_line.output:
+        pathlib.Path(cmd_line.output).write_text(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
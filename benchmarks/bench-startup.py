@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import logging
+import os
+import pathlib
+import platform
+import shutil
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from synthetic import repo_dir
+
+logging.basicConfig(level=logging.INFO)
+
+_default_db = repo_dir / "webapp" / "app" / "waterways.db"
+
+# imported after the app, as the first chart does, to measure what the lazy imports moved out of worker start up
+_deferred = (
+    "import importlib, webapp.app.main\n"
+    "from webapp.app.models import plotting_modules\n"
+    "for module in plotting_modules:\n"
+    "    importlib.import_module(module)\n"
+)
+
+
+def with_args(f):
+    def with_args_(*args, **kwargs):
+        ap = argparse.ArgumentParser(description="Import time and worker start up benchmark for the web app.")
+        ap.add_argument("-p", "--database-path", type=str, help="Path to the sqlite3 database the app is started with.", default=str(_default_db))
+        ap.add_argument("-n", "--runs", type=int, help="Number of fresh interpreters each import is timed in.", default=5)
+        ap.add_argument("-k", "--top", type=int, help="Number of modules with the largest import time to report.", default=25)
+        ap.add_argument("-g", "--gunicorn", type=str, choices=["yes", "no"], help="Whether to also time gunicorn starting with and without preload.", default="yes")
+        ap.add_argument("-w", "--workers", type=int, help="Number of gunicorn workers.", default=2)
+        ap.add_argument("-o", "--output", type=str, help="Write the results as JSON here instead of to stdout.", default=None)
+        return f(ap.parse_args(), *args, **kwargs)
+    return with_args_
+
+
+def import_times(database, code, runs):
+    # python -X importtime's self and cumulative microseconds per module, median of runs fresh interpreters, and
+    # each interpreter's wall time
+    env = {**os.environ, "SQLITE_PATH": str(database)}
+    samples, walls = {}, []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code], cwd=str(repo_dir), env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True, check=True
+        )
+        walls.append(time.perf_counter() - started)
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "self [us]" in line:
+                continue
+            own, cumulative, name = line[len("import time:"):].split("|")
+            depth = (len(name) - len(name.lstrip())) // 2
+            samples.setdefault(name.strip(), []).append((int(own), int(cumulative), depth))
+    modules = {
+        name: {
+            "self_ms": round(statistics.median(s[0] for s in values) / 1000, 2),
+            "cumulative_ms": round(statistics.median(s[1] for s in values) / 1000, 2),
+            "depth": values[0][2],
+        }
+        for name, values in samples.items()
+    }
+    return modules, round(statistics.median(walls) * 1000, 1)
+
+
+def benchmark_imports(database, cmd_line):
+    modules, wall_ms = import_times(database, "import webapp.app.main", cmd_line.runs)
+    top = sorted(modules.items(), key=lambda item: -item[1]["cumulative_ms"])[:cmd_line.top]
+    logging.info(
+        f"import webapp.app.main: {modules['webapp.app.main']['cumulative_ms']}ms, {wall_ms}ms with the interpreter."
+    )
+
+    deferred, _ = import_times(database, _deferred, cmd_line.runs)
+    # what the first chart request pays for: every module only the plotting imports load, by top level package
+    deferred_ms = {}
+    for name, m in deferred.items():
+        if name not in modules:
+            package = name.split(".")[0]
+            deferred_ms[package] = round(deferred_ms.get(package, 0) + m["self_ms"], 2)
+    deferred_ms = dict(sorted(deferred_ms.items(), key=lambda item: -item[1]))
+    logging.info(f"deferred to the first chart: {round(sum(deferred_ms.values()), 1)}ms.")
+    return {
+        "app_import_ms": modules["webapp.app.main"]["cumulative_ms"],
+        "interpreter_ms": wall_ms,
+        "app_modules": {
+            name: m["cumulative_ms"] for name, m in sorted(modules.items()) if name.startswith("webapp.app.")
+        },
+        "top_modules": [{"module": name, **m} for name, m in top],
+        "deferred_ms": deferred_ms,
+    }
+
+
+def _pss(pid):
+    # proportional set size of the master and its workers, so pages the workers share are only counted once
+    pids = [pid]
+    for task in pathlib.Path(f"/proc/{pid}/task").glob("*"):
+        children = (task / "children").read_text().split() if (task / "children").exists() else []
+        pids.extend(int(child) for child in children)
+    total = 0
+    for p in pids:
+        try:
+            for line in pathlib.Path(f"/proc/{p}/smaps_rollup").read_text().splitlines():
+                if line.startswith("Pss:"):
+                    total += int(line.split()[1])
+        except OSError:
+            pass
+    return round(total / 1024, 1) if total else None
+
+
+def _request(base, method, path, form=None):
+    data = urllib.parse.urlencode(form).encode() if form is not None else None
+    try:
+        with urllib.request.urlopen(urllib.request.Request(base + path, data=data, method=method)) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+def first_chart(base, database, timeout=120):
+    # a chart is a job, so it is timed until its result can be collected. the first one pays for the lazy imports.
+    connection = sqlite3.connect(str(database))
+    location = connection.execute(
+        "select l.id from location l join location_type lt on lt.id = l.location_type_id where lt.name = 'SENSOR'"
+    ).fetchone()[0]
+    chemical = connection.execute("select chemical_id from waterway_reading where location_id = ? limit 1", (location,)).fetchone()[0]
+    connection.close()
+    started = time.perf_counter()
+    status, body = _request(base, "POST", "/chart", {
+        "locations": json.dumps([location]), "measures": json.dumps([chemical]), "chart_type": "scatter",
+        "start_date": "", "end_date": "", "condenser": "",
+    })
+    if status in (200, 202):
+        uri = json.loads(body)["uri"]
+        deadline = time.perf_counter() + timeout
+        status = 202
+        # until the chart is in the shared cache, a worker that is not drawing it does not know the job
+        while status in (202, 404) and time.perf_counter() < deadline:
+            status, _ = _request(base, "GET", uri)
+            if status in (202, 404):
+                time.sleep(0.02)
+    return status, round((time.perf_counter() - started) * 1000, 1)
+
+
+def benchmark_gunicorn(database, cmd_line, preload):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    # the chart cache is shared through a directory, so whichever worker is asked for the finished chart finds it
+    cache_dir = tempfile.mkdtemp(prefix="bench-startup-")
+    env = {
+        **os.environ, "SQLITE_PATH": str(database), "GUNICORN_PRELOAD": "Y" if preload else "N",
+        "CHART_CACHE_DIR": cache_dir,
+    }
+    started = time.perf_counter()
+    # started from the repository root, so gunicorn.conf.py is read
+    server = subprocess.Popen(
+        [
+            sys.executable, "-m", "gunicorn", "-b", f"127.0.0.1:{port}", "-w", str(cmd_line.workers), "-t", "120",
+            "webapp.app.main:app"
+        ],
+        cwd=str(repo_dir), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        base = f"http://127.0.0.1:{port}"
+        deadline = started + 120
+        while True:
+            try:
+                status, _ = _request(base, "GET", "/rest/locations/")
+                break
+            except OSError:
+                if time.perf_counter() > deadline or server.poll() is not None:
+                    raise RuntimeError("gunicorn did not start")
+                time.sleep(0.05)
+        ready_ms = round((time.perf_counter() - started) * 1000, 1)
+        chart_status, chart_ms = first_chart(base, database)
+        result = {
+            "mode": "preload" if preload else "lazy",
+            "workers": cmd_line.workers,
+            "first_response_ms": ready_ms,
+            "first_response_status": status,
+            "first_chart_ms": chart_ms,
+            "first_chart_status": chart_status,
+            "pss_mb": _pss(server.pid),
+        }
+        logging.info(
+            f"gunicorn ({result['mode']}): first /rest/locations/ after {ready_ms}ms, first chart in {chart_ms}ms, "
+            f"{result['pss_mb']}MB"
+        )
+        return result
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+@with_args
+def main(cmd_line):
+    database = pathlib.Path(cmd_line.database_path).resolve()
+    report = {
+        "benchmark": "startup",
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=str(repo_dir), stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, universal_newlines=True
+        ).stdout.strip() or None,
+        "python": platform.python_version(),
+        "settings": {"runs": cmd_line.runs, "workers": cmd_line.workers, "database": str(database)},
+        "imports": benchmark_imports(database, cmd_line),
+    }
+    if cmd_line.gunicorn == "yes":
+        report["gunicorn"] = [benchmark_gunicorn(database, cmd_line, preload) for preload in (False, True)]
+
+    output = json.dumps(report, indent=2)
+    if cmd_line.output:
+        pathlib.Path(cmd_line.output).write_text(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
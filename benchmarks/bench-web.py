@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import logging
+import os
+import pathlib
+import platform
+import random
+import resource
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from synthetic import repo_dir, scripts_dir, generate
+
+logging.basicConfig(level=logging.INFO)
+
+_parent_dir = pathlib.Path(__file__).resolve().parent
+_default_data = _parent_dir / "data"
+endpoints = ["index", "readings", "readings_compact", "locations", "measures", "chart"]
+
+
+def with_args(f):
+    def with_args_(*args, **kwargs):
+        ap = argparse.ArgumentParser(description="Latency, throughput and memory benchmark for the web app.")
+        ap.add_argument("-r", "--readings", type=int, help="Number of synthetic readings in the benchmark database.", default=1000000)
+        ap.add_argument("-m", "--measures", type=int, help="Number of synthetic measures.", default=106)
+        ap.add_argument("-d", "--data-dir", type=str, help="Where the synthetic files and database are kept between runs.", default=str(_default_data))
+        ap.add_argument("-f", "--force", action="store_true", help="If specified, will rebuild the database even if one of this size exists.", default=False)
+        ap.add_argument("-n", "--requests", type=int, help="Number of measured requests per endpoint.", default=200)
+        ap.add_argument("-c", "--concurrency", type=int, help="Number of clients sending requests at once.", default=4)
+        ap.add_argument("-e", "--endpoints", type=str, nargs="+", choices=endpoints, help="Endpoints to measure.", default=endpoints)
+        ap.add_argument("-g", "--gunicorn", type=str, choices=["yes", "no", "only"], help="Whether to also drive a local gunicorn.", default="yes")
+        ap.add_argument("-w", "--workers", type=int, help="Number of gunicorn workers.", default=1)
+        ap.add_argument("-t", "--threads", type=int, help="Number of threads per gunicorn worker.", default=1)
+        ap.add_argument("-s", "--seed", type=int, help="Seed for the synthetic data and the request parameters.", default=0)
+        ap.add_argument("-o", "--output", type=str, help="Write the results as JSON here instead of to stdout.", default=None)
+        return f(ap.parse_args(), *args, **kwargs)
+    return with_args_
+
+
+def build_database(cmd_line):
+    # the database is kept between runs, named after its size, since loading millions of readings takes a while
+    data_dir = pathlib.Path(cmd_line.data_dir)
+    raw_dir = data_dir / f"raw-{cmd_line.readings}-{cmd_line.measures}-{cmd_line.seed}"
+    database = data_dir / f"waterways-{cmd_line.readings}-{cmd_line.measures}-{cmd_line.seed}.db"
+    if database.exists() and not cmd_line.force:
+        logging.info(f"Using {database}.")
+        return database
+
+    for path in (database, pathlib.Path(f"{database}-wal"), pathlib.Path(f"{database}-shm")):
+        if path.exists():
+            path.unlink()
+    start = time.perf_counter()
+    generate(raw_dir, cmd_line.readings, cmd_line.measures, seed=cmd_line.seed)
+    logging.info(f"{cmd_line.readings} readings generated in {time.perf_counter() - start:.1f}s.")
+
+    start = time.perf_counter()
+    for script, *args in (("db-init.py",), ("db-load.py", "-b", "-r", str(raw_dir))):
+        subprocess.run(
+            [sys.executable, str(scripts_dir / script), "-p", str(database), *args],
+            cwd=str(scripts_dir), check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+    logging.info(f"{database} built in {time.perf_counter() - start:.1f}s.")
+    return database
+
+
+def request_factories(database, seed):
+    # each factory returns (method, path, form) for one request. the parameters are drawn from the database so
+    # every request finds data, and vary from request to request so the caches don't answer all of them.
+    connection = sqlite3.connect(str(database))
+    sensors = [row[0] for row in connection.execute(
+        "select l.id from location l join location_type lt on lt.id = l.location_type_id where lt.name = 'SENSOR'"
+    )]
+    chemicals = [row for row in connection.execute("select id, display from chemical where name != 'N/A'")]
+    connection.close()
+    rng = random.Random(seed)
+
+    def readings(compact):
+        def factory():
+            location, chemical = rng.choice(sensors), rng.choice(chemicals)[0]
+            query = {"locations": f"[{location}]", "measures": f"[{chemical}]", "limit": 1000}
+            if compact:
+                query["compact"] = "Y"
+            return "GET", "/rest/readings?" + urllib.parse.urlencode(query), None
+        return factory
+
+    def measures():
+        return "GET", "/rest/measures?" + urllib.parse.urlencode({"term": rng.choice(chemicals)[1][:2]}), None
+
+    def chart():
+        return "POST", "/chart", {
+            "locations": json.dumps(rng.sample(sensors, rng.randint(1, 3))),
+            "measures": json.dumps([c[0] for c in rng.sample(chemicals, rng.randint(1, 2))]),
+            "chart_type": rng.choice(["scatter", "bar", "histogram"]),
+            "start_date": "",
+            "end_date": "",
+            "condenser": "",
+        }
+
+    return {
+        "index": lambda: ("GET", "/", None),
+        "readings": readings(False),
+        "readings_compact": readings(True),
+        "locations": lambda: ("GET", "/rest/locations/", None),
+        "measures": measures,
+        "chart": chart,
+    }
+
+
+class TestClient(object):
+    # sends requests through flask's test client, in this process
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def __call__(self, method, path, form=None):
+        response = self.client.open(path, method=method, data=form)
+        return response.status_code, response.get_data()
+
+
+class HttpClient(object):
+    # sends requests to a server over http
+
+    def __init__(self, base):
+        self.base = base
+
+    def __call__(self, method, path, form=None):
+        data = urllib.parse.urlencode(form).encode() if form is not None else None
+        try:
+            with urllib.request.urlopen(urllib.request.Request(self.base + path, data=data, method=method)) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+def send(client, method, path, form, timeout=120):
+    # charts are rendered as jobs, so a chart request is timed until its result can be collected
+    status, body = client(method, path, form)
+    if path != "/chart" or status not in (200, 202):
+        return status
+    uri = json.loads(body)["uri"]
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        status, body = client("GET", uri)
+        if status != 202:
+            return status
+        time.sleep(0.02)
+    return 504
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def run(clients, factory, count):
+    latencies, errors = [], []
+    lock = threading.Lock()
+    requests = [factory() for _ in range(count)]
+
+    def worker(client):
+        while True:
+            with lock:
+                if not requests:
+                    return
+                method, path, form = requests.pop()
+            start = time.perf_counter()
+            status = send(client, method, path, form)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if status >= 400:
+                    errors.append(status)
+
+    threads = [threading.Thread(target=worker, args=(client,)) for client in clients]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": count,
+        "errors": len(errors),
+        "concurrency": len(clients),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2),
+        "throughput_rps": round(count / wall, 2),
+    }
+
+
+def measure(mode, clients, factories, cmd_line, peak_rss):
+    results = []
+    for name in cmd_line.endpoints:
+        send(clients[0], *factories[name]())  # warm up the caches and connections outside of the measurement
+        result = {"mode": mode, "endpoint": name, **run(clients, factories[name], cmd_line.requests)}
+        result["peak_rss_mb"] = peak_rss()
+        logging.info(
+            f"{mode} {name}: p50 {result['p50_ms']}ms p95 {result['p95_ms']}ms p99 {result['p99_ms']}ms "
+            f"{result['throughput_rps']} req/s"
+        )
+        results.append(result)
+    return results
+
+
+def benchmark_test_client(database, cmd_line):
+    os.environ["SQLITE_PATH"] = str(database)
+    sys.path.insert(0, str(repo_dir))
+    from webapp.app.main import app
+
+    logging.getLogger("gunicorn.error").setLevel(logging.WARNING)
+    clients = [TestClient(app) for _ in range(cmd_line.concurrency)]
+    factories = request_factories(database, cmd_line.seed)
+    # ru_maxrss is in KiB on linux
+    return measure(
+        "test_client", clients, factories, cmd_line,
+        lambda: round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    )
+
+
+def _peak_rss(pid):
+    # the sum of each gunicorn process' own peak, read from /proc so nothing needs to be installed
+    pids = [pid]
+    for task in pathlib.Path(f"/proc/{pid}/task").glob("*"):
+        children = (task / "children").read_text().split() if (task / "children").exists() else []
+        pids.extend(int(child) for child in children)
+    total = 0
+    for p in pids:
+        try:
+            for line in pathlib.Path(f"/proc/{p}/status").read_text().splitlines():
+                if line.startswith("VmHWM:"):
+                    total += int(line.split()[1])
+        except OSError:
+            pass
+    return round(total / 1024, 1) if total else None
+
+
+def benchmark_gunicorn(database, cmd_line):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    env = {**os.environ, "SQLITE_PATH": str(database)}
+    server = subprocess.Popen(
+        [
+            sys.executable, "-m", "gunicorn", "-b", f"127.0.0.1:{port}", "-w", str(cmd_line.workers),
+            "--threads", str(cmd_line.threads), "-t", "120", "webapp.app.main:app"
+        ],
+        cwd=str(repo_dir), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        base = f"http://127.0.0.1:{port}"
+        deadline = time.perf_counter() + 60
+        while True:
+            try:
+                urllib.request.urlopen(base + "/rest/locations/").read()
+                break
+            except OSError:
+                if time.perf_counter() > deadline or server.poll() is not None:
+                    raise RuntimeError("gunicorn did not start")
+                time.sleep(0.2)
+
+        clients = [HttpClient(base) for _ in range(cmd_line.concurrency)]
+        factories = request_factories(database, cmd_line.seed)
+        return measure("gunicorn", clients, factories, cmd_line, lambda: _peak_rss(server.pid))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+@with_args
+def main(cmd_line):
+    database = build_database(cmd_line)
+    results = []
+    if cmd_line.gunicorn != "only":
+        results += benchmark_test_client(database, cmd_line)
+    if cmd_line.gunicorn != "no":
+        results += benchmark_gunicorn(database, cmd_line)
+
+    connection = sqlite3.connect(str(database))
+    report = {
+        "benchmark": "web",
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=str(repo_dir), stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, universal_newlines=True
+        ).stdout.strip() or None,
+        "python": platform.python_version(),
+        "database": {
+            "readings": connection.execute("select count(*) from waterway_reading").fetchone()[0],
+            "locations": connection.execute("select count(*) from location").fetchone()[0],
+            "measures": connection.execute("select count(*) from chemical").fetchone()[0],
+            "size_mb": round(database.stat().st_size / 1024 / 1024, 1),
+        },
+        "settings": {
+            "requests": cmd_line.requests, "concurrency": cmd_line.concurrency, "workers": cmd_line.workers,
+            "threads": cmd_line.threads, "seed": cmd_line.seed,
+        },
+        "results": results,
+    }
+    connection.close()
+
+    output = json.dumps(report, indent=2)
+    if cmd_line.output:
+        pathlib.Path(cmd_line.output).write_text(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
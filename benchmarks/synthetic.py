@@ -0,0 +1,105 @@
+import datetime
+import json
+import pathlib
+import numpy as np
+
+repo_dir = pathlib.Path(__file__).resolve().parent.parent
+scripts_dir = repo_dir / "scripts"
+raw_data_dir = scripts_dir / "raw-data"
+
+# measures from the challenge data, the rest are numbered
+known_measures = [
+    ("Iron", "µg/l"), ("Nitrates", "mg/l"), ("Water temperature", "°C"), ("Total dissolved salts", "mg/l"),
+    ("Lead", "µg/l"), ("Copper", "µg/l"), ("Zinc", "µg/l"), ("Arsenic", "µg/l"), ("Cadmium", "µg/l"),
+    ("Chromium", "µg/l"), ("Mercury", "µg/l"), ("Nickel", "µg/l"), ("Ammonium", "mg/l"), ("Nitrites", "mg/l"),
+    ("Orthophosphate-phosphorus", "mg/l"), ("Dissolved oxygen", "mg/l"), ("Chlorides", "mg/l"),
+    ("Sulphates", "mg/l"), ("Total coliforms", "CFU/100ml"), ("Biochemical Oxygen", "mg/l"),
+]
+
+months = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+
+def measures(count):
+    return (known_measures + [(f"Measure {i}", "mg/l") for i in range(len(known_measures) + 1, count + 1)])[:count]
+
+
+def locations(coordinate_map):
+    # the sensor names as they are spelled in the readings file, without the dump
+    return [name.title() for name in coordinate_map if name != "DUMP"]
+
+
+def write_units(path, measure_list):
+    # the challenge file is latin-1, which the loader detects
+    with open(path, "w", encoding="latin-1") as f:
+        f.write("measure,unit\n")
+        for name, unit in measure_list:
+            f.write(f"{name},{unit}\n")
+
+
+def coordinates(count=None, source=raw_data_dir / "location-coordinates.json", seed=0):
+    # the real sensors and dump, or count made up sensors scattered over the same area
+    real = json.loads(pathlib.Path(source).read_text())
+    if count is None:
+        return real
+    rng = np.random.default_rng(seed)
+    xs = [c["x"] for c in real.values()]
+    ys = [c["y"] for c in real.values()]
+    made_up = {
+        f"SENSOR {i:0{len(str(count))}d}": {"x": float(x), "y": float(y)}
+        for i, x, y in zip(
+            range(1, count + 1), rng.uniform(min(xs), max(xs), count), rng.uniform(min(ys), max(ys), count)
+        )
+    }
+    made_up["DUMP"] = real["DUMP"]
+    return made_up
+
+
+def write_coordinates(path, coordinate_map):
+    pathlib.Path(path).write_text(json.dumps(coordinate_map))
+
+
+def write_readings(path, count, location_names, measure_names, seed=0, start_id=1, chunk_size=1000000):
+    # readings in the challenge layout: id, value, location, sampleDate (dd-Mon-yy), measure. each location/measure
+    # series varies around a level of its own, so the values spread across orders of magnitude like real ones do.
+    rng = np.random.default_rng(seed)
+    first, last = datetime.date(1998, 1, 1).toordinal(), datetime.date(2016, 12, 31).toordinal()
+    dates = [datetime.date.fromordinal(day) for day in range(first, last + 1)]
+    date_strings = np.array([f"{d.day:02d}-{months[d.month - 1]}-{d.year % 100:02d}" for d in dates])
+    location_names = np.array(location_names)
+    measure_names = np.array(measure_names)
+    levels = rng.lognormal(0, 1, (len(location_names), len(measure_names)))
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("id,value,location,sampleDate,measure\n")
+        for offset in range(0, count, chunk_size):
+            size = min(chunk_size, count - offset)
+            location = rng.integers(0, len(location_names), size)
+            measure = rng.integers(0, len(measure_names), size)
+            day = rng.integers(0, len(dates), size)
+            value = levels[location, measure] * rng.lognormal(0, 0.25, size)
+            ids = np.arange(start_id + offset, start_id + offset + size)
+            lines = [
+                f"{i},{v:.4f},{l},{d},{m}"
+                for i, v, l, d, m in zip(
+                    ids.tolist(), value.tolist(), location_names[location].tolist(), date_strings[day].tolist(),
+                    measure_names[measure].tolist()
+                )
+            ]
+            f.write("\n".join(lines))
+            f.write("\n")
+
+
+def generate(directory, readings, measure_count=106, location_count=None, seed=0):
+    # writes units-of-measure.csv, waterway-readings.csv and location-coordinates.json for db-load -r. the real
+    # locations are used unless a location count is given.
+    directory = pathlib.Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    measure_list = measures(measure_count)
+    coordinate_map = coordinates(location_count, seed=seed)
+    write_units(directory / "units-of-measure.csv", measure_list)
+    write_coordinates(directory / "location-coordinates.json", coordinate_map)
+    write_readings(
+        directory / "waterway-readings.csv", readings, locations(coordinate_map), [name for name, _ in measure_list],
+        seed
+    )
+    return directory
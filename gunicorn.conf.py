@@ -0,0 +1,31 @@
+import os
+import shutil
+import tempfile
+
+# gunicorn reads this file from the directory it is started in. every worker writes its prometheus metrics to files
+# in PROMETHEUS_MULTIPROC_DIR, which /metrics adds up, so the directory has to be emptied when the server starts and
+# the files of workers that exit marked as dead.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "waterways-metrics"))
+
+# emptied here rather than in on_starting, since a preloaded app is imported before that hook runs and its metrics
+# open their files at import. only once per master, as this file is read again when gunicorn reloads on a HUP and the
+# workers' files must survive that.
+if os.environ.get("WATERWAYS_METRICS_MASTER") != str(os.getpid()):
+    os.environ["WATERWAYS_METRICS_MASTER"] = str(os.getpid())
+    shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+# GUNICORN_PRELOAD=Y loads the app once, in the master, which also imports the chart libraries and fills the reference
+# data, statistics and anomaly caches (warm_up in webapp/app/main.py) before forking the workers. they start serving
+# at once and share those pages with the master until they write to them. code changes then need a full restart.
+preload_app = os.getenv("GUNICORN_PRELOAD", "N").upper() in ("Y", "1", "TRUE")
+if preload_app:
+    os.environ.setdefault("WARM_UP", "Y")
+
+
+def child_exit(server, worker):
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+import argparse
+import datetime
+import logging
+import os
+import pathlib
+import sys
+
+logging.basicConfig(level=logging.INFO)
+
+_parent_dir = pathlib.Path(__file__).resolve().parent
+_default_db = _parent_dir / "waterways.db"
+
+# the frames are the web app's own, read through both of its paths
+sys.path.insert(0, str(_parent_dir.parent))
+
+
+def with_args(f):
+    def with_args_(*args, **kwargs):
+        ap = argparse.ArgumentParser(description="Checks that the column store and the database give charts the same readings.")
+        ap.add_argument("-p", "--database-path", type=str, help="Path to the sqlite3 database.", default=str(_default_db))
+        ap.add_argument("-l", "--locations", type=int, nargs="+", help="Location IDs, all when not given.", default=[])
+        ap.add_argument("-m", "--measures", type=int, nargs="+", help="Measure IDs, each on its own and all at once when not given.", default=[])
+        ap.add_argument("-s", "--start-date", type=str, help="First sample date, as YYYY-MM-DD.", default="1998-01-01")
+        ap.add_argument("-e", "--end-date", type=str, help="Last sample date, as YYYY-MM-DD.", default=datetime.date.today().isoformat())
+        return f(ap.parse_args(), *args, **kwargs)
+    return with_args_
+
+
+@with_args
+def main(cmd_line):
+    os.environ["SQLITE_PATH"] = str(pathlib.Path(cmd_line.database_path).resolve())
+    from pandas.testing import assert_frame_equal
+    from webapp.app.main import app
+    from webapp.app.columns import column_store
+    from webapp.app.models import Plotter
+
+    start_date = datetime.datetime.strptime(cmd_line.start_date, "%Y-%m-%d")
+    end_date = datetime.datetime.strptime(cmd_line.end_date, "%Y-%m-%d")
+    failures = 0
+    with app.app_context():
+        columns = column_store.current()
+        if columns is None:
+            logging.error("There is no current column store, run db-load.py or db-ingest.py -C first.")
+            sys.exit(1)
+
+        measures = cmd_line.measures or sorted({m for _, m in columns.series([], [])})
+        for measure_ids in [[m] for m in measures] + ([] if cmd_line.measures else [[]]):
+            queried = Plotter.query_frame(cmd_line.locations, measure_ids, start_date, end_date)
+            sliced = Plotter.columns_frame(columns, cmd_line.locations, measure_ids, start_date, end_date)
+            try:
+                # the dtypes too, so /chart/data and the chart cache don't depend on which one served a request
+                assert_frame_equal(queried, sliced, check_exact=True)
+            except AssertionError as e:
+                failures += 1
+                logging.error(f"measures {measure_ids or 'all'}: the frames differ. {e}")
+            else:
+                logging.info(f"measures {measure_ids or 'all'}: {len(queried)} identical rows.")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+import argparse
+import pathlib
+import logging
+import time
+from sqlalchemy import func
+from sqlalchemy.orm import sessionmaker
+from models import Location, Chemical, ReadingChange
+from loader import (
+    csv_dir, file_checksum, already_loaded, record_file, read_coordinates, units_and_chemicals,
+    location_types_and_waste, bulk_insert_readings, bump_data_version, journal_readings,
+    sqlite_engine
+)
+from loader.pipeline import pipeline_insert_readings
+from loader.rollups import refresh_rollups
+from loader.metrics import record_load
+from loader.columns import column_store_path, write_columns
+
+logging.basicConfig(level=logging.INFO)
+
+_parent_dir = pathlib.Path(__file__).resolve().parent
+_default_db = _parent_dir / "waterways.db"
+
+
+def with_args(f):
+    def with_args_(*args, **kwargs):
+        ap = argparse.ArgumentParser(description="Incremental loader for new waterway reading files.")
+        ap.add_argument("files", type=str, nargs="*", help="Waterway reading CSV files to ingest.")
+        ap.add_argument("-p", "--database-path", type=str, help="Path to the sqlite3 database.", default=str(_default_db))
+        ap.add_argument("-u", "--units", type=str, nargs="+", help="Units of measure CSV files with new chemicals.", default=[])
+        ap.add_argument("-c", "--coordinates", type=str, help="Location coordinates JSON file.", default=str(csv_dir / "location-coordinates.json"))
+        ap.add_argument("-s", "--batch-size", type=int, help="Number of readings per insert batch.", default=50000)
+        ap.add_argument("-f", "--force", action="store_true", help="If specified, will re-read files that were already loaded.", default=False)
+        ap.add_argument("-j", "--jobs", type=int, nargs="?", const=0, help="If specified, will parse the readings with this many worker processes (all cores when no count is given).", default=None)
+        ap.add_argument("-C", "--columns", action="store_true", help="If specified, will write the column store even if there is none yet (an existing one is always rewritten after new readings).", default=False)
+        return f(ap.parse_args(), *args, **kwargs)
+    return with_args_
+
+
+def ingest_units(session, path, force=False):
+    checksum = file_checksum(path)
+    if not force and already_loaded(session, checksum):
+        logging.info(f"{path} is unchanged, skipping.")
+        return
+
+    chemical_count = session.query(Chemical).count()
+    row_count = units_and_chemicals(session, path)
+    if session.query(Chemical).count() != chemical_count:
+        bump_data_version(session, "reference")
+    record_file(session, path, checksum, row_count, row_count)
+    session.commit()
+    logging.info(f"{path}: {row_count} units of measure read.")
+
+
+def ingest_readings(session, path, coordinates, batch_size, force=False, jobs=None):
+    checksum = file_checksum(path)
+    if not force and already_loaded(session, checksum):
+        logging.info(f"{path} is unchanged, skipping.")
+        return 0
+
+    start = time.perf_counter()
+    location_count = session.query(Location).count()
+    lt_sensor = location_types_and_waste(session, coordinates)
+    journal_readings(session)
+    journaled = session.query(func.max(ReadingChange.id)).scalar() or 0
+    if jobs is not None:
+        row_count, inserted_count = pipeline_insert_readings(
+            session, path, lt_sensor, coordinates, batch_size, ignore_existing=True, workers=jobs
+        )
+    else:
+        row_count, inserted_count = bulk_insert_readings(
+            session, path, lt_sensor, coordinates, batch_size, ignore_existing=True
+        )
+    if inserted_count:
+        # only the series this file added readings to, as journaled by the insert trigger, rather than every series
+        # it mentions
+        refresh_rollups(session, session.query(ReadingChange.location_id, ReadingChange.chemical_id).filter(
+            ReadingChange.id > journaled
+        ).distinct().all())
+        bump_data_version(session)
+    if session.query(Location).count() != location_count:
+        bump_data_version(session, "reference")
+    record_file(session, path, checksum, row_count, inserted_count)
+    session.commit()
+
+    elapsed = time.perf_counter() - start
+    record_load("ingest", row_count, inserted_count, elapsed)
+    logging.info(
+        f"{path}: {row_count} rows read, {inserted_count} new readings inserted in {elapsed:.2f}s "
+        f"({row_count / elapsed:.0f} rows/s)."
+    )
+    return inserted_count
+
+
+@with_args
+def main(cmd_line):
+    engine = sqlite_engine(cmd_line.database_path)
+    session = sessionmaker(bind=engine)()
+
+    # each file is its own transaction, so a failure part way through keeps the files that were already ingested
+    for path in cmd_line.units:
+        ingest_units(session, path, cmd_line.force)
+
+    coordinates = read_coordinates(cmd_line.coordinates)
+    total = 0
+    for path in cmd_line.files:
+        total += ingest_readings(session, path, coordinates, cmd_line.batch_size, cmd_line.force, cmd_line.jobs)
+    logging.info(f"{total} new readings ingested.")
+
+    # the web app stops using a column store that is older than the readings, so one that exists is kept current
+    if cmd_line.columns or (total and column_store_path(cmd_line.database_path).exists()):
+        write_columns(session, cmd_line.database_path)
+
+    session.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,45 +1,129 @@
 #!/usr/bin/env python3
 import argparse
+import datetime
+import logging
 import pathlib
-from sqlalchemy import create_engine
+import sys
+from sqlalchemy import select, func
 import sqlalchemy
 from sqlalchemy.engine import base
-from models import Base
+from sqlalchemy.orm import sessionmaker
+from models import Base, WaterwayReading
+from loader import sqlite_engine
+from loader.rollups import refresh_rollups
+
+logging.basicConfig(level=logging.INFO)
 
 _parent = pathlib.Path(__file__).resolve().parent
 _default_db = _parent / "waterways.db"
 
+# -e checks the web app's own reading queries, see hot_queries
+sys.path.insert(0, str(_parent.parent))
+from webapp.app.queries import chart_readings, search_readings  # noqa: E402
+
 
 def with_args(f):
     def with_args_(*args, **kwargs):
         ap = argparse.ArgumentParser(description="Database schema initializer.")
         ap.add_argument("-p", "--database-path", type=str, help="Path to the sqlite3 database.", default=str(_default_db))
         ap.add_argument("-d", "--delete", action="store_true", help="If specified, will clear out the database.", default=False)
+        ap.add_argument("-m", "--migrate", action="store_true", help="If specified, will add missing tables, indexes and views to an existing database.", default=False)
+        ap.add_argument("-e", "--explain", action="store_true", help="If specified, will check that the reading queries are planned against an index.", default=False)
         return f(ap.parse_args(), *args, **kwargs)
     return with_args_
 
 
+def create_views(engine):
+    base_view = _parent / "views" / "waterway-reading-master.sql"
+    engine.execute(base_view.read_text())
+    for view in (_parent / "views").iterdir():
+        if view.name != base_view.name:
+            engine.execute(
+                view.read_text()
+            )
+
+
+def drop_views(engine):
+    for view in (_parent / "views").iterdir():
+        try:
+            engine.execute(
+                f"drop view {view.stem.replace('-', '_')}"
+            )
+        except sqlalchemy.exc.OperationalError:
+            pass
+
+
+def migrate(engine):
+    Base.metadata.create_all(bind=engine)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+    # views are recreated, since their definitions may have changed
+    drop_views(engine)
+    create_views(engine)
+
+    session = sessionmaker(bind=engine)()
+    refresh_rollups(session)
+    session.commit()
+    session.close()
+    engine.execute("analyze")
+
+
+def hot_queries():
+    # the reading queries made by the web app and scratch.py. Plotter.retrieve_data's and WaterwayReading.search's are
+    # the app's own, with the IN lists, ordering and keyset cursor of a chart and of a readings page
+    start, end = datetime.date(1998, 1, 1), datetime.date.today()
+    between = WaterwayReading.sample_date.between(start, end)
+    cursor = (datetime.date(2005, 1, 1), 1)
+    return {
+        "Plotter.retrieve_data": chart_readings([1, 2], [1, 2], start, end),
+        "WaterwayReading.search": search_readings([1, 2], [1, 2], start, end, cursor, 1001),
+        "WaterwayReading.search (locations only)": search_readings([1, 2], [], start, end, cursor, 1001),
+        "WaterwayReading.search (dates only)": search_readings([], [], start, end, cursor, 1001),
+        "WaterwayReading.min_sample_date": select(func.min(WaterwayReading.sample_date)),
+        "WaterwayReading.max_sample_date": select(func.max(WaterwayReading.sample_date)),
+        "time_series": select(WaterwayReading.sample_date, WaterwayReading.value).where(
+            WaterwayReading.chemical_id == 1, WaterwayReading.location_id == 1, between
+        ),
+    }
+
+
+_indexed = ("USING INDEX", "USING COVERING INDEX", "USING INTEGER PRIMARY KEY")
+
+
+def explain(engine):
+    # a query "passes" when every step of its plan that reads the readings table does so through an index. a SEARCH
+    # without one, e.g. min(sample_date) once its index is gone, reads the whole table just as a SCAN does
+    failures = []
+    for name, statement in hot_queries().items():
+        compiled = statement.compile(dialect=engine.dialect, compile_kwargs={"render_postcompile": True})
+        params = [compiled.params[param] for param in compiled.positiontup]
+        plan = [row[-1] for row in engine.execute(f"explain query plan {compiled}", *params)]
+        scans = [
+            step for step in plan
+            if "waterway_reading" in step and not any(using in step for using in _indexed)
+        ]
+        if scans:
+            failures.append(name)
+        logging.info(f"{'FULL SCAN' if scans else 'INDEXED'} {name}: {'; '.join(plan)}")
+    return failures
+
+
 @with_args
 def main(cmd_line):
-    engine = create_engine(f"sqlite:///{cmd_line.database_path}")
+    engine = sqlite_engine(cmd_line.database_path)
     if cmd_line.delete:
         Base.metadata.drop_all(bind=engine)
-        for view in (_parent / "views").iterdir():
-            try:
-                engine.execute(
-                    f"drop view {view.stem.replace('-', '_')}"
-                )
-            except sqlalchemy.exc.OperationalError:
-                pass
-    else:
+        drop_views(engine)
+    elif cmd_line.migrate:
+        migrate(engine)
+    elif not cmd_line.explain:
         Base.metadata.create_all(bind=engine)
-        base_view = _parent / "views" / "waterway-reading-master.sql"
-        engine.execute(base_view.read_text())
-        for view in (_parent / "views").iterdir():
-            if view.name != base_view.name:
-                engine.execute(
-                    view.read_text()
-                )
+        create_views(engine)
+
+    if cmd_line.explain and explain(engine):
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -3,107 +3,41 @@ import argparse
 import pathlib
 import csv
 import logging
-import chardet
-import datetime
-import json
-from sqlalchemy import create_engine
+import time
 from sqlalchemy.orm import sessionmaker
-from models import UnitOfMeasure, Chemical, Location, WaterwayReading, LocationType
+from models import Chemical, Location, WaterwayReading
+from loader import (
+    csv_dir, parse_sample_date, file_checksum, record_file, read_coordinates, units_and_chemicals,
+    location_types_and_waste, bulk_insert_readings, bump_data_version, sqlite_engine
+)
+from loader.pipeline import pipeline_insert_readings
+from loader.rollups import refresh_rollups
+from loader.metrics import record_load
+from loader.columns import write_columns
 
 logging.basicConfig(level=logging.DEBUG)
 
 _parent_dir = pathlib.Path(__file__).resolve().parent
 _default_db = _parent_dir / "waterways.db"
-_csv_dir = _parent_dir / "raw-data"
 
 def with_args(f):
     def with_args_(*args, **kwargs):
         ap = argparse.ArgumentParser(description="Database schema initializer.")
         ap.add_argument("-p", "--database-path", type=str, help="Path to the sqlite3 database.", default=str(_default_db))
+        ap.add_argument("-r", "--raw-data", type=str, help="Directory holding the units of measure, readings and coordinates files.", default=str(csv_dir))
+        ap.add_argument("-b", "--bulk", action="store_true", help="If specified, will use the cached, batched bulk loader.", default=False)
+        ap.add_argument("-s", "--batch-size", type=int, help="Number of readings per insert batch in the bulk and pipelined modes.", default=50000)
+        ap.add_argument("-j", "--jobs", type=int, nargs="?", const=0, help="If specified, will parse the readings with this many worker processes (all cores when no count is given).", default=None)
+        ap.add_argument("-C", "--columns", action="store_true", help="If specified, will also write the memory mapped column store the web app reads readings from.", default=False)
         return f(ap.parse_args(), *args, **kwargs)
     return with_args_
 
 
-def units_and_chemicals(session):
+def locations_and_readings(session, path, lt_sensor, coordinates):
 
-    with open(_csv_dir / "units-of-measure.csv", "rb") as f:
-        encoding = chardet.detect(f.read())["encoding"]
+    count = 0
 
-    with open(_csv_dir / "units-of-measure.csv", "r", encoding=encoding) as csv_file:
-        reader = csv.DictReader(csv_file, fieldnames=["measure", "unit"])
-        next(reader)  # skip the header
-        for row in reader:
-            display = row["measure"].strip()
-            name = row["measure"].upper().strip()
-            unit = row["unit"].strip()
-            unit = (unit if unit else "N/A").encode("utf-8")
-
-            # first check that a unit of measurement record exists
-            unit_of_measure = session.query(UnitOfMeasure).filter_by(unit_name=unit).first()
-            if not unit_of_measure:
-                unit_of_measure = UnitOfMeasure(
-                    unit_name=unit
-                )
-                session.add(unit_of_measure)
-                session.flush()
-                logging.info(f"{unit} unit of measure added.")
-            
-            # add the chemical, if not already there
-            chemical = session.query(Chemical).filter_by(name=name).first()
-            if not chemical:
-                chemical = Chemical(
-                    name=name, 
-                    display=display,
-                    unit_of_measure=unit_of_measure
-                )
-                session.add(chemical)
-                session.flush()
-                logging.info(f"{name} chemical added.")
-
-    # add N/A chemical for blank vals
-    session.add(
-        Chemical(
-            name="N/A",
-            display="N/A",
-            unit_of_measure=session.query(UnitOfMeasure).filter_by(unit_name="N/A").first()
-        )
-    )
-    session.flush()
-
-
-def locations_and_readings(session):
-
-    lt_waste = LocationType(
-        name="WASTE",
-        description="Waste dumping location"
-    )
-
-    lt_sensor = LocationType(
-        name="SENSOR",
-        description="Sensor location"
-    )
-
-    session.add(lt_waste)
-    session.add(lt_sensor)
-    session.flush()
-
-    file_text = (_csv_dir / "location-coordinates.json").read_text()
-    coordinates = json.loads(file_text)
-
-    # set up waste loc
-    session.add(
-        Location(
-            name="WASTE",
-            display="Kasios Waste Dump",
-            location_type=lt_waste,
-            longitude=coordinates["DUMP"]["x"],
-            latitude=coordinates["DUMP"]["y"]
-        )
-    )
-    session.flush()
-
-
-    with open(_csv_dir / "waterway-readings.csv", "r") as csv_file:
+    with open(path, "r") as csv_file:
         reader = csv.DictReader(csv_file, fieldnames=["id", "value", "location", "date", "measure"])
         next(reader)  # skip the header
 
@@ -133,38 +67,57 @@ def locations_and_readings(session):
                 chemical = session.query(Chemical).filter_by(name="N/A").first()
 
             # add reading
-            
-            # handle special case for pre-2000 dates. we only get two digits, but string
-            # formatters would possibly read 13 (2013) as 1913.
-            sample_date = row["date"]
-            parts = sample_date.split("-")
-            year = parts[2]
-            if year in ("98", "99"):  # ex) 98 (1998), 99 (1999)
-                year = f"19{year}"
-            else:
-                year = f"20{year}"
-            date = datetime.datetime.strptime(f"{parts[0]}-{parts[1]}-{year}", "%d-%b-%Y").date()
-            
             reading = WaterwayReading(
                 id=int(row["id"]),
                 value=row["value"], 
                 location=location, 
                 chemical=chemical, 
-                sample_date=date
+                sample_date=parse_sample_date(row["date"])
             )
             session.add(reading)
             session.flush()
+            count += 1
+    return count
 
 
 @with_args
 def main(cmd_line):
-    engine = create_engine(f"sqlite:///{cmd_line.database_path}")
+    engine = sqlite_engine(cmd_line.database_path)
     session = sessionmaker(bind=engine)()
 
-    units_and_chemicals(session)
-    locations_and_readings(session)
+    raw_data = pathlib.Path(cmd_line.raw_data)
+    units_path = raw_data / "units-of-measure.csv"
+    readings_path = raw_data / "waterway-readings.csv"
 
+    unit_count = units_and_chemicals(session, units_path)
+    record_file(session, units_path, file_checksum(units_path), unit_count, unit_count)
+
+    coordinates = read_coordinates(raw_data / "location-coordinates.json")
+    lt_sensor = location_types_and_waste(session, coordinates)
+
+    start = time.perf_counter()
+    if cmd_line.jobs is not None:
+        _, count = pipeline_insert_readings(
+            session, readings_path, lt_sensor, coordinates, cmd_line.batch_size, workers=cmd_line.jobs
+        )
+    elif cmd_line.bulk:
+        _, count = bulk_insert_readings(session, readings_path, lt_sensor, coordinates, cmd_line.batch_size)
+    else:
+        count = locations_and_readings(session, readings_path, lt_sensor, coordinates)
+    record_file(session, readings_path, file_checksum(readings_path), count, count)
     session.commit()
+
+    elapsed = time.perf_counter() - start
+    record_load("load", count, count, elapsed)
+    logging.info(f"{count} readings loaded in {elapsed:.2f}s ({count / elapsed:.0f} rows/s).")
+
+    refresh_rollups(session)
+    bump_data_version(session)
+    bump_data_version(session, "reference")
+    session.commit()
+
+    if cmd_line.columns:
+        write_columns(session, cmd_line.database_path)
     session.close()
 
 
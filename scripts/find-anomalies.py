@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+import argparse
+import csv
+import datetime
+import logging
+import pathlib
+import sys
+import time
+from sqlalchemy.orm import sessionmaker
+from models import Chemical, Location
+from loader import sqlite_engine
+from loader.columns import read_columns
+
+logging.basicConfig(level=logging.INFO)
+
+_parent_dir = pathlib.Path(__file__).resolve().parent
+_default_db = _parent_dir / "waterways.db"
+
+# the detection is the web app's, so /rest/anomalies and this script flag the same readings
+sys.path.insert(0, str(_parent_dir.parent))
+from webapp.app.columns import day_number  # noqa: E402
+from webapp.app.anomalies import Anomalies, methods  # noqa: E402
+
+
+def with_args(f):
+    def with_args_(*args, **kwargs):
+        ap = argparse.ArgumentParser(description="Finds spikes in every location and measure series.")
+        ap.add_argument("-p", "--database-path", type=str, help="Path to the sqlite3 database.", default=str(_default_db))
+        ap.add_argument("-l", "--locations", type=int, nargs="+", help="Location IDs, all when not given.", default=[])
+        ap.add_argument("-m", "--measures", type=int, nargs="+", help="Measure IDs, all when not given.", default=[])
+        ap.add_argument("-s", "--start-date", type=str, help="First sample date, as YYYY-MM-DD.", default="1998-01-01")
+        ap.add_argument("-e", "--end-date", type=str, help="Last sample date, as YYYY-MM-DD.", default=datetime.date.today().isoformat())
+        ap.add_argument("-w", "--window", type=int, help="Number of readings in the rolling median window.", default=15)
+        ap.add_argument("-t", "--mad-threshold", type=float, help="Robust (median/MAD) score a reading must reach.", default=3.5)
+        ap.add_argument("-z", "--z-threshold", type=float, help="Z-score against its whole series a reading must reach.", default=4.0)
+        ap.add_argument("-M", "--method", type=str, choices=methods, help="Which of the two scores must reach its threshold.", default="any")
+        ap.add_argument("-o", "--output", type=str, help="Write the anomalies as CSV here instead of to stdout.", default=None)
+        return f(ap.parse_args(), *args, **kwargs)
+    return with_args_
+
+
+@with_args
+def main(cmd_line):
+    engine = sqlite_engine(cmd_line.database_path)
+    session = sessionmaker(bind=engine)()
+
+    start = time.perf_counter()
+    columns = read_columns(session, cmd_line.database_path)
+    logging.info(f"{len(columns)} readings read in {time.perf_counter() - start:.2f}s.")
+
+    start = time.perf_counter()
+    anomalies = Anomalies(columns, cmd_line.window, cmd_line.mad_threshold, cmd_line.z_threshold)
+    selected = anomalies.select(
+        cmd_line.locations, cmd_line.measures, day_number(cmd_line.start_date), day_number(cmd_line.end_date),
+        cmd_line.method
+    )
+    logging.info(
+        f"{len(anomalies)} anomalies found in {time.perf_counter() - start:.2f}s, {len(selected)} of them selected."
+    )
+
+    locations = dict(session.query(Location.id, Location.display))
+    measures = dict(session.query(Chemical.id, Chemical.display))
+    session.close()
+
+    output = open(cmd_line.output, "w", newline="") if cmd_line.output else sys.stdout
+    try:
+        writer = csv.writer(output)
+        writer.writerow([
+            "id", "location_id", "location", "measure_id", "measure", "sample_date", "value", "median", "mad_score",
+            "zscore"
+        ])
+        for row in anomalies.rows(selected):
+            writer.writerow([
+                row["id"], row["location"], locations.get(row["location"]), row["measure"], measures.get(row["measure"]),
+                row["sample_date"], row["value"], row["median"], row["mad_score"], row["zscore"]
+            ])
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+import csv
+import datetime
+import functools
+import hashlib
+import json
+import logging
+import pathlib
+import chardet
+from sqlalchemy import create_engine, event, text
+from models import UnitOfMeasure, Chemical, Location, WaterwayReading, LocationType, LoadedFile, DataVersion, ReadingChange
+
+csv_dir = pathlib.Path(__file__).resolve().parent.parent / "raw-data"
+
+
+def sqlite_engine(path):
+    # wal lets the web app keep reading from a snapshot while a load is writing. it is a property of the file, so
+    # every database the loaders touch is switched over. synchronous=normal is durable enough in wal mode and saves
+    # an fsync per commit.
+    engine = create_engine(f"sqlite:///{path}")
+
+    @event.listens_for(engine, "connect")
+    def pragmas(connection, record):
+        connection.execute("pragma journal_mode = wal")
+        connection.execute("pragma synchronous = normal")
+
+    return engine
+
+
+@functools.lru_cache(maxsize=None)
+def parse_sample_date(sample_date):
+    # handle special case for pre-2000 dates. we only get two digits, but string
+    # formatters would possibly read 13 (2013) as 1913.
+    parts = sample_date.split("-")
+    year = parts[2]
+    if year in ("98", "99"):  # ex) 98 (1998), 99 (1999)
+        year = f"19{year}"
+    else:
+        year = f"20{year}"
+    return datetime.datetime.strptime(f"{parts[0]}-{parts[1]}-{year}", "%d-%b-%Y").date()
+
+
+def file_checksum(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def already_loaded(session, checksum):
+    return session.query(LoadedFile).filter_by(checksum=checksum).first() is not None
+
+
+def record_file(session, path, checksum, row_count, inserted_count):
+    session.query(LoadedFile).filter_by(checksum=checksum).delete()
+    session.add(
+        LoadedFile(
+            name=pathlib.Path(path).name,
+            checksum=checksum,
+            row_count=row_count,
+            inserted_count=inserted_count,
+            loaded_at=datetime.datetime.now()
+        )
+    )
+    session.flush()
+
+
+def bump_data_version(session, name="waterway_reading"):
+    # readers (e.g. the web app's chart cache) compare this stamp to decide whether what they hold is stale
+    data_version = session.query(DataVersion).filter_by(name=name).first()
+    if not data_version:
+        data_version = DataVersion(name=name, version=0)
+        session.add(data_version)
+    data_version.version += 1
+    data_version.updated_at = datetime.datetime.now()
+    session.flush()
+
+
+def journal_readings(session, keep_days=7):
+    # readings inserted by this connection for the rest of the transaction are also written to reading_change, which
+    # the web app follows to push new readings to subscribed clients. the trigger is temporary, so full loads don't
+    # pay for it, and it is only ever fired for rows that were actually inserted.
+    connection = session.connection()
+    ReadingChange.__table__.create(connection, checkfirst=True)
+    connection.execute(text(
+        "create temp trigger if not exists journal_waterway_reading after insert on main.waterway_reading begin "
+        "insert into reading_change (reading_id, location_id, chemical_id, created_at) "
+        "values (new.id, new.location_id, new.chemical_id, datetime('now', 'localtime')); "
+        "end"
+    ))
+    session.query(ReadingChange).filter(
+        ReadingChange.created_at < datetime.datetime.now() - datetime.timedelta(days=keep_days)
+    ).delete(synchronize_session=False)
+
+
+def read_coordinates(path=csv_dir / "location-coordinates.json"):
+    return json.loads(pathlib.Path(path).read_text())
+
+
+def detect_encoding(path, limit=1 << 16):
+    # only feed the detector a bounded prefix of the file, rather than reading all of it into memory
+    detector = chardet.UniversalDetector()
+    with open(path, "rb") as f:
+        while f.tell() < limit and not detector.done:
+            chunk = f.read(4096)
+            if not chunk:
+                break
+            detector.feed(chunk)
+    return detector.close()["encoding"]
+
+
+def units_and_chemicals(session, path=csv_dir / "units-of-measure.csv"):
+
+    encoding = detect_encoding(path)
+
+    row_count = 0
+    with open(path, "r", encoding=encoding) as csv_file:
+        reader = csv.DictReader(csv_file, fieldnames=["measure", "unit"])
+        next(reader)  # skip the header
+        for row in reader:
+            row_count += 1
+            display = row["measure"].strip()
+            name = row["measure"].upper().strip()
+            unit = row["unit"].strip()
+            unit = (unit if unit else "N/A").encode("utf-8")
+
+            # first check that a unit of measurement record exists
+            unit_of_measure = session.query(UnitOfMeasure).filter_by(unit_name=unit).first()
+            if not unit_of_measure:
+                unit_of_measure = UnitOfMeasure(
+                    unit_name=unit
+                )
+                session.add(unit_of_measure)
+                session.flush()
+                logging.info(f"{unit} unit of measure added.")
+            
+            # add the chemical, if not already there
+            chemical = session.query(Chemical).filter_by(name=name).first()
+            if not chemical:
+                chemical = Chemical(
+                    name=name, 
+                    display=display,
+                    unit_of_measure=unit_of_measure
+                )
+                session.add(chemical)
+                session.flush()
+                logging.info(f"{name} chemical added.")
+
+    # add N/A chemical for blank vals
+    if not session.query(Chemical).filter_by(name="N/A").first():
+        unit_of_measure = session.query(UnitOfMeasure).filter_by(unit_name="N/A".encode("utf-8")).first()
+        if not unit_of_measure:
+            unit_of_measure = UnitOfMeasure(unit_name="N/A".encode("utf-8"))
+            session.add(unit_of_measure)
+        session.add(
+            Chemical(
+                name="N/A",
+                display="N/A",
+                unit_of_measure=unit_of_measure
+            )
+        )
+        session.flush()
+    return row_count
+
+
+def location_types_and_waste(session, coordinates):
+    lt_waste = session.query(LocationType).filter_by(name="WASTE").first()
+    lt_sensor = session.query(LocationType).filter_by(name="SENSOR").first()
+    if lt_waste and lt_sensor:
+        return lt_sensor
+
+    lt_waste = LocationType(
+        name="WASTE",
+        description="Waste dumping location"
+    )
+
+    lt_sensor = LocationType(
+        name="SENSOR",
+        description="Sensor location"
+    )
+
+    session.add(lt_waste)
+    session.add(lt_sensor)
+    session.flush()
+
+    # set up waste loc
+    session.add(
+        Location(
+            name="WASTE",
+            display="Kasios Waste Dump",
+            location_type=lt_waste,
+            longitude=coordinates["DUMP"]["x"],
+            latitude=coordinates["DUMP"]["y"]
+        )
+    )
+    session.flush()
+    return lt_sensor
+
+
+class ReadingDimensions(object):
+    # resolves the dimension tables once, rather than querying them for every row
+
+    def __init__(self, session, lt_sensor, coordinates):
+        self.session = session
+        self.lt_sensor = lt_sensor
+        self.coordinates = coordinates
+        self.locations = {name: id for id, name in session.query(Location.id, Location.name)}
+        self.chemicals = {name: id for id, name in session.query(Chemical.id, Chemical.name)}
+        self.na_chemical = self.chemicals["N/A"]
+
+    def location_id(self, location_name, location_display):
+        location_id = self.locations.get(location_name)
+        if location_id is None:
+            location = Location(
+                name=location_name,
+                display=location_display,
+                location_type=self.lt_sensor,
+                longitude=self.coordinates[location_name]["x"],
+                latitude=self.coordinates[location_name]["y"]
+            )
+            self.session.add(location)
+            self.session.flush()
+            location_id = self.locations[location_name] = location.id
+            logging.info(f"{location_name} location added.")
+        return location_id
+
+    def chemical_id(self, chemical_name):
+        return self.chemicals.get(chemical_name, self.na_chemical)
+
+
+def reading_insert(ignore_existing=False):
+    insert = WaterwayReading.__table__.insert()
+    if ignore_existing:
+        insert = insert.prefix_with("OR IGNORE")
+    return insert
+
+
+def bulk_insert_readings(session, path, lt_sensor, coordinates, batch_size=50000, ignore_existing=False):
+    # returns the number of rows read and the number of readings inserted. when ignore_existing is set, readings
+    # whose id is already present are skipped instead of raising an integrity error.
+
+    dimensions = ReadingDimensions(session, lt_sensor, coordinates)
+    insert = reading_insert(ignore_existing)
+
+    row_count = 0
+    inserted_count = 0
+    batch = []
+
+    with open(path, "r") as csv_file:
+        reader = csv.reader(csv_file)
+        next(reader)  # skip the header
+
+        for id, value, location_display, sample_date, measure in reader:
+            location_display = location_display.strip()
+
+            batch.append({
+                "id": int(id),
+                "value": value,
+                "location_id": dimensions.location_id(location_display.upper(), location_display),
+                "chemical_id": dimensions.chemical_id(measure.strip().upper()),
+                "sample_date": parse_sample_date(sample_date)
+            })
+
+            if len(batch) >= batch_size:
+                inserted_count += session.execute(insert, batch).rowcount
+                row_count += len(batch)
+                batch = []
+                logging.debug(f"{row_count} readings processed.")
+
+    if batch:
+        inserted_count += session.execute(insert, batch).rowcount
+        row_count += len(batch)
+    return row_count, inserted_count
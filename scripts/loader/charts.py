@@ -0,0 +1,153 @@
+import datetime
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import pathlib
+import time
+import numpy as np
+
+# the charts written by scripts/render-charts.py:
+#
+#   charts/manifest.json                        a charts entry per chart, with the hash of what it was drawn from
+#   charts/<location>-<measure>-<start>-<end>.png   matplotlib (agg) scatter of the series
+#   charts/<location>-<measure>-<start>-<end>.html  the same series as a standalone plotly page
+#
+# bump renderer_version whenever the charts are drawn differently, so the next run redraws every one of them
+renderer_version = 1
+formats = ("png", "html")
+
+# set in each worker by _init_worker, so the readings are handed to a worker once rather than with every chart
+_columns = None
+_labels = None
+
+
+def chart_name(location_id, chemical_id, start_date, end_date):
+    return f"{location_id}-{chemical_id}-{start_date}-{end_date}"
+
+
+def content_hash(columns, labels, pair, start, end):
+    # the readings and titles a chart is drawn from, so an unchanged chart is recognized without drawing it
+    digest = hashlib.sha256()
+    digest.update(json.dumps([renderer_version, labels["locations"][pair[0]], labels["measures"][pair[1]]]).encode())
+    digest.update(np.ascontiguousarray(columns.day[start:end], dtype=np.int32).tobytes())
+    digest.update(np.ascontiguousarray(columns.value[start:end], dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+def _init_worker(columns, labels):
+    global _columns, _labels
+    import matplotlib
+    matplotlib.use("Agg")  # nothing is ever shown, and workers have no display
+    _columns, _labels = columns, labels
+
+
+def _replace(path, write):
+    # written next to the target and moved over it, so an interrupted run never leaves half a chart behind
+    temporary = path.with_name(f".{path.name}")
+    write(str(temporary))
+    os.replace(str(temporary), str(path))
+
+
+def render_chart(task):
+    # runs in the worker processes: draws one series between two days in each of the requested formats
+    from matplotlib.figure import Figure
+
+    name, pair, start_day, end_day, output_dir, chart_formats = task
+    started = time.perf_counter()
+    start, end = _columns.rows(pair, start_day, end_day)
+    dates = np.asarray(_columns.day[start:end]).astype("datetime64[D]")
+    values = np.asarray(_columns.value[start:end], dtype=np.float64)
+    location, measure = _labels["locations"][pair[0]], _labels["measures"][pair[1]]
+    title = f"{measure} at {location}"
+    output_dir = pathlib.Path(output_dir)
+
+    if "png" in chart_formats:
+        # a figure of its own rather than pyplot's current one, so nothing is kept between charts
+        fig = Figure(figsize=(10, 6))
+        ax = fig.subplots()
+        ax.scatter(dates.astype(datetime.date), values, color="tab:blue", s=1)
+        ax.set_xlabel("Sample Dates")
+        ax.set_ylabel(measure)
+        ax.set_title(title)
+        ax.grid(True)
+        _replace(output_dir / f"{name}.png", lambda path: fig.savefig(path, format="png"))
+
+    if "html" in chart_formats:
+        import plotly.graph_objects as go
+
+        fig = go.Figure(go.Scattergl(x=dates.astype(str), y=values, mode="markers", marker={"size": 3}))
+        fig.update_layout(title=title, xaxis_title="Sample Dates", yaxis_title=measure, height=600, width=1000)
+        _replace(
+            output_dir / f"{name}.html",
+            lambda path: fig.write_html(path, include_plotlyjs="cdn", full_html=True)
+        )
+    return name, end - start, time.perf_counter() - started
+
+
+def render_charts(columns, labels, pairs, date_ranges, output_dir, chart_formats=formats, workers=None, force=False):
+    # every (location, measure) pair in every (start date, end date) range, drawn by a pool of worker processes
+    # from the readings already in columns. charts whose readings and titles hash the same as in the manifest, and
+    # whose files are all there, are skipped unless forced. returns the number of charts drawn and skipped.
+    output_dir = pathlib.Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = output_dir / "manifest.json"
+    try:
+        manifest = json.loads(manifest_path.read_text())
+    except (OSError, ValueError):
+        manifest = {"charts": {}}
+    charts = manifest.setdefault("charts", {})
+
+    tasks, entries, skipped, empty = [], {}, 0, 0
+    for start_date, end_date in date_ranges:
+        start_day = int(np.datetime64(start_date, "D").astype(np.int64))
+        end_day = int(np.datetime64(end_date, "D").astype(np.int64))
+        for pair in pairs:
+            start, end = columns.rows(pair, start_day, end_day)
+            if end <= start:
+                empty += 1
+                continue
+            name = chart_name(pair[0], pair[1], start_date, end_date)
+            files = [f"{name}.{fmt}" for fmt in chart_formats]
+            digest = content_hash(columns, labels, pair, start, end)
+            entry = charts.get(name, {})
+            if (
+                not force and entry.get("hash") == digest
+                and all(f in entry.get("files", []) and (output_dir / f).is_file() for f in files)
+            ):
+                skipped += 1
+                continue
+            entries[name] = {
+                "location": pair[0],
+                "measure": pair[1],
+                "start_date": str(start_date),
+                "end_date": str(end_date),
+                "readings": end - start,
+                "hash": digest,
+                "files": sorted(set(files) | set(entry.get("files", [])) if entry.get("hash") == digest else files),
+            }
+            tasks.append((name, pair, start_day, end_day, str(output_dir), tuple(chart_formats)))
+    logging.info(
+        f"{len(tasks)} chart(s) to draw, {skipped} unchanged and {empty} without readings in their date range."
+    )
+
+    def save():
+        _replace(manifest_path, lambda path: pathlib.Path(path).write_text(json.dumps(manifest, indent=2)))
+
+    drawn = 0
+    if tasks:
+        started = time.perf_counter()
+        workers = max(1, min(workers or os.cpu_count(), len(tasks)))
+        # the readings reach the workers through the initializer: inherited when processes are forked, pickled once
+        # per worker otherwise
+        with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(columns, labels)) as pool:
+            for name, count, seconds in pool.imap_unordered(render_chart, tasks):
+                charts[name] = dict(entries[name], rendered=datetime.datetime.now().isoformat(timespec="seconds"))
+                drawn += 1
+                logging.debug(f"{name}: {count} readings drawn in {seconds:.2f}s.")
+                if drawn % 100 == 0:
+                    save()
+        logging.info(f"{drawn} chart(s) drawn in {time.perf_counter() - started:.2f}s by {workers} worker(s).")
+    save()
+    return drawn, skipped
@@ -0,0 +1,113 @@
+import json
+import logging
+import os
+import pathlib
+import shutil
+import time
+import numpy as np
+from models import DataVersion
+
+# the column store the web app memory maps in place of the readings table, see webapp/app/columns.py:
+#
+#   waterways.columns/current            name of the live version directory
+#   waterways.columns/<version>-<time>/  id, value, day, location and chemical .npy files, sorted by location,
+#                                        chemical and day, series.npy with a (location, chemical, start, end) row per
+#                                        series, date_order.npy and date_day.npy with the rows in (day, id) order and
+#                                        their days, and manifest.json with the data version they were written from
+names = ("id", "value", "day", "location", "chemical")
+
+
+def column_store_path(database_path):
+    return pathlib.Path(database_path).resolve().with_suffix(".columns")
+
+
+def write_columns(session, database_path, chunk_size=500000):
+    # written from the committed readings after the data version was bumped, so the web app only uses it once it
+    # matches the database. the new version is written to a directory of its own and then swapped in by replacing
+    # the current pointer, so a reader never sees a partly written store, and workers that still map the previous
+    # one keep reading it until they next check.
+    started = time.perf_counter()
+    store = column_store_path(database_path)
+    version = session.query(DataVersion.version).filter_by(name="waterway_reading").scalar() or 0
+
+    parts = {name: [] for name in names}
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.execute(
+            "select id, cast(value as real), sample_date, location_id, chemical_id from waterway_reading"
+        )
+        for rows in iter(lambda: cursor.fetchmany(chunk_size), []):
+            id, value, day, location, chemical = zip(*rows)
+            parts["id"].append(np.array(id, dtype=np.int64))
+            parts["value"].append(np.array(value, dtype=np.float64))
+            parts["day"].append(np.array(day, dtype="datetime64[D]").astype(np.int32))
+            parts["location"].append(np.array(location, dtype=np.int32))
+            parts["chemical"].append(np.array(chemical, dtype=np.int32))
+    finally:
+        cursor.close()
+    dtypes = {"id": np.int64, "value": np.float64, "day": np.int32, "location": np.int32, "chemical": np.int32}
+    columns = {
+        name: np.concatenate(parts[name]) if parts[name] else np.array([], dtype=dtypes[name]) for name in names
+    }
+    del parts
+
+    order = np.lexsort((columns["id"], columns["day"], columns["chemical"], columns["location"]))
+    columns = {name: column[order] for name, column in columns.items()}
+    location, chemical = columns["location"], columns["chemical"]
+    starts = np.flatnonzero(
+        np.r_[True, (location[1:] != location[:-1]) | (chemical[1:] != chemical[:-1])]
+    ) if len(order) else np.array([], dtype=np.int64)
+    series = np.stack(
+        [location[starts], chemical[starts], starts, np.r_[starts[1:], len(order)]], axis=1
+    ).astype(np.int64).reshape(-1, 4)
+
+    name = f"{version}-{int(time.time() * 1000)}"
+    directory = store / name
+    temporary = store / f".{name}"
+    temporary.mkdir(parents=True)
+    for column in names:
+        np.save(str(temporary / f"{column}.npy"), columns[column])
+    np.save(str(temporary / "series.npy"), series)
+    # so /rest/readings can page through every series by date without each worker sorting them
+    date_order = np.lexsort((columns["id"], columns["day"])).astype(np.int64)
+    np.save(str(temporary / "date_order.npy"), date_order)
+    np.save(str(temporary / "date_day.npy"), columns["day"][date_order])
+    (temporary / "manifest.json").write_text(json.dumps({"version": version, "readings": len(order)}))
+    temporary.rename(directory)
+
+    pointer = store / ".current"
+    pointer.write_text(name)
+    os.replace(str(pointer), str(store / "current"))
+    for old in store.iterdir():
+        if old.is_dir() and old.name != name:
+            shutil.rmtree(str(old), ignore_errors=True)
+
+    logging.info(
+        f"Column store {directory} written, {len(order)} readings in {time.perf_counter() - started:.2f}s."
+    )
+    return directory
+
+
+def read_columns(session, database_path):
+    # every reading as the web app's ReadingColumns: the column store when it was written from the current readings,
+    # otherwise one query over the readings table. callers put the repository root on sys.path first.
+    from webapp.app.columns import ReadingColumns
+
+    version = session.query(DataVersion.version).filter_by(name="waterway_reading").scalar() or 0
+    store = column_store_path(database_path)
+    try:
+        columns = ReadingColumns.open(store / (store / "current").read_text().strip())
+        if columns.version == version:
+            logging.info(f"Reading the column store {store}.")
+            return columns
+    except OSError:
+        pass
+
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.execute(
+            "select id, location_id, chemical_id, sample_date, cast(value as real) from waterway_reading"
+        )
+        return ReadingColumns.read(version, cursor)
+    finally:
+        cursor.close()
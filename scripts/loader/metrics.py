@@ -0,0 +1,52 @@
+import logging
+import os
+import time
+
+try:
+    import prometheus_client
+    from prometheus_client import CollectorRegistry, Counter, Gauge
+except ImportError:  # the loaders run without metrics
+    prometheus_client = None
+
+_registry = None
+_metrics = None
+
+
+def _loader_metrics():
+    # with PROMETHEUS_PUSHGATEWAY set the figures go to a registry of their own that is pushed after every file,
+    # since the loaders don't live long enough to be scraped. with PROMETHEUS_MULTIPROC_DIR set (the web app's
+    # directory) prometheus_client writes them to files there instead, which the app's /metrics adds up.
+    global _registry, _metrics
+    if _metrics is None:
+        _registry = CollectorRegistry() if os.getenv("PROMETHEUS_PUSHGATEWAY") else prometheus_client.REGISTRY
+        _metrics = (
+            Counter("waterways_loader_rows_total", "Rows read by the loaders.", ["loader"], registry=_registry),
+            Counter(
+                "waterways_loader_inserted_total", "Readings inserted by the loaders.", ["loader"], registry=_registry
+            ),
+            Counter("waterways_loader_seconds_total", "Time spent loading files.", ["loader"], registry=_registry),
+            Gauge(
+                "waterways_loader_last_success_timestamp_seconds", "When the loaders last finished a file.",
+                ["loader"], registry=_registry, multiprocess_mode="max"
+            ),
+        )
+    return _metrics
+
+
+def record_load(loader, row_count, inserted_count, seconds):
+    # reports one loaded file, and does nothing unless a pushgateway or a multiprocess directory is configured
+    gateway = os.getenv("PROMETHEUS_PUSHGATEWAY")
+    if prometheus_client is None or not (gateway or os.getenv("PROMETHEUS_MULTIPROC_DIR")):
+        return
+
+    rows, inserted, busy, last_success = _loader_metrics()
+    rows.labels(loader).inc(row_count)
+    inserted.labels(loader).inc(inserted_count)
+    busy.labels(loader).inc(seconds)
+    last_success.labels(loader).set(time.time())
+
+    if gateway:
+        try:
+            prometheus_client.push_to_gateway(gateway, job=f"waterways-{loader}", registry=_registry)
+        except OSError as e:
+            logging.warning(f"Could not push loader metrics to {gateway}: {e}")
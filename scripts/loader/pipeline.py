@@ -0,0 +1,134 @@
+import csv
+import locale
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from loader import parse_sample_date, ReadingDimensions
+
+# the order of the values in the rows the workers return, and of the insert they are written with
+reading_columns = ("id", "value", "location_id", "chemical_id", "sample_date")
+
+# set in each worker by _init_worker: the location and chemical ids known when the load started
+_locations = None
+_chemicals = None
+_na_chemical = None
+
+
+def _init_worker(locations, chemicals, na_chemical):
+    global _locations, _chemicals, _na_chemical
+    _locations, _chemicals, _na_chemical = locations, chemicals, na_chemical
+
+
+def parse_range(path, start, end):
+    # runs in the worker processes: reads, decodes and parses the lines between two byte offsets of the file and
+    # resolves their dimensions, so the writer only has rows ready to insert. a location that is not known yet is
+    # left as its name and returned with its display name for the writer to add, which it does once per location.
+    with open(path, "rb") as csv_file:
+        csv_file.seek(start)
+        # the encoding open(path, "r") reads it with in bulk_insert_readings
+        lines = csv_file.read(end - start).decode(locale.getpreferredencoding(False)).splitlines()
+
+    rows, missing = [], {}
+    for id, value, location_display, sample_date, measure in csv.reader(lines):
+        location_display = location_display.strip()
+        location_name = location_display.upper()
+        location_id = _locations.get(location_name)
+        if location_id is None:
+            location_id = location_name
+            missing[location_name] = location_display
+        rows.append((
+            int(id),
+            # stored as read, as bulk_insert_readings and a row at a time loads store it
+            value,
+            location_id,
+            _chemicals.get(measure.strip().upper(), _na_chemical),
+            parse_sample_date(sample_date).isoformat()
+        ))
+    return rows, missing
+
+
+def byte_ranges(path, chunk_size):
+    # (start, end) offsets of chunks of about chunk_size lines, each starting at the beginning of a line. only the
+    # offsets are sent to the workers, which read the lines themselves, rather than this process reading and
+    # pickling the whole file.
+    size = os.path.getsize(path)
+    with open(path, "rb") as csv_file:
+        csv_file.readline()  # skip the header
+        start = csv_file.tell()
+        sample = csv_file.read(1 << 16)
+        step = max(1, int(chunk_size * len(sample) / max(1, sample.count(b"\n"))))
+        while start < size:
+            csv_file.seek(start + step)
+            csv_file.readline()
+            end = min(csv_file.tell(), size)
+            yield start, end
+            start = end
+
+
+def feed(pool, path, chunk_size, pending, stop):
+    # the queue is bounded, so this blocks once the writer falls behind instead of queuing the whole file
+    def put(item):
+        while not stop.is_set():
+            try:
+                pending.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        for start, end in byte_ranges(path, chunk_size):
+            if not put(pool.apply_async(parse_range, (path, start, end))):
+                return
+    finally:
+        put(None)
+
+
+def pipeline_insert_readings(session, path, lt_sensor, coordinates, batch_size=50000, ignore_existing=False, workers=None):
+    # same contract as bulk_insert_readings, but the csv is read, parsed and resolved by a pool of worker processes
+    # while this thread does nothing but insert the finished rows, in file order, through the session's connection.
+    # the rows are passed to the DBAPI cursor as they are, without sqlalchemy building and processing a dict for each.
+
+    workers = workers or os.cpu_count()
+    dimensions = ReadingDimensions(session, lt_sensor, coordinates)
+    insert = (
+        f"insert {'or ignore ' if ignore_existing else ''}into waterway_reading ({', '.join(reading_columns)}) "
+        f"values ({', '.join('?' for _ in reading_columns)})"
+    )
+    cursor = session.connection().connection.cursor()
+
+    row_count = 0
+    inserted_count = 0
+    pending = queue.Queue(maxsize=workers * 2)
+    stop = threading.Event()
+
+    with multiprocessing.Pool(
+        workers, initializer=_init_worker, initargs=(dimensions.locations, dimensions.chemicals, dimensions.na_chemical)
+    ) as pool:
+        feeder = threading.Thread(target=feed, args=(pool, path, batch_size, pending, stop), daemon=True)
+        feeder.start()
+        try:
+            while True:
+                result = pending.get()
+                if result is None:
+                    break
+                rows, missing = result.get()
+                if missing:
+                    ids = {name: dimensions.location_id(name, display) for name, display in missing.items()}
+                    rows = [
+                        (id, value, ids[location_id], chemical_id, sample_date)
+                        if isinstance(location_id, str) else (id, value, location_id, chemical_id, sample_date)
+                        for id, value, location_id, chemical_id, sample_date in rows
+                    ]
+                cursor.executemany(insert, rows)
+                inserted_count += cursor.rowcount
+                row_count += len(rows)
+                logging.debug(f"{row_count} readings processed.")
+        finally:
+            stop.set()
+            feeder.join()
+            cursor.close()
+
+    return row_count, inserted_count
@@ -0,0 +1,54 @@
+import logging
+from sqlalchemy import text
+from models import LocationChemicalWeekdayCount, LocationChemicalMonthStats
+
+# each rollup is rebuilt a whole location/chemical series at a time. the covering reading index is ordered by
+# (chemical_id, location_id, ...), so rebuilding a series only reads that series' slice of the index.
+_rollups = {
+    LocationChemicalWeekdayCount.__tablename__: """
+        select location_id
+             , chemical_id
+             , cast(strftime('%w', sample_date) as integer) day_of_week
+             , count(id) total
+        from waterway_reading
+        {where}
+        group by location_id
+               , chemical_id
+               , strftime('%w', sample_date)
+    """,
+    LocationChemicalMonthStats.__tablename__: """
+        select location_id
+             , chemical_id
+             , strftime('%Y-%m', sample_date) month
+             , count(id) total
+             , min(value) minimum
+             , max(value) maximum
+             , avg(value) mean
+        from waterway_reading
+        {where}
+        group by location_id
+               , chemical_id
+               , strftime('%Y-%m', sample_date)
+    """,
+}
+
+_series_filter = "where chemical_id = :chemical_id and location_id = :location_id"
+
+
+def refresh_rollups(session, series=None):
+    # series is an iterable of (location_id, chemical_id) pairs whose readings changed. when it is None, every
+    # rollup table is rebuilt from scratch.
+    if series is not None:
+        series = [{"location_id": l, "chemical_id": c} for l, c in series]
+        if not series:
+            return
+
+    for table, query in _rollups.items():
+        if series is None:
+            session.execute(text(f"delete from {table}"))
+            session.execute(text(f"insert into {table} {query.format(where='')}"))
+        else:
+            session.execute(text(f"delete from {table} {_series_filter}"), series)
+            session.execute(text(f"insert into {table} {query.format(where=_series_filter)}"), series)
+
+    logging.info(f"Rollups refreshed for {'all' if series is None else len(series)} series.")
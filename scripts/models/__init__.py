@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Date, Numeric, ForeignKey
+from sqlalchemy import Column, Integer, String, Date, DateTime, Numeric, ForeignKey, Index
 from sqlalchemy.orm import declarative_base, relationship
 from sqlalchemy.sql.expression import null
 
@@ -59,6 +59,12 @@ class Location(Base):
 
 class WaterwayReading(Base):
     __tablename__ = "waterway_reading"
+    __table_args__ = (
+        # covers the chemical/location/date range lookups made by the charts and the readings endpoint
+        Index("ix_waterway_reading_chemical_location_date", "chemical_id", "location_id", "sample_date", "value"),
+        Index("ix_waterway_reading_location_date", "location_id", "sample_date"),
+        Index("ix_waterway_reading_sample_date", "sample_date"),
+    )
 
     id = Column(Integer, primary_key=True, nullable=False, comment="Unique ID, provided in dataset.")
     value = Column(Numeric, nullable=False, comment="The numeric value of the reading.")
@@ -68,3 +74,53 @@ class WaterwayReading(Base):
 
     chemical = relationship("Chemical", backref="waterway_readings")
     location = relationship("Location", backref="waterway_readings")
+
+
+class LoadedFile(Base):
+    __tablename__ = "loaded_file"
+
+    id = Column(Integer, primary_key=True, autoincrement=True, comment="Unique, serial ID.")
+    name = Column(String(255), nullable=False, comment="The file name that was loaded.")
+    checksum = Column(String(64), nullable=False, comment="SHA-256 checksum of the file's contents.", unique=True)
+    row_count = Column(Integer, nullable=False, comment="Number of data rows in the file.")
+    inserted_count = Column(Integer, nullable=False, comment="Number of rows that were new to the database.")
+    loaded_at = Column(DateTime, nullable=False, comment="When this file was loaded.")
+
+
+class LocationChemicalWeekdayCount(Base):
+    __tablename__ = "location_chemical_weekday_count"
+
+    location_id = Column(Integer, ForeignKey("location.id"), primary_key=True, comment="Foreign key reference to the location.")
+    chemical_id = Column(Integer, ForeignKey("chemical.id"), primary_key=True, comment="Foreign key reference to the chemical.")
+    day_of_week = Column(Integer, primary_key=True, comment="Day of the week, 0 (Sunday) through 6 (Saturday).")
+    total = Column(Integer, nullable=False, comment="Number of readings taken on this day of the week.")
+
+
+class LocationChemicalMonthStats(Base):
+    __tablename__ = "location_chemical_month_stats"
+
+    location_id = Column(Integer, ForeignKey("location.id"), primary_key=True, comment="Foreign key reference to the location.")
+    chemical_id = Column(Integer, ForeignKey("chemical.id"), primary_key=True, comment="Foreign key reference to the chemical.")
+    month = Column(String(7), primary_key=True, comment="The month the readings were taken in, as YYYY-MM.")
+    total = Column(Integer, nullable=False, comment="Number of readings taken in this month.")
+    minimum = Column(Numeric, nullable=False, comment="The smallest reading value in this month.")
+    maximum = Column(Numeric, nullable=False, comment="The largest reading value in this month.")
+    mean = Column(Numeric, nullable=False, comment="The average reading value in this month.")
+
+
+class DataVersion(Base):
+    __tablename__ = "data_version"
+
+    name = Column(String(100), primary_key=True, comment="The name of the data set, e.g. a table name.")
+    version = Column(Integer, nullable=False, default=0, comment="Incremented every time the data set changes.")
+    updated_at = Column(DateTime, nullable=False, comment="When the data set last changed.")
+
+
+class ReadingChange(Base):
+    __tablename__ = "reading_change"
+
+    id = Column(Integer, primary_key=True, autoincrement=True, comment="Unique, serial ID, in the order the readings were inserted.")
+    reading_id = Column(Integer, nullable=False, comment="The waterway reading that was inserted.")
+    location_id = Column(Integer, nullable=False, comment="The location of the reading.")
+    chemical_id = Column(Integer, nullable=False, comment="The chemical of the reading.")
+    created_at = Column(DateTime, nullable=False, comment="When the reading was inserted.")
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+import argparse
+import datetime
+import logging
+import pathlib
+import sys
+import time
+import numpy as np
+from sqlalchemy.orm import sessionmaker
+from models import Chemical, Location, UnitOfMeasure
+from loader import sqlite_engine
+from loader.charts import formats, render_charts
+from loader.columns import read_columns
+
+logging.basicConfig(level=logging.INFO)
+
+_parent_dir = pathlib.Path(__file__).resolve().parent
+_default_db = _parent_dir / "waterways.db"
+_default_output = _parent_dir / "charts"
+
+# the readings are read into the web app's ReadingColumns, see loader.columns.read_columns
+sys.path.insert(0, str(_parent_dir.parent))
+
+
+def date_range(value):
+    # checked here, so a bad range is a usage error rather than a traceback in a pool worker
+    start_date, _, end_date = value.partition(":")
+    try:
+        start_date = datetime.datetime.strptime(start_date, "%Y-%m-%d").date()
+        end_date = datetime.datetime.strptime(end_date, "%Y-%m-%d").date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value} is not a START:END range of YYYY-MM-DD dates.")
+    if start_date > end_date:
+        raise argparse.ArgumentTypeError(f"{value} ends before it starts.")
+    # as YYYY-MM-DD, which strptime doesn't require (2005-1-1) but the chart names and np.datetime64 do
+    return start_date.isoformat(), end_date.isoformat()
+
+
+def with_args(f):
+    def with_args_(*args, **kwargs):
+        ap = argparse.ArgumentParser(description="Draws a chart for every location, measure and date range, unattended.")
+        ap.add_argument("-p", "--database-path", type=str, help="Path to the sqlite3 database.", default=str(_default_db))
+        ap.add_argument("-l", "--locations", type=int, nargs="+", help="Location IDs, all when not given.", default=[])
+        ap.add_argument("-m", "--measures", type=int, nargs="+", help="Measure IDs, all when not given.", default=[])
+        ap.add_argument("-r", "--ranges", type=date_range, nargs="+", help="Date ranges as START:END, e.g. 1998-01-01:2005-12-31, every reading's dates when not given.", default=[])
+        ap.add_argument("-f", "--formats", type=str, nargs="+", choices=formats, help="Chart formats to write.", default=list(formats))
+        ap.add_argument("-o", "--output-dir", type=str, help="Directory the charts and their manifest are written to.", default=str(_default_output))
+        ap.add_argument("-j", "--jobs", type=int, help="Number of worker processes drawing charts, all cores when not given.", default=None)
+        ap.add_argument("-F", "--force", action="store_true", help="If specified, will redraw charts whose readings have not changed.", default=False)
+        return f(ap.parse_args(), *args, **kwargs)
+    return with_args_
+
+
+@with_args
+def main(cmd_line):
+    engine = sqlite_engine(cmd_line.database_path)
+    session = sessionmaker(bind=engine)()
+
+    # every chart is drawn from this one read, rather than a query per chart
+    start = time.perf_counter()
+    columns = read_columns(session, cmd_line.database_path)
+    logging.info(f"{len(columns)} readings read in {time.perf_counter() - start:.2f}s.")
+
+    labels = {
+        "locations": dict(session.query(Location.id, Location.display)),
+        "measures": {
+            # unit names are stored as blobs
+            id: f"{display} ({unit.decode() if isinstance(unit, bytes) else unit})" if unit else display
+            for id, display, unit in session.query(Chemical.id, Chemical.display, UnitOfMeasure.unit_name).outerjoin(
+                UnitOfMeasure, Chemical.unit_of_measure_id == UnitOfMeasure.id
+            )
+        },
+    }
+    session.close()
+
+    pairs = [
+        pair for pair in columns.series(cmd_line.locations, cmd_line.measures)
+        if pair[0] in labels["locations"] and pair[1] in labels["measures"]
+    ]
+    date_ranges = cmd_line.ranges
+    if not date_ranges and len(columns):
+        date_ranges = [(str(np.datetime64(int(columns.day.min()), "D")), str(np.datetime64(int(columns.day.max()), "D")))]
+    render_charts(
+        columns, labels, pairs, date_ranges, cmd_line.output_dir, cmd_line.formats, cmd_line.jobs, cmd_line.force
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,8 @@
 import pathlib
 import argparse
 import datetime
+import matplotlib
+matplotlib.use("Agg")  # written to a file, never shown, so it also runs without a display
 from matplotlib import pyplot
 from sqlalchemy import create_engine, between
 from sqlalchemy.orm import sessionmaker
@@ -18,11 +20,12 @@ def with_args(f):
         ap.add_argument("-p", "--database-path", type=str, help="Path to the sqlite3 database.", default=str(_default_db))
         ap.add_argument("-l", "--locations", type=int, nargs="+", help="Location IDs")
         ap.add_argument("-m", "--measures", type=int, nargs="+", help="Measure IDs")
+        ap.add_argument("-o", "--output", type=str, help="Path the chart is saved to.", default="plot.png")
         return f(ap.parse_args(), *args, **kwargs)
     return with_args_
 
 
-def time_series(session, locations, measures, start_date=datetime.datetime(1998, 1, 1), end_date=datetime.datetime.now()):
+def time_series(session, locations, measures, start_date=datetime.datetime(1998, 1, 1), end_date=datetime.datetime.now(), output="plot.png"):
     measure_objects = session.query(Chemical).filter(Chemical.id.in_(measures[:2])).all()
     location_objects = session.query(Location).filter(Location.id.in_(locations[:2])).all()
 
@@ -63,8 +66,8 @@ def time_series(session, locations, measures, start_date=datetime.datetime(1998,
     # Put a legend below current axis
     ax.legend(loc='upper center', bbox_to_anchor=(0.5, -0.15), fancybox=True, shadow=True, ncol=5, prop={'size': 9})
 
-    pyplot.show()
-    pyplot.savefig("plot.png")
+    fig.savefig(output)
+    pyplot.close(fig)
 
     # ax.plot(sample_dates, , color='tab:orange', label='Windspeed')
 
@@ -74,7 +77,7 @@ def main(cmd_line):
     engine = create_engine(f"sqlite:///{cmd_line.database_path}")
     session = sessionmaker(bind=engine)()
 
-    time_series(session, cmd_line.locations, cmd_line.measures)
+    time_series(session, cmd_line.locations, cmd_line.measures, output=cmd_line.output)
 
     session.commit()
     session.close()
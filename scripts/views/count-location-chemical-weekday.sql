@@ -8,15 +8,14 @@ with wd_num_to_text as (
     select 5 id, 'FRI' val union
     select 6 id, 'SAT' val
 )
-select a.location
-     , a.chemical 
+select l.display location
+     , cm.display chemical 
      , b.val day_of_week
-     , count(a.id) total
-from waterway_reading_master a
-inner join wd_num_to_text b on cast(strftime('%w', a.sample_date) as integer) = b.id 
-group by a.chemical
-       , a.location
-       , strftime('%w', a.sample_date) 
+     , a.total
+from location_chemical_weekday_count a
+inner join location l on a.location_id = l.id
+inner join chemical cm on a.chemical_id = cm.id
+inner join wd_num_to_text b on a.day_of_week = b.id 
 order by location asc
        , chemical asc
        , total desc
@@ -0,0 +1,210 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from .payload import Payload
+from .columns import day_number
+from .stats import reading_stats
+
+logger = logging.getLogger("gunicorn.error")
+
+methods = ("any", "mad", "zscore")
+
+
+def robust_scores(columns, window=15, chunk_size=131072):
+    # the hampel score of every reading: its distance from the median of the window readings around it (shifted
+    # inwards at either end of its series), over 1.4826 times the median absolute deviation of that window. every
+    # series is scored at once, a chunk of rows at a time, by gathering each row's window into a (rows, window)
+    # matrix and partitioning it. when more than half the window is one value the mad is 0, and 1.2533 times the
+    # mean absolute deviation is used instead, so a spike in an otherwise constant series still scores. readings of
+    # series shorter than the window, or of windows that are entirely flat, get nan. even windows are widened by one,
+    # so the median is a reading.
+    half = window // 2
+    window = 2 * half + 1
+    count = len(columns)
+    medians = np.full(count, np.nan)
+    scores = np.full(count, np.nan)
+    starts, ends = columns.bounds()
+    offsets = np.arange(window)
+    for first in range(0, count, chunk_size):
+        last = min(count, first + chunk_size)
+        rows = np.arange(first, last)
+        start, end = starts[first:last], ends[first:last]
+        scored = end - start >= window
+        rows, start, end = rows[scored], start[scored], end[scored]
+        if not len(rows):
+            continue
+        windows = columns.value[np.clip(rows - half, start, end - window)[:, None] + offsets]
+        windows.partition(half, axis=1)
+        median = windows[:, half].copy()
+        windows -= median[:, None]
+        np.abs(windows, out=windows)
+        windows.partition(half, axis=1)
+        # both scaled to match the standard deviation of normally distributed readings
+        mad = windows[:, half] * 1.4826
+        flat = mad == 0
+        mad[flat] = windows[flat].mean(axis=1) * 1.2533
+        with np.errstate(invalid="ignore", divide="ignore"):
+            score = np.where(mad > 0, (columns.value[rows] - median) / mad, np.nan)
+        medians[rows] = median
+        scores[rows] = score
+    return medians, scores
+
+
+def z_scores(columns):
+    # each reading's distance from the mean of its whole series, in sample standard deviations
+    first, ends = columns.spans()
+    if not len(first):
+        return np.array([], dtype=np.float64)
+    value = np.asarray(columns.value, dtype=np.float64)
+    counts = ends - first
+    group = np.repeat(np.arange(len(first)), counts)
+    mean = np.add.reduceat(value, first) / counts
+    squares = np.add.reduceat((value - mean[group]) ** 2, first)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        std = np.where(counts > 1, np.sqrt(squares / (counts - 1)), np.nan)
+        return np.where(std[group] > 0, (value - mean[group]) / std[group], np.nan)
+
+
+class Anomalies(object):
+    # the readings of a ReadingColumns whose robust score or z-score reached its threshold, as columns sorted by
+    # sample date and id
+
+    def __init__(self, columns, window, mad_threshold, z_threshold):
+        self.version = columns.version
+        self.window = window
+        self.mad_threshold = mad_threshold
+        self.z_threshold = z_threshold
+        medians, robust = robust_scores(columns, window)
+        z = z_scores(columns)
+        with np.errstate(invalid="ignore"):
+            flagged = np.flatnonzero((np.abs(robust) >= mad_threshold) | (np.abs(z) >= z_threshold))
+        flagged = flagged[np.lexsort((columns.id[flagged], columns.day[flagged]))]
+        self.id = np.asarray(columns.id[flagged])
+        self.location = np.asarray(columns.location[flagged])
+        self.chemical = np.asarray(columns.chemical[flagged])
+        self.day = np.asarray(columns.day[flagged])
+        self.value = np.asarray(columns.value[flagged])
+        self.median = medians[flagged]
+        self.mad_score = robust[flagged]
+        self.zscore = z[flagged]
+
+    def __len__(self):
+        return len(self.id)
+
+    def select(self, location_ids, chemical_ids, start_day, end_day, method="any"):
+        with np.errstate(invalid="ignore"):
+            mad = np.abs(self.mad_score) >= self.mad_threshold
+            z = np.abs(self.zscore) >= self.z_threshold
+        keep = {"any": mad | z, "mad": mad, "zscore": z}[method]
+        keep &= (self.day >= start_day) & (self.day <= end_day)
+        if location_ids:
+            keep &= np.isin(self.location, list(location_ids))
+        if chemical_ids:
+            keep &= np.isin(self.chemical, list(chemical_ids))
+        return np.flatnonzero(keep)
+
+    def rows(self, selected):
+        def floats(values):
+            return [None if v != v else round(v, 4) for v in values.tolist()]
+
+        return [
+            {
+                "id": id, "location": location, "measure": chemical, "sample_date": sample_date, "value": value,
+                "median": median, "mad_score": mad_score, "zscore": zscore,
+            }
+            for id, location, chemical, sample_date, value, median, mad_score, zscore in zip(
+                self.id[selected].tolist(),
+                self.location[selected].tolist(),
+                self.chemical[selected].tolist(),
+                np.datetime_as_string(self.day[selected].astype("datetime64[D]")).tolist(),
+                self.value[selected].tolist(),
+                floats(self.median[selected]),
+                floats(self.mad_score[selected]),
+                floats(self.zscore[selected]),
+            )
+        ]
+
+
+class AnomalyDetector(object):
+    # runs the detection over every series of the columnar readings /rest/stats uses, and keeps the result until
+    # the data version changes. like the statistics, only the first run makes requests wait, and later ones are
+    # run by whichever request notices the new data while the others are answered from the previous result. the
+    # compressed responses of the last cache_size distinct queries are kept per data version, and a query returns at
+    # most page_limit anomalies unless it asks for fewer or more.
+
+    def __init__(self, app=None):
+        self.window = 15
+        self.mad_threshold = 3.5
+        self.z_threshold = 4.0
+        self.cache_size = 128
+        self.page_limit = 1000
+        self._anomalies = None
+        self._lock = threading.Lock()
+        self._payloads = OrderedDict()
+        self._payload_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.window = app.config.get("ANOMALY_WINDOW", self.window)
+        self.mad_threshold = app.config.get("ANOMALY_MAD_THRESHOLD", self.mad_threshold)
+        self.z_threshold = app.config.get("ANOMALY_Z_THRESHOLD", self.z_threshold)
+        self.cache_size = app.config.get("ANOMALY_CACHE_SIZE", self.cache_size)
+        self.page_limit = app.config.get("ANOMALY_PAGE_LIMIT", self.page_limit)
+
+    def current(self):
+        columns = reading_stats.current()
+        if self._anomalies is None or self._anomalies.version != columns.version:
+            if self._lock.acquire(blocking=self._anomalies is None):
+                try:
+                    if self._anomalies is None or self._anomalies.version != columns.version:
+                        started = time.perf_counter()
+                        self._anomalies = Anomalies(columns, self.window, self.mad_threshold, self.z_threshold)
+                        with self._payload_lock:
+                            self._payloads.clear()
+                        logger.info(
+                            f"{len(self._anomalies)} anomalies found in {len(columns)} readings in "
+                            f"{time.perf_counter() - started:.2f}s (data version {columns.version})."
+                        )
+                finally:
+                    self._lock.release()
+        return self._anomalies
+
+    def payload(self, location_ids, chemical_ids, start_date, end_date, method="any", limit=None):
+        anomalies = self.current()
+        limit = limit or self.page_limit
+        start_day, end_day = day_number(start_date), day_number(end_date)
+        key = (
+            anomalies.version, tuple(sorted(location_ids)), tuple(sorted(chemical_ids)), start_day, end_day, method,
+            limit
+        )
+        with self._payload_lock:
+            payload = self._payloads.get(key)
+            if payload is not None:
+                self._payloads.move_to_end(key)
+                return payload
+
+        selected = anomalies.select(location_ids, chemical_ids, start_day, end_day, method)
+        total = len(selected)
+        selected = selected[:limit]
+        payload = Payload.json({
+            "method": method,
+            "window": anomalies.window,
+            "mad_threshold": anomalies.mad_threshold,
+            "z_threshold": anomalies.z_threshold,
+            "version": anomalies.version,
+            "count": total,
+            "limit": limit,
+            "message": "Ok." if total else "None found.",
+            "results": anomalies.rows(selected),
+        })
+        with self._payload_lock:
+            self._payloads[key] = payload
+            while len(self._payloads) > self.cache_size:
+                self._payloads.popitem(last=False)
+        return payload
+
+
+anomaly_detector = AnomalyDetector()
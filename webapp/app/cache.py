@@ -0,0 +1,155 @@
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from .metrics import count_lookup
+
+logger = logging.getLogger("gunicorn.error")
+
+
+def _unlink(path):
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _mtime(path):
+    # another worker may have pruned the file already
+    try:
+        return path.stat().st_mtime
+    except FileNotFoundError:
+        return 0
+
+
+class ChartCache(object):
+    # two tier cache for rendered charts, stored as json serializable values. the first tier is a size bounded LRU held by each process, the second an
+    # optional directory of files shared by every gunicorn worker. keys include the data version, so an entry is
+    # never served once the readings it was rendered from have changed.
+
+    def __init__(self, app=None):
+        self.max_entries = 64
+        self.max_disk_entries = 512
+        self.directory = None
+        self.version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_entries = app.config.get("CHART_CACHE_SIZE", self.max_entries)
+        self.max_disk_entries = app.config.get("CHART_CACHE_DISK_SIZE", self.max_disk_entries)
+        directory = app.config.get("CHART_CACHE_DIR")
+        if directory:
+            self.directory = pathlib.Path(directory)
+            try:
+                self.directory.mkdir(parents=True, exist_ok=True)
+            except OSError:
+                logger.warning(f"Chart cache directory {directory} is not writable, using the memory cache only.")
+                self.directory = None
+
+    @staticmethod
+    def key(version, **params):
+        canonical = json.dumps({"version": version, **params}, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def check_version(self, version):
+        # the memory tier is dropped as soon as the data changes, rather than waiting for stale entries to age out
+        with self._lock:
+            if version != self.version:
+                self._entries.clear()
+                self.version = version
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                count_lookup("chart", "memory")
+                return self._entries[key]
+
+        if self.directory:
+            path = self.directory / f"{key}.json"
+            try:
+                value = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                count_lookup("chart", "miss")
+                return None
+            self._remember(key, value)
+            count_lookup("chart", "disk")
+            return value
+        count_lookup("chart", "miss")
+        return None
+
+    def put(self, key, value):
+        self._remember(key, value)
+        if self.directory:
+            try:
+                self._write(self.directory / f"{key}.json", value)
+                self._prune()
+            except OSError as e:
+                logger.warning(f"Could not write chart {key} to the disk cache: {e}")
+
+    def put_job(self, key, state):
+        # the status of the chart job rendering key, so any worker can answer a poll for it. only kept in the shared
+        # directory, the worker running the job has it in memory.
+        if self.directory:
+            try:
+                (self.directory / "jobs").mkdir(exist_ok=True)
+                self._write(self.directory / "jobs" / f"{key}.json", state)
+            except OSError as e:
+                logger.warning(f"Could not write chart job {key} to the disk cache: {e}")
+
+    def get_job(self, key):
+        if not self.directory:
+            return None
+        try:
+            return json.loads((self.directory / "jobs" / f"{key}.json").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def prune_jobs(self, max_age):
+        if self.directory:
+            expired = time.time() - max_age
+            for path in (self.directory / "jobs").glob("*.json"):
+                if _mtime(path) < expired:
+                    _unlink(path)
+
+    def _write(self, path, value):
+        # written to a temporary file first, so other workers never read a partially written file
+        fd, tmp = tempfile.mkstemp(dir=str(path.parent), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(value, f)
+        os.replace(tmp, str(path))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.directory:
+            for path in self.directory.glob("*.json"):
+                _unlink(path)
+            for path in self.directory.glob("jobs/*.json"):
+                _unlink(path)
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _prune(self):
+        files = list(self.directory.glob("*.json"))
+        if len(files) <= self.max_disk_entries:
+            return
+        files.sort(key=_mtime)
+        for path in files[:len(files) - self.max_disk_entries]:
+            _unlink(path)
+
+
+chart_cache = ChartCache()
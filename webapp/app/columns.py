@@ -0,0 +1,276 @@
+import json
+import logging
+import pathlib
+import threading
+import time
+import numpy as np
+
+logger = logging.getLogger("gunicorn.error")
+
+# the column store written by scripts/loader/columns.py next to the database:
+#
+#   waterways.columns/current            name of the live version directory, replaced atomically by the loader
+#   waterways.columns/<version>-<time>/  id, value, day, location and chemical .npy files, sorted by location,
+#                                        chemical and day, series.npy with a (location, chemical, start, end) row per
+#                                        series, date_order.npy and date_day.npy with the rows in (day, id) order and
+#                                        their days, and manifest.json with the data version they were written from
+names = ("id", "value", "day", "location", "chemical")
+
+
+def day_number(date):
+    # a date or datetime as days since 1970-01-01, how the store keeps sample dates
+    return int(np.datetime64(date, "D").astype(np.int64))
+
+
+class ReadingColumns(object):
+    # readings as numpy columns sorted by location, chemical and sample date (days since 1970-01-01), so each
+    # location/chemical series is one contiguous, date ordered slice. either built in memory, or memory mapped from
+    # the column store, in which case every gunicorn worker shares the same pages through the os page cache.
+
+    def __init__(self, version, location, chemical, day, value, id=None, series=None, date_order=None):
+        self.version = version
+        self.location = location
+        self.chemical = chemical
+        self.day = day
+        self.value = value
+        self.id = id
+        self._date_order = date_order
+        self._date_lock = threading.Lock()
+        if series is None:
+            starts = np.flatnonzero(
+                np.r_[True, (location[1:] != location[:-1]) | (chemical[1:] != chemical[:-1])]
+            ) if len(value) else np.array([], dtype=np.int64)
+            series = zip(location[starts], chemical[starts], starts, np.r_[starts[1:], len(value)])
+        self._series = {
+            (int(location_id), int(chemical_id)): (int(start), int(end))
+            for location_id, chemical_id, start, end in series
+        }
+
+    @classmethod
+    def sorted(cls, version, location, chemical, day, value, id=None):
+        order = np.lexsort((day, chemical, location) if id is None else (id, day, chemical, location))
+        return cls(
+            version, location[order], chemical[order], day[order], value[order],
+            id=None if id is None else id[order]
+        )
+
+    @classmethod
+    def read(cls, version, cursor, chunk_size=100000):
+        # from a db-api cursor that has selected (id, location id, chemical id, sample date, value) rows, read a
+        # chunk at a time since building a result row object per reading takes longer than the query itself
+        parts = {name: [] for name in ("id", "location", "chemical", "day", "value")}
+        for rows in iter(lambda: cursor.fetchmany(chunk_size), []):
+            id, location, chemical, day, value = zip(*rows)
+            parts["id"].append(np.array(id, dtype=np.int64))
+            parts["location"].append(np.array(location, dtype=np.int32))
+            parts["chemical"].append(np.array(chemical, dtype=np.int32))
+            parts["day"].append(np.array(day, dtype="datetime64[D]").astype(np.int32))
+            parts["value"].append(np.array(value, dtype=np.float64))
+        dtypes = {"id": np.int64, "location": np.int32, "chemical": np.int32, "day": np.int32, "value": np.float64}
+        columns = {
+            name: np.concatenate(chunks) if chunks else np.array([], dtype=dtypes[name])
+            for name, chunks in parts.items()
+        }
+        return cls.sorted(
+            version, columns["location"], columns["chemical"], columns["day"], columns["value"], id=columns["id"]
+        )
+
+    @classmethod
+    def open(cls, directory):
+        directory = pathlib.Path(directory)
+        manifest = json.loads((directory / "manifest.json").read_text())
+        arrays = {name: np.load(str(directory / f"{name}.npy"), mmap_mode="r") for name in names}
+        try:
+            # stores written before the loader wrote the date order have it sorted on first use instead
+            date_order = tuple(
+                np.load(str(directory / f"{name}.npy"), mmap_mode="r") for name in ("date_order", "date_day")
+            )
+        except OSError:
+            date_order = None
+        return cls(
+            manifest["version"], arrays["location"], arrays["chemical"], arrays["day"], arrays["value"],
+            id=arrays["id"], series=np.load(str(directory / "series.npy")).tolist(), date_order=date_order
+        )
+
+    def __len__(self):
+        return len(self.value)
+
+    def spans(self):
+        # the start and end rows of every series, in row order
+        spans = np.array(sorted(self._series.values()), dtype=np.int64).reshape(-1, 2)
+        return spans[:, 0], spans[:, 1]
+
+    def bounds(self):
+        # the start and end rows of the series each row belongs to
+        starts, ends = self.spans()
+        return np.repeat(starts, ends - starts), np.repeat(ends, ends - starts)
+
+    def series(self, location_ids, chemical_ids):
+        # the (location, chemical) pairs with readings, limited to the given ids when there are any
+        location_ids, chemical_ids = set(location_ids), set(chemical_ids)
+        return sorted(
+            pair for pair in self._series
+            if (not location_ids or pair[0] in location_ids) and (not chemical_ids or pair[1] in chemical_ids)
+        )
+
+    def rows(self, pair, start_day, end_day):
+        # the row range of one series between two days, found by bisecting its sorted dates
+        start, end = self._series[pair]
+        days = self.day[start:end]
+        return start + int(np.searchsorted(days, start_day, "left")), start + int(np.searchsorted(days, end_day, "right"))
+
+    def ranges(self, pairs, start_day, end_day):
+        # (pair, start, end) for each series that has readings between the two days
+        ranges = [(pair,) + self.rows(pair, start_day, end_day) for pair in pairs]
+        return [(pair, start, end) for pair, start, end in ranges if end > start]
+
+    def take(self, ranges, name):
+        # one column of the given row ranges, a view when there is only one range
+        column = getattr(self, name)
+        if len(ranges) == 1:
+            return column[ranges[0][1]:ranges[0][2]]
+        if not ranges:
+            return column[:0]
+        return np.concatenate([column[start:end] for _, start, end in ranges])
+
+    def date_order(self):
+        # every row in (day, id) order, and the days in that order, sorted once per store version
+        if self._date_order is None:
+            with self._date_lock:
+                if self._date_order is None:
+                    order = date_permutation(self.day, self.id)
+                    self._date_order = (order, np.asarray(self.day)[order])
+        return self._date_order
+
+    def _after(self, days, ids, after):
+        # the first position of a (day, id) ordered run of rows that comes after the cursor
+        first = int(np.searchsorted(days, after[0], "left"))
+        last = int(np.searchsorted(days, after[0], "right"))
+        return first + int(np.searchsorted(ids(first, last), after[1], "right"))
+
+    def search(self, pairs, start_day, end_day, after=None, limit=None):
+        # the id, value, day, location and chemical columns of the readings between two days, in (day, id) order as
+        # /rest/readings pages through them. after is the (day, id) the previous page ended on. each series is in
+        # (day, id) order already, so a page bisects to the cursor in each and merges at most limit rows of each,
+        # unless scanning the date ordered rows from the cursor until limit of them match would read fewer rows.
+        starts = []
+        for pair in pairs:
+            start, end = self.rows(pair, start_day, end_day)
+            if after is not None and end > start:
+                start += self._after(self.day[start:end], lambda a, b, start=start: self.id[start + a:start + b], after)
+            if end > start:
+                starts.append((start, end))
+        matching = sum(end - start for start, end in starts)
+        merged = sum(min(end - start, limit) for start, end in starts) if limit is not None else matching
+
+        if limit is not None and matching and len(starts) > 1:
+            order, days = self.date_order()
+            first = int(np.searchsorted(days, start_day, "left"))
+            if after is not None:
+                first = max(first, self._after(days, lambda a, b: self.id[order[a:b]], after))
+            last = int(np.searchsorted(days, end_day, "right"))
+            if limit * (last - first) / matching < merged:
+                return self._scan(pairs, order, first, last, limit)
+
+        rows = np.concatenate(
+            [np.arange(start, end if limit is None else min(end, start + limit)) for start, end in starts]
+        ) if starts else np.array([], dtype=np.int64)
+        rows = rows[np.lexsort((self.id[rows], self.day[rows]))][:limit]
+        return {name: np.asarray(getattr(self, name)[rows]) for name in names}
+
+    def _scan(self, pairs, order, first, last, limit):
+        # the first limit rows of the date ordered rows from first to last that belong to one of the pairs, read a
+        # growing block at a time
+        everything = len(pairs) == len(self._series)
+        width = max((chemical for _, chemical in self._series), default=0) + 1
+        wanted = np.array(sorted(location * width + chemical for location, chemical in pairs), dtype=np.int64)
+        found, total, size = [], 0, max(4096, 4 * limit)
+        while first < last and total < limit:
+            block = np.asarray(order[first:min(last, first + size)])
+            if not everything:
+                block = block[np.isin(
+                    self.location[block].astype(np.int64) * width + self.chemical[block], wanted
+                )]
+            found.append(block)
+            total += len(block)
+            first += size
+            size *= 2
+        rows = np.concatenate(found)[:limit] if found else np.array([], dtype=np.int64)
+        return {name: np.asarray(getattr(self, name)[rows]) for name in names}
+
+
+def date_permutation(day, id):
+    # the permutation that puts rows in (day, id) order, as the loader writes it to date_order.npy
+    return np.lexsort((id, day)).astype(np.int64)
+
+
+def row_chunks(columns, size):
+    # search() columns as lists of (id, value, sample date, location id, chemical id) rows, the shape of a
+    # /rest/readings query's result
+    for start in range(0, len(columns["id"]), size):
+        end = start + size
+        yield list(zip(
+            columns["id"][start:end].tolist(),
+            columns["value"][start:end].tolist(),
+            np.datetime_as_string(columns["day"][start:end].astype("datetime64[D]")).tolist(),
+            columns["location"][start:end].tolist(),
+            columns["chemical"][start:end].tolist(),
+        ))
+
+
+class ColumnStore(object):
+    # the memory mapped column store, used in place of the readings table for as long as it was written from the
+    # current waterway_reading data version. the loader's current pointer and the data version are checked at most
+    # once every check_interval seconds, and None is returned while the store is missing or stale.
+
+    def __init__(self, app=None):
+        self.path = None
+        self.check_interval = 5
+        self._columns = None
+        self._store = None
+        self._opened = None
+        self._checked = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        path = app.config.get("COLUMN_STORE_PATH")
+        if path is None and not app.config.get("DATABASE_URL"):
+            from .database import default_sqlite_path
+            # next to the database, which may be a link to the loader's copy
+            path = pathlib.Path(app.config.get("SQLITE_PATH") or default_sqlite_path).resolve().with_suffix(".columns")
+        self.path = pathlib.Path(path) if path else None
+        self.check_interval = app.config.get("COLUMN_STORE_CHECK_INTERVAL", self.check_interval)
+
+    def current(self):
+        if self.path is None:
+            return None
+        if time.monotonic() - self._checked > self.check_interval:
+            with self._lock:
+                if time.monotonic() - self._checked > self.check_interval:
+                    self._refresh()
+        return self._columns
+
+    def _refresh(self):
+        from .models import DataVersion
+
+        self._checked = time.monotonic()
+        try:
+            name = (self.path / "current").read_text().strip()
+        except OSError:
+            self._columns = self._store = self._opened = None
+            return
+        if name != self._opened:
+            try:
+                self._store = ReadingColumns.open(self.path / name)
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"The column store {self.path / name} could not be opened: {e}")
+                self._columns = self._store = self._opened = None
+                return
+            self._opened = name
+            logger.info(f"Column store {self.path / name} opened, {len(self._store)} readings.")
+        # a store written before the last load is missing readings the table has
+        self._columns = self._store if self._store.version == DataVersion.current() else None
+
+column_store = ColumnStore()
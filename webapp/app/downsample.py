@@ -0,0 +1,163 @@
+import numpy as np
+
+# pandas is imported by the functions below rather than here, so it loads with the first chart, see
+# models.plotting_modules. they are only ever given a DataFrame, by which time it is already loaded.
+facets = ["location", "measure"]
+
+# coarsest last, so the first resolution that fits the point budget keeps the most detail
+resolutions = ["daily", "weekly", "monthly", "yearly"]
+
+
+def _period_codes(dates, resolution):
+    days = dates.values.astype("datetime64[D]").astype(np.int64)
+    if resolution == "daily":
+        return days
+    if resolution == "weekly":
+        return (days + 3) // 7  # 1970-01-01 was a thursday, so this starts weeks on mondays
+    months = dates.values.astype("datetime64[M]").astype(np.int64)
+    if resolution == "monthly":
+        return months
+    return months // 12
+
+
+def _period_starts(codes, resolution):
+    if resolution == "daily":
+        return codes.astype("datetime64[D]")
+    if resolution == "weekly":
+        return (codes * 7 - 3).astype("datetime64[D]")
+    if resolution == "monthly":
+        return codes.astype("datetime64[M]").astype("datetime64[D]")
+    return codes.astype("datetime64[Y]").astype("datetime64[D]")
+
+
+def _facet_codes(df):
+    import pandas
+
+    codes = np.zeros(len(df), dtype=np.int64)
+    for column in facets:
+        column_codes = pandas.Categorical(df[column]).codes.astype(np.int64)
+        codes = codes * (column_codes.max() + 2) + column_codes + 1
+    return codes
+
+
+def choose_resolution(df, budget):
+    facet_codes = _facet_codes(df)
+    for resolution in resolutions:
+        periods = _period_codes(df["sample_date"], resolution)
+        periods = periods - periods.min()
+        if len(np.unique(facet_codes * (periods.max() + 1) + periods)) <= budget:
+            return resolution
+    return resolutions[-1]
+
+
+def temporal_bins(df, resolution):
+    # one row per facet and period, with the mean value and the spread of the readings that were binned into it
+    import pandas
+
+    periods = pandas.Series(_period_codes(df["sample_date"], resolution), index=df.index, name="period")
+    grouped = df.groupby([df[column] for column in facets] + [periods], observed=True, sort=True)["value"]
+    binned = grouped.agg(["mean", "min", "max", "count"]).reset_index()
+    binned["sample_date"] = _period_starts(binned["period"].values, resolution)
+    binned = binned.drop(columns="period").rename(columns={"mean": "value", "min": "value_min", "max": "value_max"})
+    binned["error_plus"] = binned["value_max"] - binned["value"]
+    binned["error_minus"] = binned["value"] - binned["value_min"]
+    return binned
+
+
+def bin_counts(df, resolution):
+    # histograms of sample dates become one bar per facet and period, so only the counts are sent to the browser
+    import pandas
+
+    periods = pandas.Series(_period_codes(df["sample_date"], resolution), index=df.index, name="period")
+    counts = df.groupby([df[column] for column in facets] + [periods], observed=True, sort=True).size()
+    counts = counts.reset_index(name="count")
+    counts["sample_date"] = _period_starts(counts["period"].values, resolution)
+    return counts.drop(columns="period")
+
+
+def lttb_indices(x, y, starts, ends, threshold):
+    # largest triangle three buckets over many series at once, each the starts[s]:ends[s] slice of x and y with more
+    # than threshold points. it keeps the first and last points, then from each bucket the point forming the largest
+    # triangle with the previously kept point and the average of the next bucket. that makes a series' buckets
+    # sequential, but the series are independent, so each step picks from bucket i of every series in one set of array
+    # operations. the next bucket averages don't depend on what was kept, so they are all worked out first.
+    count = len(starts)
+    x = x - np.repeat(x[starts], ends - starts)  # from each series' first point, which keeps the sums small
+
+    # edges[s, i] is where bucket i of series s starts, and edges[s, -1] where the series ends
+    edges = np.linspace(1, ends - starts - 1, threshold - 1, axis=1).astype(np.int64) + starts[:, None]
+    edges = np.concatenate([edges, ends[:, None]], axis=1)
+    sums_x = np.concatenate([[0.0], np.cumsum(x)])
+    sums_y = np.concatenate([[0.0], np.cumsum(y)])
+    lengths = edges[:, 1:] - edges[:, :-1]
+    avg_x = (sums_x[edges[:, 1:]] - sums_x[edges[:, :-1]]) / lengths
+    avg_y = (sums_y[edges[:, 1:]] - sums_y[edges[:, :-1]]) / lengths
+
+    # the buckets that points are picked from, ordered by bucket and then series, so that bucket i of every series is
+    # the slice order[bounds[i]:bounds[i + 1]]
+    lengths = lengths[:, :-1].T.ravel()
+    offsets = np.cumsum(lengths) - lengths
+    order = np.arange(lengths.sum()) - np.repeat(offsets - edges[:, :-2].T.ravel(), lengths)
+    bounds = np.concatenate([[0], np.cumsum(lengths.reshape(threshold - 2, count).sum(axis=1))])
+    next_x = np.repeat(avg_x[:, 1:].T.ravel(), lengths)
+    next_y = np.repeat(avg_y[:, 1:].T.ravel(), lengths)
+    bucket_x, bucket_y = x[order], y[order]
+
+    selected = np.empty((count, threshold), dtype=np.int64)
+    selected[:, 0], selected[:, -1] = starts, ends - 1
+    a = starts
+    for i in range(threshold - 2):
+        lo, hi = bounds[i], bounds[i + 1]
+        if count == 1:
+            # one series: the kept point broadcasts, and its bucket's first largest area is just the argmax
+            area = np.abs(
+                (x[a] - next_x[lo:hi]) * (bucket_y[lo:hi] - y[a]) - (x[a] - bucket_x[lo:hi]) * (next_y[lo:hi] - y[a])
+            )
+            a = order[lo + area.argmax()]
+        else:
+            bucket_lengths = lengths[i * count:(i + 1) * count]
+            a_x, a_y = np.repeat(x[a], bucket_lengths), np.repeat(y[a], bucket_lengths)
+            area = np.abs(
+                (a_x - next_x[lo:hi]) * (bucket_y[lo:hi] - a_y) - (a_x - bucket_x[lo:hi]) * (next_y[lo:hi] - a_y)
+            )
+            # the first largest area of each series' bucket
+            bucket_offsets = offsets[i * count:(i + 1) * count] - lo
+            largest = np.flatnonzero(area >= np.repeat(np.maximum.reduceat(area, bucket_offsets), bucket_lengths))
+            a = order[lo + largest[np.searchsorted(largest, bucket_offsets)]]
+        selected[:, i + 1] = a
+    return selected.ravel()
+
+
+def lttb(df, budget):
+    df = df.sort_values(facets + ["sample_date"])
+    groups = df.groupby(facets, observed=True, sort=False).indices
+    per_facet = max(budget // max(len(groups), 1), 3)
+
+    # sorted by facet, so each facet's rows are one run of positions. the facets within their share are kept whole.
+    starts = np.array([positions[0] for positions in groups.values()], dtype=np.int64)
+    ends = starts + np.array([len(positions) for positions in groups.values()], dtype=np.int64)
+    reduce = ends - starts > per_facet
+    keep = [np.arange(start, end) for start, end in zip(starts[~reduce], ends[~reduce])]
+    if reduce.any():
+        # in days, whole numbers that the bucket sums add up exactly, so readings on the same day as the previously
+        # kept point and the next bucket still tie at an area of 0 and the first of them is kept
+        x = df["sample_date"].values.astype("datetime64[ns]").astype(np.int64) / 86400e9
+        y = df["value"].values.astype(np.float64)
+        keep.append(lttb_indices(x, y, starts[reduce], ends[reduce], per_facet))
+    return df.iloc[np.sort(np.concatenate(keep))] if keep else df
+
+
+def reduce_points(df, chart_type, budget, method="bin"):
+    # returns the frame to plot and the resolution it was reduced to, "raw" when it was already within the budget
+    if len(df) <= budget:
+        return df, "raw"
+
+    if chart_type == "histogram":
+        resolution = choose_resolution(df, budget)
+        return bin_counts(df, resolution), resolution
+
+    if method == "lttb":
+        return lttb(df, budget), "lttb"
+
+    resolution = choose_resolution(df, budget)
+    return temporal_bins(df, resolution), resolution
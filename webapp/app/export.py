@@ -0,0 +1,89 @@
+import io
+from flask import current_app, stream_with_context
+
+
+def _pyarrow():
+    # imported on the first arrow or parquet export rather than with every worker, see models.plotting_modules
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:  # the csv export works without it
+        return None
+    return pyarrow
+
+
+formats = {
+    "csv": "text/csv",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+extensions = {"csv": "csv", "arrow": "arrows", "parquet": "parquet"}
+
+
+def decode_blobs(df):
+    # unit names are stored as blobs
+    for column in df.columns:
+        if df[column].dtype == object and len(df) and isinstance(df[column].iloc[0], bytes):
+            df[column] = df[column].str.decode("utf-8")
+    return df
+
+
+def _csv(frames):
+    header = True
+    for df in frames:
+        yield decode_blobs(df).to_csv(index=False, header=header, date_format="%Y-%m-%d")
+        header = False
+
+
+def _arrow(frames):
+    # the ipc stream format is written a record batch at a time, so it can be sent while the query is still running
+    pyarrow = _pyarrow()
+    sink = io.BytesIO()
+    writer = None
+    for df in frames:
+        batch = pyarrow.RecordBatch.from_pandas(decode_blobs(df), preserve_index=False)
+        if writer is None:
+            writer = pyarrow.ipc.new_stream(sink, batch.schema)
+        writer.write_batch(batch)
+        yield sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+    if writer is not None:
+        writer.close()
+        yield sink.getvalue()
+
+
+def _parquet(frames):
+    # parquet needs its footer before it can be read, so one row group is written per frame and the file is sent
+    # once it is complete
+    pyarrow = _pyarrow()
+    sink = io.BytesIO()
+    writer = None
+    for df in frames:
+        table = pyarrow.Table.from_pandas(decode_blobs(df), preserve_index=False)
+        if writer is None:
+            writer = pyarrow.parquet.ParquetWriter(sink, table.schema, compression="snappy")
+        writer.write_table(table)
+    if writer is not None:
+        writer.close()
+    yield sink.getvalue()
+
+
+_writers = {"csv": _csv, "arrow": _arrow, "parquet": _parquet}
+
+
+def export(frames, fmt, name):
+    # frames is an iterable of DataFrames sharing the same columns and dtypes. categorical columns should share
+    # their categories too, so arrow can reuse one dictionary for every batch.
+    if fmt not in formats:
+        return {"message": f"Unknown format, expected one of: {', '.join(['json'] + list(formats))}."}, 400
+    if fmt != "csv" and _pyarrow() is None:
+        return {"message": f"The {fmt} format requires pyarrow, which is not installed."}, 501
+
+    response = current_app.response_class(
+        stream_with_context(_writers[fmt](frames)),
+        mimetype=formats[fmt]
+    )
+    response.headers["Content-Disposition"] = f"attachment; filename={name}.{extensions[fmt]}"
+    return response, 200
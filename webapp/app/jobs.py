@@ -0,0 +1,170 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .cache import chart_cache
+from .profiling import recording
+
+logger = logging.getLogger("gunicorn.error")
+
+
+class Job(object):
+
+    def __init__(self, id):
+        self.id = id
+        self.status = "queued"
+        self.stage = None
+        self.progress = 0.0
+        self.result = None
+        self.message = None
+        self.status_code = None
+        self.timings = None
+        self.requests = 1
+        self.updated = time.monotonic()
+
+    @classmethod
+    def shared(cls, state):
+        # a job another gunicorn worker is running, as it last wrote it to the chart cache directory
+        job = cls(state["id"])
+        job.status, job.stage, job.progress = state["status"], state["stage"], state["progress"]
+        job.message, job.status_code = state["message"], state["status_code"]
+        return job
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed")
+
+    def json(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": round(self.progress, 2),
+            "message": self.message,
+            "uri": f"/chart/job/{self.id}"
+        }
+
+    def state(self):
+        return dict(self.json(), status_code=self.status_code)
+
+
+class JobQueue(object):
+    # renders charts on a bounded pool of threads outside of the request that asked for them, so gunicorn's request
+    # timeout no longer applies. jobs are keyed by their chart cache key: asking for a chart that is already queued
+    # or running joins that job instead of starting another. progress is pushed to the socket.io room named after
+    # the job id, and finished jobs are kept for retention seconds so their results can be collected.
+    #
+    # each gunicorn worker has its own queue. with more than one worker, CHART_CACHE_DIR must be a directory they all
+    # share, where every job's status and result is written so a poll reaching another worker finds them, and
+    # SOCKETIO_MESSAGE_QUEUE must be set so progress reaches clients connected to another worker.
+
+    def __init__(self, app=None, socketio=None):
+        self.workers = 2
+        self.max_pending = 32
+        self.retention = 300
+        self.app = None
+        self.socketio = None
+        self._jobs = {}
+        self._executor = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app, socketio)
+
+    def init_app(self, app, socketio=None):
+        self.app = app
+        self.socketio = socketio
+        self.workers = app.config.get("CHART_JOB_WORKERS", self.workers)
+        self.max_pending = app.config.get("CHART_JOB_QUEUE", self.max_pending)
+        self.retention = app.config.get("CHART_JOB_RETENTION", self.retention)
+
+    def _pool(self):
+        # started on first use rather than in init_app, so each forked gunicorn worker gets its own threads
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="chart-job")
+        return self._executor
+
+    def _prune(self):
+        expired = time.monotonic() - self.retention
+        for id in [id for id, job in self._jobs.items() if job.finished and job.updated < expired]:
+            del self._jobs[id]
+        chart_cache.prune_jobs(self.retention)
+
+    @property
+    def shared(self):
+        # whether a job this worker doesn't know about would have been written where it can see it
+        return chart_cache.directory is not None
+
+    def get(self, id):
+        with self._lock:
+            job = self._jobs.get(id)
+        if job is None:
+            state = chart_cache.get_job(id)
+            if state is not None:
+                job = Job.shared(state)
+        return job
+
+    def submit(self, id, func, **kwargs):
+        # returns the job and whether it was already running, or (None, False) when the queue is full.
+        # func is called as func(progress=callback, **kwargs) inside an application context and returns a
+        # (result, status code) pair, where 201 means the chart was rendered.
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(id)
+            if job is not None and job.status != "failed":
+                job.requests += 1
+                return job, True
+            if sum(1 for job in self._jobs.values() if not job.finished) >= self.max_pending:
+                return None, False
+            job = self._jobs[id] = Job(id)
+            chart_cache.put_job(id, job.state())
+            self._pool().submit(self._run, job, func, kwargs)
+            return job, False
+
+    def finished(self, id, result):
+        # records a result that was produced without rendering, e.g. from the chart cache
+        with self._lock:
+            job = self._jobs.get(id)
+            if job is None or job.finished:
+                job = self._jobs[id] = Job(id)
+                job.status, job.progress, job.result, job.status_code = "done", 1.0, result, 201
+                chart_cache.put_job(id, job.state())
+        return job
+
+    def _update(self, job, **changes):
+        for name, value in changes.items():
+            setattr(job, name, value)
+        job.updated = time.monotonic()
+        chart_cache.put_job(job.id, job.state())
+        self.emit(job)
+
+    def emit(self, job, to=None):
+        if self.socketio is not None:
+            self.socketio.emit("chart_job", job.json(), to=to or job.id)
+
+    def _run(self, job, func, kwargs):
+        started = time.monotonic()
+        with self.app.app_context(), recording() as timings:
+            self._update(job, status="running")
+
+            def progress(stage, fraction):
+                self._update(job, stage=stage, progress=fraction)
+
+            try:
+                result, status_code = func(progress=progress, **kwargs)
+            except Exception:
+                logger.exception(f"Chart job {job.id} failed")
+                result, status_code = {"message": "The chart could not be rendered."}, 500
+            if timings is not None:
+                job.timings = timings.header()
+
+        if status_code == 201:
+            self._update(job, status="done", progress=1.0, result=result, status_code=status_code)
+        else:
+            self._update(job, status="failed", message=result.get("message"), status_code=status_code)
+        logger.info(
+            f"Chart job {job.id[:12]} {job.status} in {time.monotonic() - started:.2f}s "
+            f"for {job.requests} request(s){': ' + timings.summary() if timings is not None else ''}"
+        )
+
+
+chart_jobs = JobQueue()
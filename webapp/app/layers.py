@@ -0,0 +1,61 @@
+import json
+import pathlib
+import threading
+from flask import request
+from shapely.geometry import shape, mapping
+from .payload import Payload
+
+layers_dir = pathlib.Path(__file__).resolve().parent / "static" / "data"
+layers = ("lakes", "rivers")
+
+# web mercator tiles are 256px wide and cover 360 / 2^zoom degrees, so simplifying to half a pixel at a zoom level
+# is invisible there. past max_zoom the original geometry is sent.
+min_zoom, max_zoom = 10, 18
+
+_payloads = {}
+_lock = threading.Lock()
+
+
+def tolerance(zoom):
+    return 180 / (256 * 2 ** zoom)
+
+
+def _round(coordinates, digits):
+    if not coordinates:
+        return []
+    if isinstance(coordinates[0], (int, float)):
+        return [round(c, digits) for c in coordinates]
+    return [_round(c, digits) for c in coordinates]
+
+
+def _simplified(name, zoom):
+    collection = json.loads((layers_dir / f"{name}.geojson").read_text())
+    if zoom < max_zoom:
+        for feature in collection["features"]:
+            geometry = mapping(shape(feature["geometry"]).simplify(tolerance(zoom), preserve_topology=True))
+            feature["geometry"] = {"type": geometry["type"], "coordinates": _round(geometry["coordinates"], 7)}
+    return Payload.json(collection, max_age=86400)
+
+
+def layer_payload(name, zoom=None):
+    # the static layers only change with a deploy, so each zoom level is simplified and compressed once per process
+    if name not in layers:
+        return None
+    zoom = max_zoom if zoom is None else min(max(zoom, min_zoom), max_zoom)
+    key = (name, zoom)
+    if key not in _payloads:
+        with _lock:
+            if key not in _payloads:
+                _payloads[key] = _simplified(name, zoom)
+    return _payloads[key]
+
+
+def layer_response(name):
+    try:
+        zoom = int(request.args["zoom"]) if request.args.get("zoom") else None
+    except ValueError:
+        return {"message": "The zoom must be a whole number."}, 400
+    payload = layer_payload(name, zoom)
+    if payload is None:
+        return {"message": "Not found."}, 404
+    return payload.response()
@@ -0,0 +1,135 @@
+import logging
+import threading
+from .refdata import reference_data
+
+logger = logging.getLogger("gunicorn.error")
+
+
+def _ids(values):
+    try:
+        return {int(value) for value in values or []}
+    except (TypeError, ValueError):
+        return None
+
+
+class ReadingFeed(object):
+    # pushes readings that db-ingest inserts to the clients subscribed to their location and measure. db-ingest
+    # journals every reading it inserts to reading_change, and a background task follows that journal every interval
+    # seconds. everything that arrived for a location/measure pair in one interval is sent as a single event, and a
+    # pair that received more than max_rows readings only gets a count, so a large ingest can't flood the sockets.
+    #
+    # subscriptions are held by the process the client is connected to, and events are only sent to those clients,
+    # so each gunicorn worker can follow the journal on its own.
+
+    def __init__(self, app=None, socketio=None):
+        self.interval = 2
+        self.max_rows = 1000
+        self.batch_size = 50000
+        self.app = None
+        self.socketio = None
+        self._rooms = {}
+        self._subscriptions = {}
+        self._cursor = None
+        self._task = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app, socketio)
+
+    def init_app(self, app, socketio=None):
+        self.app = app
+        self.socketio = socketio
+        self.interval = app.config.get("READING_FEED_INTERVAL", self.interval)
+        self.max_rows = app.config.get("READING_FEED_MAX_ROWS", self.max_rows)
+
+    def subscribe(self, sid, locations, measures):
+        # empty lists mean every location or measure, as they do for charts. returns the subscribed pairs, or None
+        # when the ids aren't valid
+        from .models import ReadingChange
+
+        locations, measures = _ids(locations), _ids(measures)
+        if locations is None or measures is None:
+            return None
+        reference = reference_data.current()
+        locations = locations or {l.id for l in reference.sensors}
+        measures = measures or {c.id for c in reference.chemicals}
+        rooms = {(l, c) for l in locations for c in measures if reference.location(l) and reference.chemical(c)}
+
+        with self._lock:
+            self._unsubscribe(sid)
+            self._subscriptions[sid] = rooms
+            for room in rooms:
+                self._rooms.setdefault(room, set()).add(sid)
+            if self._cursor is None:
+                self._cursor = ReadingChange.latest()
+            if self._task is None:
+                # started on first use, so each forked gunicorn worker runs its own
+                self._task = self.socketio.start_background_task(self._run)
+        return sorted(rooms)
+
+    def unsubscribe(self, sid):
+        with self._lock:
+            self._unsubscribe(sid)
+
+    def _unsubscribe(self, sid):
+        for room in self._subscriptions.pop(sid, ()):
+            sids = self._rooms.get(room)
+            sids.discard(sid)
+            if not sids:
+                del self._rooms[room]
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.interval)
+            try:
+                with self.app.app_context():
+                    self.poll()
+            except Exception:
+                logger.exception("Reading feed poll failed")
+
+    def poll(self):
+        from .models import ReadingChange
+
+        # the cursor is read, the journal fetched and the cursor advanced under the lock, so two polls can't both send
+        # the same changes or move it backwards. only the emits happen outside of it.
+        with self._lock:
+            rooms = {room: set(sids) for room, sids in self._rooms.items()}
+            if not rooms:
+                # nobody is listening, so the next subscriber starts from whatever is new from then on
+                self._cursor = None
+                return
+            if self._cursor is None:
+                self._cursor = ReadingChange.latest()
+                return
+
+            deltas = {}
+            while True:
+                changes = ReadingChange.since(self._cursor, self.batch_size)
+                for change_id, reading_id, location_id, chemical_id, sample_date, value in changes:
+                    room = (location_id, chemical_id)
+                    if room in rooms:
+                        delta = deltas.setdefault(room, {"count": 0, "readings": []})
+                        delta["count"] += 1
+                        if delta["count"] <= self.max_rows:
+                            delta["readings"].append([reading_id, sample_date, value])
+                if changes:
+                    self._cursor = changes[-1][0]
+                if len(changes) < self.batch_size:
+                    break
+            cursor = self._cursor
+
+        for (location_id, chemical_id), delta in deltas.items():
+            truncated = delta["count"] > self.max_rows
+            event = {
+                "location": location_id,
+                "measure": chemical_id,
+                "cursor": cursor,
+                "count": delta["count"],
+                "truncated": truncated,
+                # a truncated delta is only a hint to reload, rather than an arbitrary part of what arrived
+                "readings": [] if truncated else delta["readings"]
+            }
+            for sid in rooms[(location_id, chemical_id)]:
+                self.socketio.emit("readings", event, to=sid)
+
+
+reading_feed = ReadingFeed()
@@ -0,0 +1,166 @@
+import os
+import time
+from flask import g, request, current_app
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+
+try:
+    import prometheus_client
+    from prometheus_client import Counter, Histogram, CollectorRegistry
+    from prometheus_client.core import GaugeMetricFamily
+    from prometheus_client import multiprocess
+except ImportError:  # the app runs without metrics
+    prometheus_client = None
+
+_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+if prometheus_client is not None:
+    # under gunicorn every worker writes these to PROMETHEUS_MULTIPROC_DIR, and /metrics adds them up
+    request_duration = Histogram(
+        "waterways_http_request_duration_seconds", "Time spent answering requests, by route.",
+        ["method", "route", "status"], buckets=_buckets
+    )
+    chart_duration = Histogram(
+        "waterways_chart_render_duration_seconds", "Time spent rendering charts, by chart type.",
+        ["chart_type", "status"], buckets=_buckets
+    )
+    chart_requests = Counter(
+        "waterways_chart_requests_total", "Chart requests, by whether the cache or a running job answered them.",
+        ["cache"]
+    )
+    cache_lookups = Counter(
+        "waterways_cache_lookups_total", "Cache lookups, by cache and the tier that answered them.",
+        ["cache", "result"]
+    )
+    query_duration = Histogram(
+        "waterways_db_query_duration_seconds", "Time spent running sql statements.", buckets=_buckets
+    )
+
+
+def observe_chart(chart_type, seconds, status):
+    if prometheus_client is not None:
+        chart_duration.labels(chart_type or "unknown", status).observe(seconds)
+
+
+def count_chart_request(cache):
+    if prometheus_client is not None:
+        chart_requests.labels(cache).inc()
+
+
+def count_lookup(cache, result):
+    if prometheus_client is not None:
+        cache_lookups.labels(cache, result).inc()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # on the statement's execution context, so one that raises doesn't skew the next on the same pooled connection
+    if context is not None:
+        context.metrics_query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "metrics_query_started", None)
+    if started is not None:
+        query_duration.observe(time.perf_counter() - started)
+
+
+def _timestamp(value):
+    return time.mktime(value.timetuple())
+
+
+class DatabaseCollector(object):
+    # figures read from the database when /metrics is scraped, rather than counted by every worker: reading and
+    # reference data counts, data versions and their age, and what the loaders last loaded
+
+    def collect(self):
+        from .models import db, DataVersion, LoadedFile, WaterwayReading
+        from .refdata import reference_data
+
+        reference = reference_data.current()
+        yield GaugeMetricFamily("waterways_locations", "Number of locations.", value=len(reference.locations))
+        yield GaugeMetricFamily("waterways_chemicals", "Number of chemicals.", value=len(reference.chemicals))
+
+        try:
+            # the rollup holds every reading once, and is far smaller than the readings table
+            readings = db.session.execute(
+                db.text("select coalesce(sum(total), 0) from location_chemical_weekday_count")
+            ).scalar()
+            yield GaugeMetricFamily("waterways_readings", "Number of waterway readings.", value=readings)
+
+            versions = GaugeMetricFamily("waterways_data_version", "Version stamp of each data set.", labels=["name"])
+            ages = GaugeMetricFamily(
+                "waterways_data_age_seconds", "Seconds since each data set last changed.", labels=["name"]
+            )
+            for name, version, updated_at in db.session.query(
+                DataVersion.name, DataVersion.version, DataVersion.updated_at
+            ):
+                versions.add_metric([name], version)
+                ages.add_metric([name], time.time() - _timestamp(updated_at))
+            yield versions
+            yield ages
+
+            files, loaded_at = db.session.query(db.func.count(LoadedFile.id), db.func.max(LoadedFile.loaded_at)).one()
+            yield GaugeMetricFamily("waterways_loaded_files", "Number of files the loaders have read.", value=files)
+            if loaded_at:
+                yield GaugeMetricFamily(
+                    "waterways_loader_lag_seconds", "Seconds since the loaders last read a file.",
+                    value=time.time() - _timestamp(loaded_at)
+                )
+        except OperationalError:
+            # databases loaded before these tables existed
+            db.session.rollback()
+
+        newest = WaterwayReading.max_sample_date()
+        if newest:
+            yield GaugeMetricFamily(
+                "waterways_newest_sample_timestamp_seconds", "Sample date of the newest reading.",
+                value=_timestamp(newest)
+            )
+
+
+class Metrics(object):
+    # prometheus metrics for /metrics. request latency is observed from before_request to after_request, so the
+    # time spent streaming a response body is not included.
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if prometheus_client is None:
+            return
+        if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+            event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    def _before_request(self):
+        g.metrics_started = time.perf_counter()
+
+    def _after_request(self, response):
+        started = g.pop("metrics_started", None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+            request_duration.labels(request.method, route, str(response.status_code)).observe(
+                time.perf_counter() - started
+            )
+        return response
+
+    def response(self):
+        if prometheus_client is None:
+            return {"message": "Metrics require prometheus_client, which is not installed."}, 501
+        registry = CollectorRegistry()
+        if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            for collector in (request_duration, chart_duration, chart_requests, cache_lookups, query_duration):
+                registry.register(collector)
+        registry.register(DatabaseCollector())
+        response = current_app.response_class(prometheus_client.generate_latest(registry))
+        response.headers["Content-Type"] = prometheus_client.CONTENT_TYPE_LATEST
+        return response
+
+
+metrics = Metrics()
@@ -3,21 +3,31 @@ import logging
 import pathlib
 import os
 import datetime
+import time
 import ast
+import json
 import random
 import numpy as np
-import pandas
-import plotly.express as px
-import plotly.offline.offline as poff
 from io import BytesIO
-from matplotlib import pyplot
-from matplotlib import dates as mdates
 from operator import or_
 from flask_sqlalchemy import SQLAlchemy
-from flask import request, url_for, send_file, make_response
+from flask import request, url_for, send_file, make_response, current_app, stream_with_context
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy import or_, func
+from sqlalchemy import or_, func, type_coerce
 from sqlalchemy.sql.operators import endswith_op
+from sqlalchemy.exc import OperationalError
+from ..cache import chart_cache
+from ..jobs import Job, chart_jobs
+from ..downsample import reduce_points
+from ..export import export, decode_blobs
+from ..refdata import reference_data
+from ..profiling import stage
+from ..metrics import observe_chart, count_chart_request
+from ..stats import reading_stats, buckets, default_percentiles
+from ..columns import column_store, row_chunks, day_number
+from ..anomalies import anomaly_detector, methods as anomaly_methods
+from ..propagation import propagation, buckets as propagation_buckets
+from ..queries import chart_readings, search_readings
 
 
 
@@ -25,6 +35,9 @@ db = SQLAlchemy()
 viz_dir = pathlib.PurePath("/viz")
 logger = logging.getLogger("gunicorn.error")
 max_plots = 5
+# pandas, plotly and matplotlib are most of a worker's start up and only charts and exports use them, so they are
+# imported where they are used, on the first such request. warm_up in main.py imports them ahead of time instead.
+plotting_modules = ("pandas", "plotly.express", "plotly.offline.offline", "matplotlib.pyplot")
 
 class Plotter(object):
 
@@ -66,56 +79,230 @@ class Plotter(object):
         start_date = kwargs.get("start_date")
         end_date = kwargs.get("end_date")
 
-        frames = []
-        for i, measure in enumerate(measure_objects):
-            for j, location in enumerate(location_objects):
-                query = db.session.query(
-                    WaterwayReading.id,
-                    Location.display.label("location"),
-                    Location.longitude,
-                    Location.latitude,
-                    WaterwayReading.sample_date.label("sample_date"), 
-                    WaterwayReading.value.label("value"),
-                    Chemical.display + "(" + UnitOfMeasure.unit_name + ")",
-                    UnitOfMeasure.unit_name.label("unit"),
-                ).join(
-                    Chemical, WaterwayReading.chemical_id == Chemical.id
-                ).join(
-                    Location, WaterwayReading.location_id == Location.id
-                ).join(
-                    UnitOfMeasure, Chemical.unit_of_measure_id == UnitOfMeasure.id
-                ).filter(
-                    WaterwayReading.sample_date.between(start_date, end_date)
+        # a missing location or measure never filtered its pairs before, so it still doesn't
+        location_ids = [location.id if location else None for location in location_objects]
+        measure_ids = [measure.id if measure else None for measure in measure_objects]
+
+        started = time.perf_counter()
+        columns = column_store.current()
+        if columns is not None:
+            with stage("columns"):
+                df = Plotter.columns_frame(
+                    columns,
+                    [] if None in location_ids else location_ids,
+                    [] if None in measure_ids else measure_ids,
+                    start_date,
+                    end_date
                 )
-                if location:
-                    query = query.filter(WaterwayReading.location == location)
-                if measure:
-                    query = query.filter(WaterwayReading.chemical == measure)
-                frames.append(
-                    pandas.read_sql(
-                        query.statement.compile(compile_kwargs={"literal_binds": True}),
-                        db.session.bind
-                    )
-                )                
-        df = pandas.concat(frames)
-        df.columns = ["id", "location", "longitude", "latitude", "sample_date", "value", "measure", "unit"]
+            logger.info(
+                f"Plotter.retrieve_data: the column store returned {len(df)} rows for {len(measure_ids)} measure(s) "
+                f"and {len(location_ids)} location(s) in {time.perf_counter() - started:.3f}s"
+            )
+            return {
+                "dataframe": df,
+                "locations": location_objects,
+                "measures": measure_objects
+            }
+
+        df = Plotter.query_frame(
+            [] if None in location_ids else location_ids,
+            [] if None in measure_ids else measure_ids,
+            start_date,
+            end_date
+        )
+        logger.info(
+            f"Plotter.retrieve_data: 1 query returned {len(df)} rows for {len(measure_ids)} measure(s) and "
+            f"{len(location_ids)} location(s) in {time.perf_counter() - started:.3f}s"
+        )
         return {
             "dataframe": df, 
             "locations": location_objects,
             "measures": measure_objects
         }
                         
+    @staticmethod
+    def query_frame(location_ids, measure_ids, start_date, end_date):
+        # the frame of a chart's readings, read from the database. columns_frame must return exactly the same frame
+        # for the same parameters, which scripts/check-columns.py checks.
+        query = chart_readings(location_ids, measure_ids, start_date.date(), end_date.date())
+
+        with stage("query"):
+            rows = db.session.execute(query).fetchall()
+        with stage("frame"):
+            import pandas
+
+            columns = ["id", "location", "longitude", "latitude", "sample_date", "value", "measure", "unit"]
+            df = pandas.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+            df = decode_blobs(df).astype({
+                "id": "int64",
+                "location": "category",
+                "longitude": "float64",
+                "latitude": "float64",
+                "value": "float64",
+                "measure": "category",
+            })
+            df["sample_date"] = pandas.to_datetime(df["sample_date"], format="%Y-%m-%d").astype("datetime64[ns]")
+        return df
+
+    @staticmethod
+    def columns_frame(columns, location_ids, measure_ids, start_date, end_date):
+        # the frame retrieve_data's query returns, sliced from the column store. location and measure names, units
+        # and coordinates are repeated per series rather than joined per row.
+        import pandas
+
+        reference = reference_data.current()
+        ranges = columns.ranges(
+            columns.series(location_ids, measure_ids), day_number(start_date), day_number(end_date)
+        )
+        # the query's inner joins leave out readings of unknown locations and of chemicals without a unit, and its
+        # rows are in (chemical, location, date, id) order
+        ranges = sorted(
+            (
+                r for r in ranges
+                if reference.location(r[0][0]) is not None and getattr(reference.chemical(r[0][1]), "unit", None) is not None
+            ),
+            key=lambda r: (r[0][1], r[0][0])
+        )
+        counts = [end - start for _, start, end in ranges]
+        locations = [reference.location(pair[0]) for pair, _, _ in ranges]
+        chemicals = [reference.chemical(pair[1]) for pair, _, _ in ranges]
+
+        def category(values):
+            categories = sorted(set(values))
+            codes = np.repeat([categories.index(v) for v in values], counts).astype(np.int32)
+            return pandas.Categorical.from_codes(codes, categories)
+
+        return pandas.DataFrame({
+            "id": np.asarray(columns.take(ranges, "id"), dtype=np.int64),
+            "location": category([l.display for l in locations]),
+            "longitude": np.repeat([l.longitude for l in locations], counts).astype(np.float64),
+            "latitude": np.repeat([l.latitude for l in locations], counts).astype(np.float64),
+            "sample_date": columns.take(ranges, "day").astype("datetime64[D]").astype("datetime64[ns]"),
+            "value": np.asarray(columns.take(ranges, "value"), dtype=np.float64),
+            "measure": category([f"{c.display}({c.unit})" for c in chemicals]),
+            "unit": np.repeat(np.array([c.unit for c in chemicals], dtype=object), counts),
+        })
+
     @staticmethod
     def post(*args, **kwargs):
         chart_type = request.form.get("chart_type")
         if not chart_type:
             return {"message": "You must specify a chart type."}, 401
         else:
-            return Plotter.plot(**dict(request.form))
+            return Plotter.submit(**dict(request.form))
+
+    @staticmethod
+    def data():
+        # the frame a chart would be drawn from, for analysis outside of the browser
+        kwargs = dict(request.values)
+        fmt = kwargs.pop("format", "json")
+        kwargs.setdefault("locations", "[]")
+        kwargs.setdefault("measures", "[]")
+        df = Plotter.retrieve_data(**kwargs)["dataframe"]
+        if fmt == "json":
+            response = make_response(decode_blobs(df).to_json(orient="records", date_format="iso"))
+            response.mimetype = "application/json"
+            return response, 200
+        return export([df], fmt, "chart-data")
+
+    @staticmethod
+    def cache_params(**kwargs):
+        # the same chart can be asked for in many ways, e.g. ids in a different order or as strings, so the cache is
+        # keyed on a normalized copy of the request instead of the raw form. raises ValueError when the locations or
+        # measures are not a list of ids.
+        def ids(value):
+            try:
+                parsed = ast.literal_eval(value or "[]")
+                if not isinstance(parsed, (list, tuple)):
+                    raise ValueError(value)
+                return sorted({int(i) for i in parsed if str(i).strip()})
+            except (SyntaxError, TypeError):
+                raise ValueError(value)
+
+        def date(value):
+            try:
+                return datetime.datetime.strptime(value, "%Y-%m-%d").strftime("%Y-%m-%d") if value else ""
+            except ValueError:
+                return value
+
+        return {
+            "chart_type": kwargs.get("chart_type"),
+            "locations": ids(kwargs.get("locations")),
+            "measures": ids(kwargs.get("measures")),
+            "start_date": date(kwargs.get("start_date")),
+            "end_date": date(kwargs.get("end_date")),
+            "condenser": bool(kwargs.get("condenser")),
+        }
+
+    @staticmethod
+    def submit(**kwargs):
+        # charts are rendered by the job queue, the response only says where to find the result. progress is pushed
+        # to the job's socket.io room, and the finished chart is collected from /chart/job/<id>.
+        version = DataVersion.current()
+        chart_cache.check_version(version)
+        try:
+            key = chart_cache.key(version, **Plotter.cache_params(**kwargs))
+        except ValueError:
+            return {"message": "Locations and measures must be lists of ids."}, 400
+
+        if chart_cache.get(key) is not None:
+            job, cache = chart_jobs.finished(key, None), "hit"
+        else:
+            job, running = chart_jobs.submit(key, Plotter.render, key=key, **kwargs)
+            if job is None:
+                return {"message": "Too many charts are being drawn, please try again shortly."}, 503
+            cache = "coalesced" if running else "miss"
+        count_chart_request(cache)
+        return {**job.json(), "cache": cache}, 200 if job.status == "done" else 202
+
+    @staticmethod
+    def render(key, progress=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            response, status = Plotter.plot(progress=progress, **kwargs)
+        except Exception:
+            observe_chart(kwargs.get("chart_type"), time.perf_counter() - started, "error")
+            raise
+        observe_chart(kwargs.get("chart_type"), time.perf_counter() - started, "done" if status == 201 else "failed")
+        if status != 201:
+            return response, status
+        result = {
+            "html": response.get_data(as_text=True),
+            "resolution": response.headers["X-Chart-Resolution"]
+        }
+        chart_cache.put(key, result)
+        return result, status
+
+    @staticmethod
+    def job(id):
+        job = chart_jobs.get(id)
+        if job is not None and job.status == "failed":
+            return {"message": job.message}, job.status_code
+        if job is not None and not job.finished:
+            return job.json(), 202
+
+        result = job.result if job is not None and job.result else chart_cache.get(id)
+        if result is None and job is None and not chart_jobs.shared:
+            # without a shared chart cache directory the job may be running on another gunicorn worker, which this
+            # one cannot see, so it is reported as pending rather than missing
+            pending = Job(id)
+            pending.status = "pending"
+            return pending.json(), 202
+        if result is None:
+            return {"message": "Not found."}, 404
+        response = make_response(result["html"])
+        response.mimetype = "text/html"
+        response.headers["X-Chart-Resolution"] = result["resolution"]
+        if job is not None and job.timings:
+            # where the render, rather than this request, spent its time
+            response.headers["X-Chart-Timing"] = job.timings
+        return response, 200
 
 
     @staticmethod
     def save_plot(directory):
+        from matplotlib import pyplot
+
         path = str(viz_dir / directory)
         files = [os.path.join(path, f) for f in os.listdir(path) if os.path.isfile(os.path.join(path, f))]
         files.sort(key=lambda x: os.path.getmtime(x))
@@ -136,26 +323,28 @@ class Plotter(object):
 
         if "measures" not in exclude:
             measures = ast.literal_eval(kwargs.get("measures"))
+            reference = reference_data.current()
             measure_obj_list = []
             for m in measures:
                 measure_obj_list.append(
-                    Chemical.query.filter(Chemical.id == m).first()   
+                    reference.chemical(m)
                 )
             if not measure_obj_list:
-                out_args["measures"] = Chemical.query.all()
+                out_args["measures"] = list(reference.chemicals)
             else:    
                 out_args["measures"] = measure_obj_list
                 
         if "locations" not in exclude:
             locations = ast.literal_eval(kwargs.get("locations"))
+            reference = reference_data.current()
             location_obj_list = []
             for l in locations:
                 location_obj_list.append(
-                    Location.query.filter(Location.id == l).first()   
+                    reference.location(l)
                 )
             
             if not location_obj_list or kwargs.get("chart_type") == "density_heatmap":
-                out_args["locations"] = Location.query.all()
+                out_args["locations"] = list(reference.locations)
             else:
                 out_args["locations"] = location_obj_list
 
@@ -177,7 +366,13 @@ class Plotter(object):
 
 
     @staticmethod
-    def plot(**kwargs):
+    def plot(progress=None, **kwargs):
+        # plotly, and pandas with it, load on the first chart rather than with every worker, see plotting_modules
+        import plotly.express as px
+        import plotly.offline.offline as poff
+
+        progress = progress or (lambda stage, fraction: None)
+        progress("retrieving", 0.1)
         data = Plotter.retrieve_data(**kwargs)
         df = data["dataframe"]
         ct = kwargs["chart_type"]
@@ -219,20 +414,44 @@ class Plotter(object):
             return {"message": "You can only specify one measure type for a condensed chart."}, 400
         
         func = px.scatter if ct == "grad_scatter" else getattr(px, ct)
-        fig = func(
-            df, 
-            **in_kwargs
-        )
 
-        fig.for_each_annotation(lambda a: a.update(text=a.text.split("=")[-1]))
-        html = poff.plot(
-            fig, 
-            include_plotlyjs=False, 
-            output_type="div"
-        )
+        # above the point budget, the browser gets time binned (or lttb downsampled) points instead of every reading
+        reading_count = len(df)
+        progress("reducing", 0.4)
+        with stage("reduce"):
+            df, resolution = reduce_points(
+                df, ct, current_app.config.get("CHART_POINT_BUDGET", 20000), current_app.config.get("CHART_DOWNSAMPLE", "bin")
+            )
+        if resolution == "lttb":
+            in_kwargs["title"] = f"Downsampled to {len(df)} of {reading_count} readings"
+        elif resolution != "raw":
+            if ct == "histogram":
+                func = px.bar
+                in_kwargs["y"] = "count"
+            else:
+                in_kwargs["hover_data"] = ["value_min", "value_max", "count"]
+                if ct == "scatter":
+                    in_kwargs["error_y"] = "error_plus"
+                    in_kwargs["error_y_minus"] = "error_minus"
+            in_kwargs["title"] = f"{resolution.capitalize()} {'counts' if ct == 'histogram' else 'means'} of {reading_count} readings"
+
+        progress("rendering", 0.5)
+        with stage("figure"):
+            fig = func(
+                df, 
+                **in_kwargs
+            )
+            fig.for_each_annotation(lambda a: a.update(text=a.text.split("=")[-1]))
+        with stage("serialize"):
+            html = poff.plot(
+                fig, 
+                include_plotlyjs=False, 
+                output_type="div"
+            )
                 
         response = make_response(html)
         response.mimetype = "text/html"
+        response.headers["X-Chart-Resolution"] = resolution
         return response, 201
        
 
@@ -262,9 +481,10 @@ class Chemical(db.Model):
         if not id:
             return {"message": "Not found"}, 404
         else:
-            result = Chemical.query.filter_by(id=id).first()
+            reference = reference_data.current()
+            result = reference.chemical(id)
             if result:
-                return result.json, 200
+                return reference.chemical_json(result), 200
             else:
                 return {"message": "Measure not found."}, 404
 
@@ -276,13 +496,14 @@ class Chemical(db.Model):
             return {"results": []}, 200
         else:
             term = str(term).upper()
-            results = Chemical.query.filter(
-                or_(
-                    Chemical.name.like(f"{term}%"), 
-                    func.upper(Chemical.display).like(f"{term}%")
-                )
-            ).order_by(Chemical.name).all()
-            return {"results": [{"id": r.id, "text": f"{r.display} ({str(r.unit_of_measure)})"} for r in results]}, 200
+            results = sorted(
+                (
+                    c for c in reference_data.current().chemicals
+                    if c.name.upper().startswith(term) or c.display.upper().startswith(term)
+                ),
+                key=lambda c: c.name
+            )
+            return {"results": [{"id": r.id, "text": f"{r.display} ({r.unit})"} for r in results]}, 200
 
 
 
@@ -296,29 +517,29 @@ class Location(db.Model):
     latitude = db.Column(db.Numeric, nullable=False)
     location_type_id = db.Column(db.ForeignKey('location_type.id'))
 
-    location_type = db.relationship('LocationType', primaryjoin='Location.location_type_id == LocationType.id', backref='locations')
+    # joined, since every geojson feature reads it
+    location_type = db.relationship('LocationType', primaryjoin='Location.location_type_id == LocationType.id', backref='locations', lazy='joined')
 
 
     @staticmethod
     def all_sensors():
-        return Location.query.filter_by(
-            location_type=LocationType.query.filter_by(name="SENSOR").first()
-        ).order_by(Location.name).all()
+        return reference_data.current().sensors
 
 
     @staticmethod
     def get(id=None):
+        reference = reference_data.current()
         if id:
             if isinstance(id, str):
-                results = Location.query.filter_by(name=id.upper()).first()
+                results = reference.location_by_name(id)
             else:
-                results = Location.query.filter_by(id=id).first()
+                results = reference.location(id)
             if results:
-                response = results.geojson, 200
+                response = reference.location_json(results), 200
             else:
                 response = { "message" : "Not found." }, 404
         else:
-            response = Location.all_locations_geojson(include_waste=not(request.args.get("nowaste") == "Y")), 200
+            response = reference.feature_collection_payload(include_waste=not(request.args.get("nowaste") == "Y")).response()
         return response
 
     @hybrid_property
@@ -364,19 +585,7 @@ class Location(db.Model):
 
     @staticmethod
     def all_locations_geojson(include_waste=True):
-        if include_waste:
-            features = [location.geojson for location in Location.query.all()]
-        else:
-            features = [
-                location.geojson for location in Location.query.filter_by(
-                    location_type=LocationType.query.filter_by(name="SENSOR").first()
-                ).all()
-            ]
-        return {
-            "type": "FeatureCollection",
-            "name": "sensor-locations",
-            "features": features
-        }
+        return reference_data.current().feature_collection(include_waste)
     
 
 
@@ -408,6 +617,11 @@ class UnitOfMeasure(db.Model):
 
 class WaterwayReading(db.Model):
     __tablename__ = 'waterway_reading'
+    __table_args__ = (
+        db.Index('ix_waterway_reading_chemical_location_date', 'chemical_id', 'location_id', 'sample_date', 'value'),
+        db.Index('ix_waterway_reading_location_date', 'location_id', 'sample_date'),
+        db.Index('ix_waterway_reading_sample_date', 'sample_date'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     value = db.Column(db.Numeric, nullable=False)
@@ -448,30 +662,204 @@ class WaterwayReading(db.Model):
     @staticmethod
     def search():
         args = dict(request.args)
+        fmt = args.pop("format", "json")
+        compact = args.pop("compact", None) == "Y"
+        try:
+            limit = int(args.pop("limit")) if args.get("limit") else None
+            cursor = WaterwayReading.parse_cursor(args.pop("cursor", None))
+        except ValueError:
+            return {"message": "The limit must be a positive number and the cursor one returned by this endpoint."}, 400
+        if limit is not None and limit < 1:
+            return {"message": "The limit must be a positive number and the cursor one returned by this endpoint."}, 400
+
         args = WaterwayReading.transform_input(**args)
         
         location_ids = [loc.id for loc in args["locations"]]
         measure_ids = [ms.id for ms in args["measures"]]
-        query = WaterwayReading.query.filter(
-            db.between(
-                WaterwayReading.sample_date,
-                args["start_date"],
-                args["end_date"]
+        # with a limit, json pages read one extra row to tell whether there is a next page
+        rows_limit = limit + 1 if limit and fmt == "json" else limit
+
+        columns = column_store.current()
+        if columns is not None:
+            selection = columns.search(
+                columns.series(location_ids, measure_ids),
+                day_number(args["start_date"]),
+                day_number(args["end_date"]),
+                after=(day_number(cursor[0]), cursor[1]) if cursor else None,
+                limit=rows_limit
             )
-        )
+            rows = lambda size: row_chunks(selection, size)
+        else:
+            query = search_readings(
+                location_ids, measure_ids, args["start_date"].date(), args["end_date"].date(), cursor, rows_limit
+            )
+            rows = lambda size: db.session.execute(query).partitions(size)
+
+        if fmt != "json":
+            return export(WaterwayReading.frames(rows), fmt, "readings")
+        return current_app.response_class(
+            stream_with_context(WaterwayReading.stream(rows, limit, compact)),
+            mimetype="application/json"
+        ), 200
 
-        if location_ids:
-            query = query.filter(WaterwayReading.location_id.in_(location_ids))
-        if measure_ids:
-            query = query.filter(WaterwayReading.chemical_id.in_(measure_ids))
+    @staticmethod
+    def stats():
+        # count, mean, min, max, std and percentiles per location, measure and day/week/month/year
+        args = dict(request.args)
+        bucket = args.pop("bucket", "month")
+        if bucket not in buckets:
+            return {"message": f"The bucket must be one of {', '.join(buckets)}."}, 400
+        try:
+            percentiles = sorted(set(
+                float(p) for p in args.pop("percentiles", ",".join(str(p) for p in default_percentiles)).split(",")
+                if p.strip()
+            ))
+        except ValueError:
+            percentiles = None
+        if percentiles is None or any(p < 0 or p > 100 for p in percentiles):
+            return {"message": "The percentiles must be a comma separated list of numbers from 0 to 100."}, 400
 
-        data = query.all()
+        args = WaterwayReading.transform_input(**args)
+        return reading_stats.payload(
+            [loc.id for loc in args["locations"]],
+            [ms.id for ms in args["measures"]],
+            args["start_date"].date(),
+            args["end_date"].date(),
+            bucket,
+            [int(p) if p.is_integer() else p for p in percentiles]
+        ).response()
 
-        if data:
-            response = {"results": [row.json for row in data], "message": "Ok."}, 200
+    @staticmethod
+    def anomalies():
+        # readings that stand out from their neighbours (rolling median/mad) or from their whole series (z-score)
+        args = dict(request.args)
+        method = args.pop("method", "any")
+        if method not in anomaly_methods:
+            return {"message": f"The method must be one of {', '.join(anomaly_methods)}."}, 400
+        try:
+            limit = int(args.pop("limit")) if args.get("limit") else None
+        except ValueError:
+            limit = 0
+        if limit is not None and limit < 1:
+            return {"message": "The limit must be a positive number."}, 400
+
+        args = WaterwayReading.transform_input(**args)
+        return anomaly_detector.payload(
+            [loc.id for loc in args["locations"]],
+            [ms.id for ms in args["measures"]],
+            args["start_date"],
+            args["end_date"],
+            method,
+            limit
+        ).response()
+
+    @staticmethod
+    def propagation():
+        # sensors by distance to the waste dump, and how well each measure at one sensor tracks it at another some
+        # days, weeks or months later
+        args = dict(request.args)
+        bucket = args.pop("bucket", "day")
+        if bucket not in propagation_buckets:
+            return {"message": f"The bucket must be one of {', '.join(propagation_buckets)}."}, 400
+        try:
+            max_lag = int(args.pop("max_lag")) if args.get("max_lag") else None
+        except ValueError:
+            max_lag = -1
+        if max_lag is not None and not 0 <= max_lag <= 365:
+            return {"message": "The max_lag must be a number from 0 to 365."}, 400
+        detail = args.pop("detail", "N").upper() in ("Y", "1", "TRUE")
+
+        args = WaterwayReading.transform_input(**args)
+        return propagation.payload(
+            [loc.id for loc in args["locations"]],
+            [ms.id for ms in args["measures"]],
+            args["start_date"],
+            args["end_date"],
+            bucket,
+            max_lag,
+            detail
+        ).response()
+
+    @staticmethod
+    def frames(rows, chunk_size=50000):
+        # the rows of a search (rows(size) yields lists of at most size rows) as DataFrames of at most chunk_size rows. location and measure names are
+        # categoricals over every location and measure, so each frame's dictionary is the same.
+        import pandas
+
+        reference = reference_data.current()
+        locations = {location.id: location.display for location in reference.locations}
+        measures = {chemical.id: chemical.display for chemical in reference.chemicals}
+        location_dtype = pandas.CategoricalDtype(sorted(set(locations.values())))
+        measure_dtype = pandas.CategoricalDtype(sorted(set(measures.values())))
+
+        def frame(rows):
+            df = pandas.DataFrame.from_records(
+                rows, columns=["id", "value", "sample_date", "location_id", "measure_id"], coerce_float=True
+            )
+            df = df.astype({"id": "int64", "value": "float64", "location_id": "int64", "measure_id": "int64"})
+            df["sample_date"] = pandas.to_datetime(df["sample_date"], format="%Y-%m-%d")
+            df["location"] = df["location_id"].map(locations).astype(location_dtype)
+            df["measure"] = df["measure_id"].map(measures).astype(measure_dtype)
+            return df
+
+        empty = True
+        for chunk in rows(chunk_size):
+            empty = False
+            yield frame(chunk)
+        if empty:
+            yield frame([])
+
+    @staticmethod
+    def parse_cursor(cursor):
+        if not cursor:
+            return None
+        sample_date, id = cursor.split("_")
+        return datetime.datetime.strptime(sample_date, "%Y-%m-%d").date(), int(id)
+
+    @staticmethod
+    def stream(rows, limit=None, compact=False):
+        # the document is written a chunk of rows at a time, so the whole result is never held in memory. locations
+        # and measures are serialized once each, rather than through lazy loads for every row.
+        reference = reference_data.current()
+        if compact:
+            locations, measures = {}, {}
         else:
-            response = {"results": [], "message": "None found."}, 200
-        return response
+            locations = {location.id: json.dumps(reference.location_json(location)) for location in reference.locations}
+            measures = {chemical.id: json.dumps(reference.chemical_json(chemical)) for chemical in reference.chemicals}
+        seen_locations, seen_measures = set(), set()
+
+        yield '{"results": ['
+        count = 0
+        last = None
+        next_cursor = None
+        for partition in rows(1000):
+            chunk = []
+            for id, value, sample_date, location_id, chemical_id in partition:
+                if limit and count == limit:
+                    next_cursor = f"{last[1]}_{last[0]}"
+                    break
+                if compact:
+                    seen_locations.add(location_id)
+                    seen_measures.add(chemical_id)
+                    location, measure = location_id, chemical_id
+                else:
+                    location, measure = locations[location_id], measures[chemical_id]
+                chunk.append(
+                    f'{{"id": {id}, "value": {json.dumps(value)}, "sample_date": "{sample_date}", '
+                    f'"location": {location}, "measure": {measure}}}'
+                )
+                count += 1
+                last = (id, sample_date)
+            if chunk:
+                yield ("," if count > len(chunk) else "") + ",".join(chunk)
+
+        tail = {"message": "Ok." if count else "None found.", "next_cursor": next_cursor}
+        if compact:
+            tail["lookup"] = {
+                "locations": {id: reference.location_json(reference.location(id)) for id in sorted(seen_locations)},
+                "measures": {id: reference.chemical_json(reference.chemical(id)) for id in sorted(seen_measures)}
+            }
+        yield "], " + json.dumps(tail)[1:]
 
 
     @staticmethod
@@ -486,13 +874,15 @@ class WaterwayReading(db.Model):
 
         if "measures" not in exclude and kwargs.get("measures"):
             measures = ast.literal_eval(kwargs.get("measures"))
-            out_args["measures"] = Chemical.query.filter(Chemical.id.in_(measures)).all()
+            reference = reference_data.current()
+            out_args["measures"] = [c for c in (reference.chemical(m) for m in set(measures)) if c]
         else: 
             out_args["measures"] = []
 
         if "locations" not in exclude and kwargs.get("locations"):
             locations = ast.literal_eval(kwargs.get("locations"))
-            out_args["locations"] = Location.query.filter(Location.id.in_(locations)).all()
+            reference = reference_data.current()
+            out_args["locations"] = [l for l in (reference.location(i) for i in set(locations)) if l]
         else: 
             out_args["locations"] = []
 
@@ -523,3 +913,68 @@ class WaterwayReadingMaster(db.Model):
     chemical = db.Column(db.String(100))
     location = db.Column(db.String(100))
     sample_date = db.Column(db.Date)
+
+
+class DataVersion(db.Model):
+    __tablename__ = 'data_version'
+
+    name = db.Column(db.String(100), primary_key=True)
+    version = db.Column(db.Integer, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+    @staticmethod
+    def current(name="waterway_reading"):
+        # databases loaded before the loader kept version stamps have no table to read from
+        try:
+            version = db.session.query(DataVersion.version).filter_by(name=name).scalar()
+        except OperationalError:
+            db.session.rollback()
+            return 0
+        return version or 0
+
+
+class LoadedFile(db.Model):
+    __tablename__ = 'loaded_file'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(255), nullable=False)
+    checksum = db.Column(db.String(64), nullable=False, unique=True)
+    row_count = db.Column(db.Integer, nullable=False)
+    inserted_count = db.Column(db.Integer, nullable=False)
+    loaded_at = db.Column(db.DateTime, nullable=False)
+
+
+class ReadingChange(db.Model):
+    __tablename__ = 'reading_change'
+
+    id = db.Column(db.Integer, primary_key=True)
+    reading_id = db.Column(db.Integer, nullable=False)
+    location_id = db.Column(db.Integer, nullable=False)
+    chemical_id = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+
+    @staticmethod
+    def latest():
+        # databases that have never had readings ingested into them have no journal yet
+        try:
+            return db.session.query(func.max(ReadingChange.id)).scalar() or 0
+        except OperationalError:
+            db.session.rollback()
+            return 0
+
+    @staticmethod
+    def since(cursor, limit):
+        # the readings inserted after the given journal entry, oldest first. readings that were deleted again since
+        # are skipped.
+        try:
+            return db.session.query(
+                ReadingChange.id, WaterwayReading.id, WaterwayReading.location_id, WaterwayReading.chemical_id,
+                type_coerce(WaterwayReading.sample_date, db.String), type_coerce(WaterwayReading.value, db.Float)
+            ).join(
+                WaterwayReading, WaterwayReading.id == ReadingChange.reading_id
+            ).filter(
+                ReadingChange.id > cursor
+            ).order_by(ReadingChange.id).limit(limit).all()
+        except OperationalError:
+            db.session.rollback()
+            return []
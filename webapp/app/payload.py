@@ -0,0 +1,66 @@
+import gzip
+import hashlib
+import io
+import json
+from flask import request, current_app
+
+try:
+    import brotli
+except ImportError:  # gzip is always available
+    brotli = None
+
+
+def _gzip(body):
+    # mtime is fixed so the same body always compresses to the same bytes, and so keeps the same etag
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode="wb", compresslevel=9, mtime=0) as f:
+        f.write(body)
+    return buffer.getvalue()
+
+
+class Payload(object):
+    # a response body that is serialized and compressed once, then served to every request with a strong etag,
+    # 304 responses for matching If-None-Match headers, and the best encoding the client accepts
+
+    def __init__(self, body, mimetype="application/json", max_age=0):
+        if not isinstance(body, bytes):
+            body = body.encode("utf-8")
+        self.mimetype = mimetype
+        self.max_age = max_age
+        etag = hashlib.sha256(body).hexdigest()[:32]
+        self.variants = {
+            "identity": (body, etag),
+            "gzip": (_gzip(body), f"{etag}-gz"),
+        }
+        if brotli is not None:
+            self.variants["br"] = (brotli.compress(body, quality=11), f"{etag}-br")
+
+    @classmethod
+    def json(cls, obj, **kwargs):
+        return cls(json.dumps(obj, separators=(",", ":")), **kwargs)
+
+    def __len__(self):
+        return len(self.variants["identity"][0])
+
+    def response(self):
+        encodings = [encoding for encoding in ("br", "gzip") if encoding in self.variants]
+        encoding = request.accept_encodings.best_match(encodings, default="identity")
+        body, etag = self.variants[encoding]
+
+        response = current_app.response_class(mimetype=self.mimetype)
+        response.set_etag(etag)
+        response.vary.add("Accept-Encoding")
+        response.cache_control.public = True
+        if self.max_age:
+            response.cache_control.max_age = self.max_age
+        else:
+            response.cache_control.no_cache = True
+
+        if request.if_none_match.contains_weak(etag):
+            response.status_code = 304
+            return response
+
+        response.set_data(body)
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+        return response
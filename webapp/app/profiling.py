@@ -0,0 +1,195 @@
+import cProfile
+import datetime
+import logging
+import pathlib
+import random
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+try:
+    import pyinstrument
+except ImportError:  # cProfile is always available
+    pyinstrument = None
+
+logger = logging.getLogger("gunicorn.error")
+
+_local = threading.local()
+
+
+class Timings(object):
+    # what one request, or one chart job, spent its time on: named stages, and the number and duration of the sql
+    # statements it ran
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = OrderedDict()
+        self.queries = 0
+        self.sql = 0.0
+        self.statements = Counter()
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def repeated(self, threshold):
+        # statements run at least threshold times, the usual sign of a lazy load per row
+        return [(statement, count) for statement, count in self.statements.most_common() if count >= threshold]
+
+    def header(self):
+        metrics = [f'sql;dur={self.sql * 1000:.1f};desc="{self.queries} queries"']
+        metrics += [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items()]
+        metrics.append(f"total;dur={self.total() * 1000:.1f}")
+        return ", ".join(metrics)
+
+    def summary(self):
+        stages = " ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in self.stages.items())
+        return f"{self.queries} queries in {self.sql * 1000:.0f}ms {stages}".strip()
+
+
+def current():
+    return getattr(_local, "timings", None)
+
+
+@contextmanager
+def stage(name):
+    # times a block into the active request's or job's timings, and does nothing when instrumentation is off
+    timings = current()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - started)
+
+
+@contextmanager
+def recording():
+    # collects timings for the code run inside it on this thread, e.g. a chart job. yields None when
+    # instrumentation is off
+    if not instrumentation.enabled:
+        yield None
+        return
+    previous, _local.timings = current(), Timings()
+    try:
+        yield _local.timings
+    finally:
+        _local.timings = previous
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # kept on the statement's execution context rather than the connection, so a statement that raises leaves
+    # nothing behind for the next one on that pooled connection to be timed from
+    if current() is not None and context is not None:
+        context.query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timings = current()
+    started = getattr(context, "query_started", None)
+    if timings is not None and started is not None:
+        timings.sql += time.perf_counter() - started
+        timings.queries += 1
+        timings.statements[statement] += 1
+
+
+class Instrumentation(object):
+    # opt in per request timing. each request (and chart job) records named stages and counts its sql statements
+    # and their time, which are sent back in a Server-Timing header and logged for slow requests. a sampled share of
+    # requests, or any request carrying the profile token, is also profiled and the profile written to profile_dir.
+    # with profiling off, the cost is a few perf_counter calls per stage and statement.
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.sample_rate = 0.0
+        self.token = None
+        self.profile_dir = None
+        self.slow_ms = 1000
+        self.repeat_threshold = 10
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get("INSTRUMENTATION", self.enabled)
+        self.sample_rate = app.config.get("PROFILE_SAMPLE_RATE", self.sample_rate)
+        self.token = app.config.get("PROFILE_TOKEN", self.token)
+        self.slow_ms = app.config.get("SLOW_REQUEST_MS", self.slow_ms)
+        directory = app.config.get("PROFILE_DIR")
+        if directory:
+            self.profile_dir = pathlib.Path(directory)
+            try:
+                self.profile_dir.mkdir(parents=True, exist_ok=True)
+            except OSError:
+                logger.warning(f"Profile directory {directory} is not writable, profiling is off.")
+                self.profile_dir = None
+        if not self.enabled:
+            return
+
+        if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+            event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    def _wants_profile(self):
+        if self.profile_dir is None:
+            return False
+        if self.token and request.headers.get("X-Profile-Token") == self.token:
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def _before_request(self):
+        _local.timings = Timings()
+        g.profiler = None
+        if self._wants_profile():
+            if pyinstrument is not None:
+                g.profiler = pyinstrument.Profiler()
+                g.profiler.start()
+            else:
+                g.profiler = cProfile.Profile()
+                g.profiler.enable()
+
+    def _after_request(self, response):
+        # streamed bodies are still being produced after this, so their time is not in the total
+        timings = current()
+        if timings is None:
+            return response
+        profiler = g.pop("profiler", None)
+        if profiler is not None:
+            self._dump(profiler, timings)
+
+        response.headers["Server-Timing"] = timings.header()
+        elapsed = timings.total() * 1000
+        if elapsed >= self.slow_ms:
+            logger.warning(f"Slow request {request.method} {request.path} {elapsed:.0f}ms: {timings.summary()}")
+        for statement, count in timings.repeated(self.repeat_threshold):
+            logger.warning(f"{request.method} {request.path} ran the same statement {count} times: {statement[:200]}")
+        return response
+
+    def _teardown_request(self, exception=None):
+        _local.timings = None
+
+    def _dump(self, profiler, timings):
+        name = (request.endpoint or "unknown").replace(".", "-")
+        stem = f"{datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{name}-{timings.total() * 1000:.0f}ms"
+        if pyinstrument is not None and isinstance(profiler, pyinstrument.Profiler):
+            profiler.stop()
+            path = self.profile_dir / f"{stem}.html"
+            path.write_text(profiler.output_html())
+        else:
+            profiler.disable()
+            path = self.profile_dir / f"{stem}.prof"
+            profiler.dump_stats(str(path))
+        logger.info(f"Profile of {request.method} {request.path} written to {path}")
+
+
+instrumentation = Instrumentation()
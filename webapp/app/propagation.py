@@ -0,0 +1,206 @@
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from shapely.geometry import MultiPoint, Point
+from .columns import day_number
+from .payload import Payload
+from .refdata import reference_data
+from .stats import reading_stats, _bucket_starts
+
+logger = logging.getLogger("gunicorn.error")
+
+buckets = ("day", "week", "month")
+
+
+def _projected(locations, latitude):
+    # longitude/latitude as metres on a plane through the given latitude, close enough over a few kilometres for
+    # shapely's planar distances
+    scale = math.cos(math.radians(latitude))
+    return [Point(l.longitude * 111320 * scale, l.latitude * 110540) for l in locations]
+
+
+def dump_distances(reference):
+    # every sensor with its distance in metres to the nearest waste dump, nearest first. without a dump the sensors
+    # are listed by name with no distance.
+    sensors = list(reference.sensors)
+    dumps = [l for l in reference.locations if l.location_type and l.location_type.name == "WASTE"]
+    if not dumps or not sensors:
+        return [(sensor, None) for sensor in sensors]
+    latitude = sum(l.latitude for l in sensors + dumps) / len(sensors + dumps)
+    dump_area = MultiPoint(_projected(dumps, latitude))
+    distances = [point.distance(dump_area) for point in _projected(sensors, latitude)]
+    return sorted(zip(sensors, distances), key=lambda pair: pair[1])
+
+
+def bucketed_series(columns, location_ids, chemical_id, start_day, end_day, bucket):
+    # the mean reading of each sensor in each bucket between the two days, as a (sensors, buckets) matrix with nan
+    # where a sensor has no reading, from one bincount over every sensor's rows
+    axis = np.unique(_bucket_starts(np.arange(start_day, end_day + 1, dtype=np.int64), bucket))
+    sums = np.zeros(len(location_ids) * len(axis))
+    counts = np.zeros(len(location_ids) * len(axis))
+    pairs = [(location_id, chemical_id) for location_id in location_ids]
+    present = set(columns.series(location_ids, [chemical_id]))
+    for row, pair in enumerate(pairs):
+        if pair not in present:
+            continue
+        start, end = columns.rows(pair, start_day, end_day)
+        index = np.searchsorted(axis, _bucket_starts(np.asarray(columns.day[start:end], dtype=np.int64), bucket))
+        index += row * len(axis)
+        sums += np.bincount(index, weights=columns.value[start:end], minlength=len(sums))
+        counts += np.bincount(index, minlength=len(counts))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (sums / counts).reshape(len(location_ids), len(axis))
+
+
+def lagged_correlations(series, max_lag, min_periods):
+    # r[i, j, lag] is the pearson correlation of sensor i's series with sensor j's series lag buckets later, over the
+    # buckets both have a reading in. each lag is six matrix products over every pair of sensors at once: counts,
+    # sums and sums of squares and products, with missing buckets masked to zero.
+    sensors, length = series.shape
+    present = ~np.isnan(series)
+    values = np.where(present, series, 0.0)
+    present = present.astype(np.float64)
+    r = np.full((sensors, sensors, max_lag + 1), np.nan)
+    overlap = np.zeros((sensors, sensors, max_lag + 1), dtype=np.int64)
+    for lag in range(min(max_lag, length - 1) + 1):
+        a, ma = values[:, :length - lag], present[:, :length - lag]
+        b, mb = values[:, lag:], present[:, lag:]
+        n = ma @ mb.T
+        sum_a, sum_b = a @ mb.T, ma @ b.T
+        sum_aa, sum_bb = (a * a) @ mb.T, ma @ (b * b).T
+        sum_ab = a @ b.T
+        with np.errstate(invalid="ignore", divide="ignore"):
+            covariance = n * sum_ab - sum_a * sum_b
+            spread = np.sqrt(np.clip(n * sum_aa - sum_a ** 2, 0, None) * np.clip(n * sum_bb - sum_b ** 2, 0, None))
+            correlation = np.where((n >= min_periods) & (spread > 0), covariance / spread, np.nan)
+        r[:, :, lag] = np.clip(correlation, -1, 1)
+        overlap[:, :, lag] = np.rint(n).astype(np.int64)
+    return r, overlap
+
+
+class Propagation(object):
+    # dump distances and lagged correlations of every measure between every pair of sensors, for one data version,
+    # date range and bucket size
+
+    def __init__(self, columns, reference, start_day, end_day, bucket, max_lag, min_periods):
+        self.version = columns.version
+        self.bucket = bucket
+        self.max_lag = max_lag
+        # the compressed responses built from it, by location, measure and detail filters, see PropagationCache
+        self.payloads = OrderedDict()
+        self.sensors = dump_distances(reference)
+        location_ids = [sensor.id for sensor, _ in self.sensors]
+        self.measures = {}
+        for chemical in reference.chemicals:
+            if not columns.series(location_ids, [chemical.id]):
+                continue
+            series = bucketed_series(columns, location_ids, chemical.id, start_day, end_day, bucket)
+            self.measures[chemical.id] = lagged_correlations(series, max_lag, min_periods)
+
+    def json(self, location_ids, measure_ids, detail=False):
+        # the rows and columns of the matrices are the sensors in order of distance, limited to the given ones
+        def rounded(values):
+            if isinstance(values, list):
+                return [rounded(v) for v in values]
+            return None if values != values else round(values, 3)
+
+        kept = [i for i, (sensor, _) in enumerate(self.sensors) if not location_ids or sensor.id in location_ids]
+        results = []
+        for chemical_id, (r, overlap) in self.measures.items():
+            if measure_ids and chemical_id not in measure_ids:
+                continue
+            r, overlap = r[np.ix_(kept, kept)], overlap[np.ix_(kept, kept)]
+            with np.errstate(invalid="ignore"):
+                best = np.where(np.isnan(r).all(axis=2, keepdims=True), 0, np.nan_to_num(r, nan=-np.inf))
+                peak_lag = best.argmax(axis=2)
+            peak_r = np.take_along_axis(r, peak_lag[:, :, None], axis=2)[:, :, 0]
+            result = {
+                "measure": chemical_id,
+                "peak_r": rounded(peak_r.tolist()),
+                "peak_lag": np.where(np.isnan(peak_r), -1, peak_lag).tolist(),
+                "overlap": overlap[:, :, 0].tolist(),
+            }
+            if detail:
+                result["r"] = rounded(r.tolist())
+            results.append(result)
+        return {
+            "version": self.version,
+            "sensors": [
+                {
+                    "location": sensor.id,
+                    "display": sensor.display,
+                    "distance_m": None if distance is None else round(distance, 1)
+                }
+                for sensor, distance in (self.sensors[i] for i in kept)
+            ],
+            "message": "Ok." if results else "None found.",
+            "results": results,
+        }
+
+
+class PropagationCache(object):
+    # keeps the propagation analysis of the last cache_size distinct date ranges, bucket sizes and lags, each until
+    # the reading or reference data changes, so it is computed once per data refresh rather than once per request.
+    # the last cache_size compressed responses of each are kept with it, so they go with it too.
+
+    def __init__(self, app=None):
+        self.max_lag = 30
+        self.min_periods = 10
+        self.cache_size = 16
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_lag = app.config.get("PROPAGATION_MAX_LAG", self.max_lag)
+        self.min_periods = app.config.get("PROPAGATION_MIN_PERIODS", self.min_periods)
+        self.cache_size = app.config.get("PROPAGATION_CACHE_SIZE", self.cache_size)
+
+    def get(self, start_date, end_date, bucket, max_lag=None):
+        columns = reading_stats.current()
+        reference = reference_data.current()
+        max_lag = self.max_lag if max_lag is None else max_lag
+        start_day, end_day = day_number(start_date), day_number(end_date)
+        key = (columns.version, reference.version, start_day, end_day, bucket, max_lag, self.min_periods)
+        # computed under the lock, so analysts asking for the same range at once share one computation
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None:
+                self._results.move_to_end(key)
+                return result
+            started = time.perf_counter()
+            result = self._results[key] = Propagation(
+                columns, reference, start_day, end_day, bucket, max_lag, self.min_periods
+            )
+            while len(self._results) > self.cache_size:
+                self._results.popitem(last=False)
+        logger.info(
+            f"Propagation of {len(result.measures)} measure(s) between {len(result.sensors)} sensors by {bucket} "
+            f"computed in {time.perf_counter() - started:.2f}s."
+        )
+        return result
+
+    def payload(self, location_ids, measure_ids, start_date, end_date, bucket="day", max_lag=None, detail=False):
+        result = self.get(start_date, end_date, bucket, max_lag)
+        key = (tuple(sorted(set(location_ids))), tuple(sorted(set(measure_ids))), bool(detail))
+        with self._lock:
+            payload = result.payloads.get(key)
+            if payload is not None:
+                result.payloads.move_to_end(key)
+                return payload
+
+        document = result.json(set(location_ids), set(measure_ids), detail)
+        document.update({"bucket": result.bucket, "max_lag": result.max_lag})
+        payload = Payload.json(document)
+        with self._lock:
+            result.payloads[key] = payload
+            while len(result.payloads) > self.cache_size:
+                result.payloads.popitem(last=False)
+        return payload
+
+
+propagation = PropagationCache()
@@ -0,0 +1,96 @@
+from sqlalchemy import Date, Float, Integer, Numeric, String, and_, column, or_, select, table, type_coerce
+
+# the reading queries the web app runs against sqlite, built on bare table definitions rather than the models so that
+# scripts/db-init.py -e can check their plans without importing flask and the rest of the app
+
+waterway_reading = table(
+    "waterway_reading",
+    column("id", Integer),
+    column("value", Numeric),
+    column("chemical_id", Integer),
+    column("location_id", Integer),
+    column("sample_date", Date),
+)
+location = table(
+    "location",
+    column("id", Integer),
+    column("display", String),
+    column("longitude", Numeric),
+    column("latitude", Numeric),
+)
+chemical = table(
+    "chemical",
+    column("id", Integer),
+    column("display", String),
+    column("unit_of_measure_id", Integer),
+)
+unit_of_measure = table(
+    "unit_of_measure",
+    column("id", Integer),
+    column("unit_name", String),
+)
+
+
+def chart_readings(location_ids, measure_ids, start_date, end_date):
+    # Plotter.retrieve_data: one parameterized query for every measure and location, rather than one query per pair
+    reading = waterway_reading.c
+    query = select(
+        reading.id,
+        location.c.display.label("location"),
+        type_coerce(location.c.longitude, Float).label("longitude"),
+        type_coerce(location.c.latitude, Float).label("latitude"),
+        type_coerce(reading.sample_date, String).label("sample_date"),
+        type_coerce(reading.value, Float).label("value"),
+        (chemical.c.display + "(" + unit_of_measure.c.unit_name + ")").label("measure"),
+        unit_of_measure.c.unit_name.label("unit"),
+    ).select_from(
+        waterway_reading.join(
+            chemical, reading.chemical_id == chemical.c.id
+        ).join(
+            location, reading.location_id == location.c.id
+        ).join(
+            unit_of_measure, chemical.c.unit_of_measure_id == unit_of_measure.c.id
+        )
+    ).where(
+        # as dates, since a datetime bound sorts after the text of its own day and left that day out
+        reading.sample_date.between(start_date, end_date)
+    )
+
+    if location_ids:
+        query = query.where(reading.location_id.in_(location_ids))
+    if measure_ids:
+        query = query.where(reading.chemical_id.in_(measure_ids))
+    # Plotter.columns_frame slices the column store's series in this order too, so both return the same frame
+    return query.order_by(reading.chemical_id, reading.location_id, reading.sample_date, reading.id)
+
+
+def search_readings(location_ids, measure_ids, start_date, end_date, cursor=None, limit=None):
+    # WaterwayReading.search: a page of readings in (sample_date, id) order
+    reading = waterway_reading.c
+    query = select(
+        reading.id,
+        type_coerce(reading.value, Float),
+        type_coerce(reading.sample_date, String),
+        reading.location_id,
+        reading.chemical_id
+    ).where(
+        reading.sample_date.between(start_date, end_date)
+    )
+
+    if location_ids:
+        query = query.where(reading.location_id.in_(location_ids))
+    if measure_ids:
+        query = query.where(reading.chemical_id.in_(measure_ids))
+
+    # keyset pagination: each page starts after the (sample_date, id) of the last row of the previous one
+    if cursor:
+        query = query.where(
+            or_(
+                reading.sample_date > cursor[0],
+                and_(reading.sample_date == cursor[0], reading.id > cursor[1])
+            )
+        )
+    query = query.order_by(reading.sample_date, reading.id)
+    if limit:
+        query = query.limit(limit)
+    return query
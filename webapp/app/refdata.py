@@ -0,0 +1,164 @@
+import threading
+import time
+from collections import namedtuple
+from types import MappingProxyType
+from flask import url_for
+from sqlalchemy import type_coerce
+from .payload import Payload
+
+LocationTypeRef = namedtuple("LocationTypeRef", ["id", "name", "description"])
+LocationRef = namedtuple("LocationRef", ["id", "name", "display", "longitude", "latitude", "location_type"])
+ChemicalRef = namedtuple("ChemicalRef", ["id", "name", "display", "unit"])
+
+
+def _id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ReferenceData(object):
+    # an immutable snapshot of the location, location type, chemical and unit of measure tables
+
+    def __init__(self, version, locations, chemicals):
+        self.version = version
+        self.locations = tuple(sorted(locations, key=lambda l: l.id))
+        self.chemicals = tuple(sorted(chemicals, key=lambda c: c.id))
+        self.sensors = tuple(sorted(
+            (l for l in self.locations if l.location_type.name == "SENSOR"), key=lambda l: l.name
+        ))
+        self._locations = MappingProxyType({l.id: l for l in self.locations})
+        self._location_names = MappingProxyType({l.name: l for l in self.locations})
+        self._chemicals = MappingProxyType({c.id: c for c in self.chemicals})
+        self._features = {}
+        self._collections = {}
+        self._payloads = {}
+
+    def location(self, id):
+        return self._locations.get(_id(id))
+
+    def location_by_name(self, name):
+        return self._location_names.get(str(name).upper())
+
+    def chemical(self, id):
+        return self._chemicals.get(_id(id))
+
+    def chemical_json(self, chemical):
+        return {
+            "id": chemical.id,
+            "name": chemical.name,
+            "display": chemical.display,
+            "unit": chemical.unit,
+            "uri": f"/rest/measure/{chemical.id}"
+        }
+
+    def location_json(self, location):
+        # built on first use, since the icon urls need an application context
+        feature = self._features.get(location.id)
+        if feature is None:
+            feature = self._features[location.id] = {
+                "type": "Feature",
+                "properties": {
+                    "id": location.id,
+                    "name": location.name,
+                    "display": location.display,
+                    "type": {
+                        "id": location.location_type.id,
+                        "name": location.location_type.name,
+                        "description": location.location_type.description
+                    },
+                    "uri": f"/rest/location/{location.id}"
+                },
+                "geometry": {
+                    "type": "Point",
+                    "coordinates": [location.longitude, location.latitude]
+                },
+                "icon": {
+                    "iconUrl": url_for("static", filename=("icons/" + ("waste.png" if location.location_type.name == "WASTE" else "sensor.png"))),
+                    "iconSize": [30, 30],
+                    "latlng": [location.latitude, location.longitude]
+                },
+                "style": {
+                    "color": "red" if location.location_type.name == "SENSOR" else "green"
+                }
+            }
+        return feature
+
+    def feature_collection(self, include_waste=True):
+        collection = self._collections.get(include_waste)
+        if collection is None:
+            locations = self.locations if include_waste else [
+                l for l in self.locations if l.location_type.name == "SENSOR"
+            ]
+            collection = self._collections[include_waste] = {
+                "type": "FeatureCollection",
+                "name": "sensor-locations",
+                "features": [self.location_json(location) for location in locations]
+            }
+        return collection
+
+    def feature_collection_payload(self, include_waste=True):
+        # serialized and compressed once per snapshot, so its etag changes only when the reference data does
+        payload = self._payloads.get(include_waste)
+        if payload is None:
+            payload = self._payloads[include_waste] = Payload.json(self.feature_collection(include_waste))
+        return payload
+
+
+class ReferenceCache(object):
+    # process wide holder of the current ReferenceData. the "reference" data version, which the loaders bump when
+    # they add locations or chemicals, is checked at most once every check_interval seconds.
+
+    def __init__(self, app=None):
+        self.check_interval = 5
+        self._data = None
+        self._checked = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.check_interval = app.config.get("REFERENCE_DATA_CHECK_INTERVAL", self.check_interval)
+
+    def current(self):
+        if self._data is None or time.monotonic() - self._checked > self.check_interval:
+            with self._lock:
+                if self._data is None or time.monotonic() - self._checked > self.check_interval:
+                    self._refresh()
+        return self._data
+
+    def invalidate(self):
+        with self._lock:
+            self._data = None
+
+    def _refresh(self):
+        from .models import db, DataVersion, Location, LocationType, Chemical, UnitOfMeasure
+
+        version = DataVersion.current("reference")
+        if self._data is None or self._data.version != version:
+            location_types = {
+                id: LocationTypeRef(id, name, description)
+                for id, name, description in db.session.query(
+                    LocationType.id, LocationType.name, LocationType.description
+                )
+            }
+            locations = [
+                LocationRef(id, name, display, float(longitude), float(latitude), location_types.get(location_type_id))
+                for id, name, display, longitude, latitude, location_type_id in db.session.query(
+                    # as the stored floats, since Numeric rounds them to 10 places and charts read them unrounded
+                    Location.id, Location.name, Location.display, type_coerce(Location.longitude, db.Float),
+                    type_coerce(Location.latitude, db.Float), Location.location_type_id
+                )
+            ]
+            chemicals = [
+                ChemicalRef(id, name, display, unit.decode() if isinstance(unit, bytes) else unit)
+                for id, name, display, unit in db.session.query(
+                    Chemical.id, Chemical.name, Chemical.display, UnitOfMeasure.unit_name
+                ).outerjoin(UnitOfMeasure, Chemical.unit_of_measure_id == UnitOfMeasure.id)
+            ]
+            self._data = ReferenceData(version, locations, chemicals)
+        self._checked = time.monotonic()
+
+
+reference_data = ReferenceCache()
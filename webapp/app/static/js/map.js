@@ -28,6 +28,8 @@ let wasteLayer;
 let sensorLayer;
 let maxZoom;
 let rivers, lakes;
+// the server simplifies the layers to what is visible at each zoom level, so they are fetched again as it changes
+let layerZoom = mymap.getZoom();
 
 let imageUrl = "/static/images/waterways_map.jpg",
     imageBounds = rasterBounds;
@@ -97,19 +99,21 @@ $.get(
     layerControl.addOverlay(wasteLayer, "Kasios Dumping Location");
     layerControl.addOverlay(ogMap, "Original Map");
     $.get(
-        "/static/data/lakes.geojson", 
+        "/layers/lakes?zoom=" + mymap.getZoom(), 
         function(data) {
-            lakes = L.geoJSON(JSON.parse(data), {});
-            lakes.setStyle({"fillColor":"blue", "fillOpacity": 1, "color": "blue", "weight": 1});
+            lakes = L.geoJSON(parseLayer(data), {
+                "style": {"fillColor":"blue", "fillOpacity": 1, "color": "blue", "weight": 1}
+            });
         }
     ).done(function() {
         lakes.addTo(mymap);
         layerControl.addOverlay(lakes, "Lakes");
         $.get(
-            "/static/data/rivers.geojson", 
+            "/layers/rivers?zoom=" + mymap.getZoom(), 
             function(data) {
-                rivers = L.geoJSON(JSON.parse(data), {});
-                rivers.setStyle({"weight": 2, "color": "blue"});
+                rivers = L.geoJSON(parseLayer(data), {
+                    "style": {"weight": 2, "color": "blue"}
+                });
             }
         ).done(function() {
             rivers.addTo(mymap);
@@ -119,10 +123,32 @@ $.get(
             mymap.setMaxBounds(bounds.pad(1));
             
             mymap.setMinZoom(mymap.getZoom());
+            reloadLayers();
+            mymap.on("zoomend", reloadLayers);
         });
     });
 });
 
+function parseLayer(data) {
+    return typeof data === "string" ? JSON.parse(data) : data;
+}
+
+function reloadLayers() {
+    let zoom = mymap.getZoom();
+    if (zoom === layerZoom) {
+        return;
+    }
+    layerZoom = zoom;
+    $.each({"lakes": lakes, "rivers": rivers}, function(name, layer) {
+        $.get("/layers/" + name + "?zoom=" + zoom, function(data) {
+            if (zoom === layerZoom) {
+                layer.clearLayers();
+                layer.addData(parseLayer(data));
+            }
+        });
+    });
+}
+
 $("#measure-search").select2({
     "ajax": {
         "url": "/rest/measures"
@@ -150,6 +176,57 @@ $("select").on("select2:select", function (evt) {
 
 
 
+// charts are rendered as jobs: posting the form returns a job id, progress arrives over socket.io and the finished
+// chart is fetched from /chart/job/<id>. without a socket connection the job is polled instead.
+let socket = typeof io === "function" ? io() : null;
+let chartJob = null;
+let generateLabel = $("#generate").html();
+
+function chartDone() {
+    chartJob = null;
+    $("#generate").html(generateLabel);
+    $("#generate").prop("disabled", false);
+}
+
+function loadChart(id) {
+    $.ajax({
+        type: "GET",
+        url: "/chart/job/" + id,
+        success: function(data, status, xhr) {
+            if (xhr.status === 202) {
+                // still running, and no socket to say when it is done
+                setTimeout(function() { if (chartJob === id) loadChart(id); }, 1000);
+                return;
+            }
+            let resolution = xhr.getResponseHeader("X-Chart-Resolution");
+            bootbox.alert(resolution && resolution !== "raw" ? "Success (" + resolution + " resolution)" : "Success");
+            $("#chart").empty();
+            $("#chart").html(data);
+            chartDone();
+        },
+        error: function(xhr, status, error) {
+            bootbox.alert(JSON.parse(xhr.responseText).message);
+            chartDone();
+        }
+    });
+}
+
+if (socket) {
+    socket.on("chart_job", function(job) {
+        if (job.id !== chartJob) {
+            return;
+        }
+        if (job.status === "done") {
+            loadChart(job.id);
+        } else if (job.status === "failed") {
+            bootbox.alert(job.message);
+            chartDone();
+        } else {
+            $("#generate").text((job.stage || job.status) + " " + Math.round(job.progress * 100) + "%");
+        }
+    });
+}
+
 $("#generate").click(function() {
     let chartType = $("#chart-type").val();
 
@@ -178,16 +255,21 @@ $("#generate").click(function() {
             $("#report-img").attr("src", "");
             $("#generate").prop("disabled", true);
         }, 
-        success: function(data) {
-            bootbox.alert("Success");
-            $("#chart").empty();
-            $("#chart").html(data);
+        success: function(job) {
+            chartJob = job.id;
+            if (job.status === "done") {
+                loadChart(job.id);
+            } else if (socket && socket.connected) {
+                $("#generate").text(job.status);
+                socket.emit("watch_chart_job", {"id": job.id});
+            } else {
+                $("#generate").text(job.status);
+                loadChart(job.id);
+            }
         }, 
         error: function(xhr, status, error) {
             bootbox.alert(JSON.parse(xhr.responseText).message);
-        },
-        complete: function() {
-            $("#generate").prop("disabled", false);
+            chartDone();
         }
     });
 });
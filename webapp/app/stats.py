@@ -0,0 +1,182 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from sqlalchemy import type_coerce
+from .payload import Payload
+from .columns import ReadingColumns, column_store
+
+logger = logging.getLogger("gunicorn.error")
+
+buckets = ("day", "week", "month", "year")
+default_percentiles = (25, 50, 75)
+
+
+def _bucket_starts(day, bucket):
+    # the first day of the bucket each day falls in, as days since 1970-01-01. weeks start on monday, and the epoch
+    # was a thursday.
+    if bucket == "day":
+        return day
+    if bucket == "week":
+        return (day - 4) // 7 * 7 + 4
+    unit = "M" if bucket == "month" else "Y"
+    return day.astype("datetime64[D]").astype(f"datetime64[{unit}]").astype("datetime64[D]").astype(np.int64)
+
+
+def _floats(values):
+    # six significant digits are more than the readings carry, and keep the document small
+    return [None if v != v else float(f"{v:.6g}") for v in values.tolist()]
+
+
+def aggregate(columns, pairs, start_day, end_day, bucket, percentiles):
+    # count, mean, min, max, sample standard deviation and percentiles of each series in each bucket. the rows of a
+    # series are already in date order, so the groups are runs of equal (series, bucket) and no sort is needed
+    # except within groups for the percentiles.
+    ranges = columns.ranges(pairs, start_day, end_day)
+    if not ranges:
+        return []
+    series = np.repeat(np.arange(len(ranges)), [end - start for _, start, end in ranges])
+    values = columns.take(ranges, "value")
+    starts_of = _bucket_starts(columns.take(ranges, "day").astype(np.int64), bucket)
+
+    changed = np.r_[True, (series[1:] != series[:-1]) | (starts_of[1:] != starts_of[:-1])]
+    boundaries = np.flatnonzero(changed)
+    group = np.cumsum(changed) - 1
+    count = np.diff(np.r_[boundaries, len(values)])
+    mean = np.add.reduceat(values, boundaries) / count
+    squares = np.add.reduceat((values - mean[group]) ** 2, boundaries)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        std = np.where(count > 1, np.sqrt(squares / (count - 1)), np.nan)
+    stats = {
+        "count": count.tolist(),
+        "mean": _floats(mean),
+        "min": _floats(np.minimum.reduceat(values, boundaries)),
+        "max": _floats(np.maximum.reduceat(values, boundaries)),
+        "std": _floats(std),
+    }
+
+    if percentiles:
+        # values sorted within each group, then linear interpolation between the two closest ranks, as numpy does
+        ordered = values[np.lexsort((values, group))]
+        for percentile in percentiles:
+            rank = boundaries + (count - 1) * (percentile / 100.0)
+            low = np.floor(rank).astype(np.int64)
+            high = np.minimum(low + 1, boundaries + count - 1)
+            fraction = rank - low
+            stats[f"p{percentile:g}"] = _floats(ordered[low] + (ordered[high] - ordered[low]) * fraction)
+
+    labels = np.array(starts_of[boundaries], dtype="datetime64[D]").astype(str).tolist()
+    edges = np.searchsorted(series[boundaries], np.arange(len(ranges) + 1))
+    results = []
+    for i, (pair, _, _) in enumerate(ranges):
+        first, last = edges[i], edges[i + 1]
+        result = {"location": pair[0], "measure": pair[1], "bucket_start": labels[first:last]}
+        result.update({name: column[first:last] for name, column in stats.items()})
+        results.append(result)
+    return results
+
+
+class ReadingStats(object):
+    # time bucketed statistics for /rest/stats, computed from a columnar copy of the readings: the column store when
+    # it is current, otherwise one built in memory. the copy is replaced when the waterway_reading data version
+    # changes, checked at most once every check_interval seconds, and requests keep being answered from the previous
+    # copy while a new one is built. the compressed responses of the last cache_size distinct queries are kept per
+    # data version.
+
+    def __init__(self, app=None):
+        self.check_interval = 5
+        self.cache_size = 128
+        self._columns = None
+        self._checked = 0
+        self._lock = threading.Lock()
+        self._payloads = OrderedDict()
+        self._payload_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.check_interval = app.config.get("STATS_CHECK_INTERVAL", self.check_interval)
+        self.cache_size = app.config.get("STATS_CACHE_SIZE", self.cache_size)
+
+    def current(self):
+        if self._columns is None or time.monotonic() - self._checked > self.check_interval:
+            # only the first build makes requests wait, later ones are done by whichever request gets the lock
+            if self._lock.acquire(blocking=self._columns is None):
+                try:
+                    if self._columns is None or time.monotonic() - self._checked > self.check_interval:
+                        self._refresh()
+                finally:
+                    self._lock.release()
+        return self._columns
+
+    def _refresh(self):
+        from .models import DataVersion
+
+        version = DataVersion.current()
+        if self._columns is None or self._columns.version != version:
+            store = column_store.current()
+            if store is not None and store.version == version:
+                # the loader wrote the same columns already, and they are shared with the other workers
+                self._columns = store
+            else:
+                self._columns = self._build(version)
+            with self._payload_lock:
+                self._payloads.clear()
+        self._checked = time.monotonic()
+
+    def _build(self, version):
+        from .models import db, WaterwayReading
+
+        started = time.perf_counter()
+        query = db.session.query(
+            WaterwayReading.id,
+            WaterwayReading.location_id,
+            WaterwayReading.chemical_id,
+            type_coerce(WaterwayReading.sample_date, db.String),
+            type_coerce(WaterwayReading.value, db.Float)
+        )
+        cursor = db.session.connection().connection.cursor()
+        try:
+            cursor.execute(str(query.statement.compile(dialect=db.engine.dialect)))
+            columns = ReadingColumns.read(version, cursor)
+        finally:
+            cursor.close()
+        logger.info(
+            f"Reading statistics built from {len(columns)} readings in {time.perf_counter() - started:.2f}s "
+            f"(data version {version})."
+        )
+        return columns
+
+    def payload(self, location_ids, chemical_ids, start_date, end_date, bucket, percentiles):
+        columns = self.current()
+        key = (
+            columns.version, tuple(sorted(location_ids)), tuple(sorted(chemical_ids)), start_date, end_date, bucket,
+            tuple(percentiles)
+        )
+        with self._payload_lock:
+            payload = self._payloads.get(key)
+            if payload is not None:
+                self._payloads.move_to_end(key)
+                return payload
+
+        start_day = np.datetime64(start_date, "D").astype(np.int64)
+        end_day = np.datetime64(end_date, "D").astype(np.int64)
+        series = aggregate(
+            columns, columns.series(location_ids, chemical_ids), start_day, end_day, bucket, percentiles
+        )
+        payload = Payload.json({
+            "bucket": bucket,
+            "percentiles": list(percentiles),
+            "version": columns.version,
+            "message": "Ok." if series else "None found.",
+            "results": series,
+        })
+        with self._payload_lock:
+            self._payloads[key] = payload
+            while len(self._payloads) > self.cache_size:
+                self._payloads.popitem(last=False)
+        return payload
+
+
+reading_stats = ReadingStats()